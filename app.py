@@ -14,13 +14,12 @@ from pathlib import Path
 
 # Конфигурация
 BACKEND_PORT = 8000
-FRONTEND_PORT = 3000
+FRONTEND_PATH = "/app/"  # Фронтенд раздается самим бэкендом (settings.static_url)
 PROJECT_ROOT = Path(__file__).parent
 
 class ProjectLauncher:
     def __init__(self):
         self.backend_process = None
-        self.frontend_process = None
         
     def check_dependencies(self):
         """Проверка зависимостей"""
@@ -38,12 +37,6 @@ class ProjectLauncher:
             print("❌ pip не найден")
             return False
             
-        # Проверка Node.js (опционально)
-        try:
-            subprocess.run(['python', '-m', 'http.server', '--help'], check=True, capture_output=True)
-        except:
-            print("⚠️ http.server недоступен, используем альтернативный метод")
-            
         print("✅ Зависимости проверены")
         return True
         
@@ -63,7 +56,7 @@ class ProjectLauncher:
             env_content = f"""# CrazyGift Backend Configuration
 DATABASE_URL=sqlite:///./crazygift.db
 SECRET_KEY=crazygift_secret_key_2025
-CORS_ORIGINS=http://localhost:{FRONTEND_PORT},http://127.0.0.1:{FRONTEND_PORT},file://
+CORS_ORIGINS=http://localhost:{BACKEND_PORT},http://127.0.0.1:{BACKEND_PORT},file://
 TELEGRAM_BOT_TOKEN=your_bot_token_here
 
 # TON Blockchain
@@ -89,6 +82,15 @@ PORT={BACKEND_PORT}
                 print("✅ Python зависимости установлены")
             except subprocess.CalledProcessError:
                 print("⚠️ Ошибка установки зависимостей, продолжаем...")
+        
+        # Миграции и тестовые данные (сервер при старте только проверяет схему)
+        admin = [sys.executable, 'crazygift-admin']
+        try:
+            subprocess.run(admin + ['migrate'], check=True, cwd=backend_path)
+            subprocess.run(admin + ['seed'], check=True, cwd=backend_path)
+        except subprocess.CalledProcessError:
+            print("❌ Ошибка миграции базы данных")
+            return False
                 
         return True
         
@@ -142,35 +144,9 @@ PORT={BACKEND_PORT}
             print(f"❌ Ошибка запуска бэкенда: {e}")
             return False
             
-    def start_frontend(self):
-        """Запуск фронтенда"""
-        frontend_path = PROJECT_ROOT / "frontend"
-        
-        print(f"🎨 Запуск фронтенда на порту {FRONTEND_PORT}...")
-        
-        try:
-            # Используем встроенный HTTP сервер Python
-            self.frontend_process = subprocess.Popen([
-                sys.executable, '-m', 'http.server', str(FRONTEND_PORT)
-            ], cwd=frontend_path)
-            
-            # Ждем запуска
-            time.sleep(2)
-            
-            if self.frontend_process.poll() is None:
-                print(f"✅ Фронтенд запущен (PID: {self.frontend_process.pid})")
-                return True
-            else:
-                print("❌ Фронтенд не запустился")
-                return False
-                
-        except Exception as e:
-            print(f"❌ Ошибка запуска фронтенда: {e}")
-            return False
-            
     def open_browser(self):
         """Открытие браузера"""
-        url = f"http://localhost:{FRONTEND_PORT}"
+        url = f"http://localhost:{BACKEND_PORT}{FRONTEND_PATH}"
         print(f"🌐 Открытие браузера: {url}")
         
         def open_delayed():
@@ -189,7 +165,7 @@ PORT={BACKEND_PORT}
         print("🎰 CrazyGift Project Status")
         print("="*50)
         print(f"🔧 Backend:  http://localhost:{BACKEND_PORT}")
-        print(f"🎨 Frontend: http://localhost:{FRONTEND_PORT}")
+        print(f"🎨 Frontend: http://localhost:{BACKEND_PORT}{FRONTEND_PATH}")
         print(f"📚 API Docs: http://localhost:{BACKEND_PORT}/docs")
         print("="*50)
         print("🔥 Проект запущен успешно!")
@@ -209,15 +185,6 @@ PORT={BACKEND_PORT}
                 self.backend_process.kill()
                 print("🔨 Бэкенд принудительно остановлен")
                 
-        if self.frontend_process:
-            self.frontend_process.terminate()
-            try:
-                self.frontend_process.wait(timeout=5)
-                print("✅ Фронтенд остановлен")
-            except:
-                self.frontend_process.kill()
-                print("🔨 Фронтенд принудительно остановлен")
-                
     def run(self):
         """Главная функция запуска"""
         print("🎰 CrazyGift Project Launcher")
@@ -239,11 +206,6 @@ PORT={BACKEND_PORT}
             if not self.start_backend():
                 return False
                 
-            # Запуск фронтенда
-            if not self.start_frontend():
-                self.cleanup()
-                return False
-                
             # Открытие браузера
             self.open_browser()
             
@@ -258,9 +220,6 @@ PORT={BACKEND_PORT}
                     if self.backend_process.poll() is not None:
                         print("❌ Бэкенд упал!")
                         break
-                    if self.frontend_process.poll() is not None:
-                        print("❌ Фронтенд упал!")
-                        break
                         
             except KeyboardInterrupt:
                 print("\n👋 Получен сигнал остановки")
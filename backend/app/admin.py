@@ -0,0 +1,159 @@
+"""
+crazygift-admin - административные команды
+
+    crazygift-admin migrate [revision]   применить миграции (по умолчанию head)
+    crazygift-admin seed                 загрузить тестовые кейсы
+    crazygift-admin status               текущая и последняя ревизия схемы
+    crazygift-admin reap                 один проход очистки зависших депозитов
+    crazygift-admin rebuild-summary [id] пересчитать сводку инвентаря (всех или одного пользователя)
+    crazygift-admin rebuild-referrals [id] пересчитать итоги по рефералам (всех или одного реферера)
+
+Запуск из папки backend: ./crazygift-admin <команда> или python -m app.admin <команда>
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from typing import Optional
+
+from alembic import command
+
+from .config import settings
+from .schema import alembic_config, current_revision, head_revision
+
+
+def migrate(revision: str = "head"):
+    """Применить миграции Alembic"""
+    start = time.perf_counter()
+    print(f"🗄️  Migrating {settings.database_url.split('://')[0]} to {revision}...")
+
+    command.upgrade(alembic_config(), revision)
+
+    print(f"✅ Migrated in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+
+async def seed():
+    """Загрузить тестовые данные"""
+    from .database import close_db
+    from .fixtures import load_test_data
+
+    try:
+        created = await load_test_data()
+    finally:
+        await close_db()
+
+    if created:
+        print(f"✅ Created {created} test cases")
+    else:
+        print("Test data already exists, skipping")
+
+
+async def status() -> bool:
+    """Показать состояние схемы"""
+    from .database import engine
+
+    try:
+        current = await current_revision(engine)
+    finally:
+        await engine.dispose()
+
+    head = head_revision()
+    print(f"Current revision: {current or 'none'}")
+    print(f"Head revision:    {head}")
+
+    if current == head:
+        print("✅ Schema is up to date")
+        return True
+
+    print("⚠️  Schema is outdated, run: crazygift-admin migrate")
+    return False
+
+
+async def reap():
+    """Один проход очистки зависших депозитов"""
+    from .database import close_db
+    from .reaper import transaction_reaper
+
+    try:
+        report = await transaction_reaper.sweep()
+    finally:
+        await close_db()
+
+    duration = report.pop("duration_ms")
+    report.pop("finished_at")
+    print(", ".join(f"{name}: {count}" for name, count in report.items()))
+    print(f"✅ Reaped in {duration:.0f}ms")
+
+
+async def rebuild_summary(user_id: Optional[int] = None):
+    """Пересчитать сводку инвентаря по таблице inventory"""
+    from .database import AsyncSessionLocal, close_db
+    from .inventory_summary import inventory_summary
+
+    start = time.perf_counter()
+    try:
+        async with AsyncSessionLocal() as db:
+            rows = await inventory_summary.rebuild(db, user_id)
+            await db.commit()
+    finally:
+        await close_db()
+
+    print(f"✅ Rebuilt {rows} summary rows in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+
+async def rebuild_referrals(user_id: Optional[int] = None):
+    """Пересчитать итоги по рефералам по таблице users"""
+    from .database import AsyncSessionLocal, close_db
+    from .referrals import referral_rollup
+
+    start = time.perf_counter()
+    try:
+        async with AsyncSessionLocal() as db:
+            rows = await referral_rollup.rebuild(db, user_id)
+            await db.commit()
+    finally:
+        await close_db()
+
+    print(f"✅ Rebuilt {rows} referral stats rows in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="crazygift-admin", description="CrazyGift admin commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = subparsers.add_parser("migrate", help="apply database migrations")
+    migrate_parser.add_argument("revision", nargs="?", default="head")
+
+    subparsers.add_parser("seed", help="load test cases")
+    subparsers.add_parser("status", help="show schema revision")
+    subparsers.add_parser("reap", help="expire stale deposits once")
+    rebuild_parser = subparsers.add_parser("rebuild-summary", help="recompute inventory summary")
+    rebuild_parser.add_argument("user_id", nargs="?", type=int)
+    referrals_parser = subparsers.add_parser("rebuild-referrals", help="recompute referral stats")
+    referrals_parser.add_argument("user_id", nargs="?", type=int)
+
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "migrate":
+            migrate(args.revision)
+        elif args.command == "seed":
+            asyncio.run(seed())
+        elif args.command == "status":
+            return 0 if asyncio.run(status()) else 1
+        elif args.command == "reap":
+            asyncio.run(reap())
+        elif args.command == "rebuild-summary":
+            asyncio.run(rebuild_summary(args.user_id))
+        elif args.command == "rebuild-referrals":
+            asyncio.run(rebuild_referrals(args.user_id))
+    except Exception as e:
+        print(f"❌ {args.command} failed: {e}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,22 @@
-import json
-import random
+from datetime import datetime
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, func
+from sqlalchemy import select, update, insert, func
 
+from .. import counters, idempotency
+from ..catalog import CatalogSnapshot, catalog_cache, serialize_cases, serialize_case_detail
+from ..counters import global_counters
 from ..database import get_db
-from ..models import User, Case, InventoryItem, Transaction
+from ..inventory_summary import inventory_summary
+from ..ledger import ledger
+from ..models import Case, CaseItem, InventoryItem, Transaction
+from ..presence import presence
+from ..referrals import referral_rollup
+from ..sampler import AliasSampler, sampler_cache
 from ..schemas import (
     CaseResponse, CaseDetailResponse, CaseOpenRequest, CaseOpenResponse,
-    InventoryItemResponse, CaseItem
+    CaseOpenBatchRequest, CaseOpenBatchResponse, InventoryItemResponse
 )
 import logging
 
@@ -19,26 +26,36 @@ router = APIRouter()
 
 @router.get("/", response_model=List[CaseResponse])
 async def get_cases(
+    request: Request,
     category: Optional[str] = None,
     active_only: bool = True,
-    db: AsyncSession = Depends(get_db)
+    rarity: Optional[str] = None
 ):
     """Получить список всех кейсов"""
     try:
-        query = select(Case)
-        
-        if active_only:
-            query = query.where(Case.active == True)
-        
-        if category:
-            query = query.where(Case.category == category)
-        
-        query = query.order_by(Case.price_stars.asc())
-        
-        result = await db.execute(query)
-        cases = result.scalars().all()
-        
-        return [CaseResponse.model_validate(case) for case in cases]
+        snapshot = await catalog_cache.get_snapshot()
+        
+        def build(snapshot: CatalogSnapshot) -> bytes:
+            cases = snapshot.cases
+            
+            if active_only:
+                cases = [case for case in cases if case.active]
+            
+            if category:
+                cases = [case for case in cases if case.category == category]
+            
+            # Кейсы, содержащие предметы указанной редкости
+            if rarity:
+                cases = [
+                    case for case in cases
+                    if any(item['rarity'] == rarity for item in snapshot.items.get(case.id, []))
+                ]
+            
+            return serialize_cases(cases)
+        
+        return catalog_cache.respond(
+            request, snapshot, ("cases", category, active_only, rarity), build
+        )
         
     except Exception as e:
         logger.error(f"Error getting cases: {str(e)}")
@@ -49,26 +66,29 @@ async def get_cases(
 
 
 @router.get("/categories")
-async def get_case_categories(db: AsyncSession = Depends(get_db)):
+async def get_case_categories(request: Request):
     """Получить список категорий кейсов"""
     try:
-        result = await db.execute(
-            select(Case.category, func.count(Case.id).label('count'))
-            .where(Case.active == True)
-            .group_by(Case.category)
-            .order_by(Case.category)
-        )
-        
-        categories = result.all()
-        
-        return [
-            {
-                "name": category.category or "default",
-                "count": category.count,
-                "display_name": get_category_display_name(category.category)
-            }
-            for category in categories
-        ]
+        snapshot = await catalog_cache.get_snapshot()
+        
+        def build(snapshot: CatalogSnapshot) -> list:
+            counts = {}
+            for case in snapshot.active_cases():
+                counts[case.category] = counts.get(case.category, 0) + 1
+            
+            # Как и ORDER BY в SQL: сначала кейсы без категории
+            categories = sorted(counts.items(), key=lambda c: (c[0] is not None, c[0] or ""))
+            
+            return [
+                {
+                    "name": category or "default",
+                    "count": count,
+                    "display_name": get_category_display_name(category)
+                }
+                for category, count in categories
+            ]
+        
+        return catalog_cache.respond(request, snapshot, "categories", build)
         
     except Exception as e:
         logger.error(f"Error getting case categories: {str(e)}")
@@ -79,47 +99,35 @@ async def get_case_categories(db: AsyncSession = Depends(get_db)):
 
 
 @router.get("/stats")
-async def get_cases_stats(db: AsyncSession = Depends(get_db)):
+async def get_cases_stats(request: Request):
     """Получить общую статистику по кейсам"""
     try:
-        total_cases = await db.scalar(
-            select(func.count(Case.id)).where(Case.active == True)
-        )
-        
-        total_opened = await db.scalar(
-            select(func.sum(Case.total_opened)).where(Case.active == True)
-        ) or 0
-        
-        popular_case_result = await db.execute(
-            select(Case.name, Case.total_opened)
-            .where(Case.active == True)
-            .order_by(Case.total_opened.desc())
-            .limit(1)
-        )
-        popular_case = popular_case_result.first()
-        
-        price_range_result = await db.execute(
-            select(
-                func.min(Case.price_stars).label('min_price'),
-                func.max(Case.price_stars).label('max_price'),
-                func.avg(Case.price_stars).label('avg_price')
-            ).where(Case.active == True)
-        )
-        price_range = price_range_result.first()
-        
-        return {
-            "total_cases": total_cases or 0,
-            "total_opened": total_opened,
-            "popular_case": {
-                "name": popular_case.name if popular_case else None,
-                "times_opened": popular_case.total_opened if popular_case else 0
-            },
-            "price_range": {
-                "min": price_range.min_price if price_range else 0,
-                "max": price_range.max_price if price_range else 0,
-                "average": round(float(price_range.avg_price), 2) if price_range and price_range.avg_price else 0
+        snapshot = await catalog_cache.get_snapshot()
+        
+        def build(snapshot: CatalogSnapshot) -> dict:
+            active_cases = snapshot.active_cases()
+            prices = [case.price_stars for case in active_cases]
+            popular_case = max(
+                active_cases,
+                key=lambda case: case.total_opened or 0,
+                default=None
+            )
+            
+            return {
+                "total_cases": len(active_cases),
+                "total_opened": sum(case.total_opened or 0 for case in active_cases),
+                "popular_case": {
+                    "name": popular_case.name if popular_case else None,
+                    "times_opened": popular_case.total_opened if popular_case else 0
+                },
+                "price_range": {
+                    "min": min(prices) if prices else None,
+                    "max": max(prices) if prices else None,
+                    "average": round(sum(prices) / len(prices), 2) if prices else 0
+                }
             }
-        }
+        
+        return catalog_cache.respond(request, snapshot, "stats", build)
         
     except Exception as e:
         logger.error(f"Error getting cases stats: {str(e)}")
@@ -130,12 +138,10 @@ async def get_cases_stats(db: AsyncSession = Depends(get_db)):
 
 
 @router.get("/{case_id}", response_model=CaseDetailResponse)
-async def get_case(case_id: int, db: AsyncSession = Depends(get_db)):
+async def get_case(case_id: int, request: Request):
     """Получить детали конкретного кейса"""
-    result = await db.execute(
-        select(Case).where(Case.id == case_id)
-    )
-    case = result.scalar_one_or_none()
+    snapshot = await catalog_cache.get_snapshot()
+    case = snapshot.by_id.get(case_id)
     
     if not case:
         raise HTTPException(
@@ -150,40 +156,36 @@ async def get_case(case_id: int, db: AsyncSession = Depends(get_db)):
         )
     
     try:
-        items_data = json.loads(case.items)
-        items = [CaseItem(**item) for item in items_data]
-    except (json.JSONDecodeError, TypeError) as e:
+        return catalog_cache.respond(
+            request,
+            snapshot,
+            ("case", case_id),
+            lambda snapshot: serialize_case_detail(case, snapshot.items.get(case_id, []))
+        )
+    except (TypeError, ValueError) as e:
         logger.error(f"Error parsing case items for case {case_id}: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Invalid case data"
         )
-    
-    # Создаем ответ правильно
-    case_dict = {
-        "id": case.id,
-        "name": case.name,
-        "description": case.description,
-        "price_stars": case.price_stars,
-        "image_url": case.image_url,
-        "category": case.category,
-        "active": case.active,
-        "total_opened": case.total_opened,
-        "created_at": case.created_at,
-        "items": items
-    }
-    
-    return CaseDetailResponse(**case_dict)
 
 
 @router.post("/{case_id}/open", response_model=CaseOpenResponse)
 async def open_case(
     case_id: int,
     request: CaseOpenRequest,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None)
 ):
-    """Открыть кейс"""
+    """Открыть кейс (повтор с тем же Idempotency-Key вернет тот же результат)"""
     try:
+        idem = await idempotency.begin(
+            db, "cases.open", idempotency_key, {"case_id": case_id, **request.model_dump()}
+        )
+        presence.touch(request.user_id)
+        if idem.replay is not None:
+            return idem.replay
+        
         case_result = await db.execute(
             select(Case).where(Case.id == case_id, Case.active == True)
         )
@@ -195,33 +197,15 @@ async def open_case(
                 detail="Case not found or inactive"
             )
         
-        user_result = await db.execute(
-            select(User).where(User.id == request.user_id)
-        )
-        user = user_result.scalar_one_or_none()
-        
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
-            )
-        
-        if user.balance_stars < case.price_stars:
-            return CaseOpenResponse(
-                success=False,
-                new_balance=user.balance_stars,
-                message=f"Недостаточно звёзд. Нужно: {case.price_stars}, у вас: {user.balance_stars}"
-            )
-        
         try:
-            items_data = json.loads(case.items)
-        except json.JSONDecodeError:
+            sampler = await get_case_sampler(db, case)
+        except (TypeError, ValueError):
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Invalid case data"
             )
         
-        chosen_item_data = select_random_item(items_data)
+        chosen_item_data = select_random_item(sampler)
         
         if not chosen_item_data:
             raise HTTPException(
@@ -229,17 +213,29 @@ async def open_case(
                 detail="Failed to select item from case"
             )
         
-        new_balance = user.balance_stars - case.price_stars
+        # Условное списание: проверка баланса и запись в одном UPDATE
+        new_balance = await ledger.debit(
+            db,
+            request.user_id,
+            case.price_stars,
+            total_cases_opened=1,
+            total_spent_stars=case.price_stars
+        )
         
-        await db.execute(
-            update(User)
-            .where(User.id == request.user_id)
-            .values(
-                balance_stars=new_balance,
-                total_cases_opened=User.total_cases_opened + 1,
-                total_spent_stars=User.total_spent_stars + case.price_stars
+        if new_balance is None:
+            balance = await ledger.get_balance(db, request.user_id)
+            
+            if balance is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="User not found"
+                )
+            
+            return CaseOpenResponse(
+                success=False,
+                new_balance=balance,
+                message=f"Недостаточно звёзд. Нужно: {case.price_stars}, у вас: {balance}"
             )
-        )
         
         purchase_transaction = Transaction(
             user_id=request.user_id,
@@ -267,22 +263,33 @@ async def open_case(
         await db.execute(
             update(Case)
             .where(Case.id == case_id)
-            .values(total_opened=Case.total_opened + 1)
+            # updated_at не трогаем: счетчик не меняет содержимое кейса
+            .values(
+                total_opened=Case.total_opened + 1,
+                updated_at=Case.updated_at
+            )
         )
         
-        await db.commit()
+        await db.flush()
         await db.refresh(inventory_item)
+        await inventory_summary.add(db, [inventory_item])
+        await global_counters.increment(db, counters.CASES_OPENED)
+        await referral_rollup.activate(db, request.user_id, 1)
         
-        logger.info(
-            f"User {request.user_id} opened case {case_id} and got {chosen_item_data['name']}"
-        )
-        
-        return CaseOpenResponse(
+        response = CaseOpenResponse(
             success=True,
             item=InventoryItemResponse.model_validate(inventory_item),
             new_balance=new_balance,
             message=f"Поздравляем! Вы получили: {chosen_item_data['name']}"
         )
+        await idem.save(response)
+        await db.commit()
+        
+        logger.info(
+            f"User {request.user_id} opened case {case_id} and got {chosen_item_data['name']}"
+        )
+        
+        return response
         
     except HTTPException:
         raise
@@ -294,22 +301,163 @@ async def open_case(
         )
 
 
-def select_random_item(items_data: List[dict]) -> Optional[dict]:
-    """Выбирает случайный предмет на основе весов"""
+@router.post("/{case_id}/open-batch", response_model=CaseOpenBatchResponse)
+async def open_case_batch(
+    case_id: int,
+    request: CaseOpenBatchRequest,
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """Открыть кейс несколько раз за одну транзакцию"""
     try:
-        if not items_data:
-            return None
+        idem = await idempotency.begin(
+            db, "cases.open_batch", idempotency_key, {"case_id": case_id, **request.model_dump()}
+        )
+        presence.touch(request.user_id)
+        if idem.replay is not None:
+            return idem.replay
+        
+        case_result = await db.execute(
+            select(Case).where(Case.id == case_id, Case.active == True)
+        )
+        case = case_result.scalar_one_or_none()
+        
+        if not case:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Case not found or inactive"
+            )
+        
+        try:
+            sampler = await get_case_sampler(db, case)
+        except (TypeError, ValueError):
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Invalid case data"
+            )
+        
+        total_price = case.price_stars * request.count
+        
+        # Списываем всю сумму одним условным UPDATE: баланс проверяется в самой БД
+        new_balance = await ledger.debit(
+            db,
+            request.user_id,
+            total_price,
+            total_cases_opened=request.count,
+            total_spent_stars=total_price
+        )
+        
+        if new_balance is None:
+            balance = await ledger.get_balance(db, request.user_id)
+            
+            if balance is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="User not found"
+                )
+            
+            return CaseOpenBatchResponse(
+                success=False,
+                new_balance=balance,
+                message=f"Недостаточно звёзд. Нужно: {total_price}, у вас: {balance}"
+            )
+        
+        chosen_items = sampler.sample_many(request.count)
+        now = datetime.utcnow()
+        
+        # Пакетная вставка транзакций и предметов
+        await db.execute(
+            insert(Transaction),
+            [
+                {
+                    "user_id": request.user_id,
+                    "type": "case_purchase",
+                    "amount": case.price_stars,
+                    "currency": "STARS",
+                    "status": "completed",
+                    "description": f"Opened case: {case.name}",
+                    "completed_at": now
+                }
+                for _ in chosen_items
+            ]
+        )
+        
+        inventory_result = await db.scalars(
+            insert(InventoryItem).returning(InventoryItem, sort_by_parameter_order=True),
+            [
+                {
+                    "user_id": request.user_id,
+                    "item_name": item['name'],
+                    "item_value": item['value'],
+                    "item_stars": item['stars'],
+                    "rarity": item['rarity'],
+                    "image_url": item['image'],
+                    "case_name": case.name,
+                    "case_id": case.id
+                }
+                for item in chosen_items
+            ]
+        )
+        inventory_items = inventory_result.all()
+        await inventory_summary.add(db, inventory_items)
+        await global_counters.increment(db, counters.CASES_OPENED, request.count)
+        await referral_rollup.activate(db, request.user_id, request.count)
+        
+        await db.execute(
+            update(Case)
+            .where(Case.id == case_id)
+            .values(
+                total_opened=Case.total_opened + request.count,
+                updated_at=Case.updated_at
+            )
+        )
         
-        weights = []
-        for item in items_data:
-            weight = item.get('weight', 1)
-            if weight <= 0:
-                weight = 1
-            weights.append(weight)
+        response = CaseOpenBatchResponse(
+            success=True,
+            items=[InventoryItemResponse.model_validate(item) for item in inventory_items],
+            new_balance=new_balance,
+            total_spent=total_price,
+            message=f"Открыто кейсов: {request.count}"
+        )
+        await idem.save(response)
+        await db.commit()
         
-        chosen_item = random.choices(items_data, weights=weights)[0]
+        logger.info(
+            f"User {request.user_id} opened case {case_id} x{request.count}"
+        )
         
-        return chosen_item
+        return response
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error batch opening case {case_id}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to open cases"
+        )
+
+
+async def get_case_sampler(db: AsyncSession, case: Case) -> AliasSampler:
+    """Возвращает скомпилированный сэмплер кейса (из кеша или собирает заново)"""
+    sampler = sampler_cache.get(case.id, case.updated_at)
+    
+    if sampler is None:
+        result = await db.execute(
+            select(CaseItem)
+            .where(CaseItem.case_id == case.id)
+            .order_by(CaseItem.position)
+        )
+        items_data = [item.to_dict() for item in result.scalars().all()]
+        sampler = sampler_cache.put(case.id, case.updated_at, items_data)
+    
+    return sampler
+
+
+def select_random_item(sampler: AliasSampler) -> Optional[dict]:
+    """Выбирает случайный предмет на основе весов"""
+    try:
+        return sampler.sample()
         
     except Exception as e:
         logger.error(f"Error selecting random item: {str(e)}")
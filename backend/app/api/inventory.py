@@ -1,11 +1,17 @@
 from datetime import datetime
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, delete, func
+from sqlalchemy import select, update, delete, func, and_
 
-from ..database import get_db
-from ..models import User, InventoryItem, Transaction
+from ..config import settings
+from ..database import get_db, get_read_db
+from ..inventory_summary import inventory_summary, summarize
+from ..ledger import ledger
+from .. import idempotency, notifications
+from ..models import User, InventoryItem, Transaction, UserInventorySummary
+from ..pagination import NEXT_CURSOR_HEADER, before_cursor, decode_cursor, encode_cursor
+from ..presence import presence
 from ..schemas import (
     InventoryItemResponse, SellItemRequest, SellItemResponse,
     WithdrawItemRequest, WithdrawItemResponse, SuccessResponse
@@ -19,41 +25,69 @@ router = APIRouter()
 @router.get("/{user_id}", response_model=List[InventoryItemResponse])
 async def get_user_inventory(
     user_id: int,
+    response: Response,
     rarity: Optional[str] = None,
     include_withdrawn: bool = False,
-    limit: int = 100,
-    offset: int = 0,
-    db: AsyncSession = Depends(get_db)
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
     Получить инвентарь пользователя
+    
+    Keyset пагинация по (created_at, id): курсор следующей страницы
+    возвращается в заголовке X-Next-Cursor (тело ответа - прежний список).
+    offset оставлен для старых клиентов.
     """
+    presence.touch(user_id)
     try:
-        # Проверяем существование пользователя
-        user_exists = await db.scalar(
-            select(User.id).where(User.id == user_id)
+        # Фильтры в условии LEFT JOIN: пользователь без подходящих предметов
+        # дает одну строку с пустым предметом, несуществующий - ни одной
+        conditions = [InventoryItem.user_id == User.id]
+        
+        if not include_withdrawn:
+            conditions.append(InventoryItem.is_withdrawn == False)
+        
+        if rarity:
+            conditions.append(InventoryItem.rarity == rarity)
+        
+        if cursor:
+            try:
+                cursor_created_at, cursor_id = decode_cursor(cursor)
+            except ValueError:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Invalid cursor"
+                )
+            conditions.append(
+                before_cursor(InventoryItem.created_at, InventoryItem.id, cursor_created_at, cursor_id)
+            )
+        
+        # Страница по индексу (user_id, is_withdrawn, created_at DESC, id DESC)
+        query = (
+            select(User.id, InventoryItem)
+            .outerjoin(InventoryItem, and_(*conditions))
+            .where(User.id == user_id)
+            .order_by(InventoryItem.created_at.desc(), InventoryItem.id.desc())
+            .limit(limit + 1)
         )
+        if offset and not cursor:
+            query = query.offset(offset)
         
-        if not user_exists:
+        rows = (await db.execute(query)).all()
+        
+        # offset мог пропустить и пустую строку пользователя - проверяем отдельно
+        if not rows and (not offset or not await db.scalar(select(User.id).where(User.id == user_id))):
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="User not found"
             )
         
-        # Строим запрос с фильтрами
-        query = select(InventoryItem).where(InventoryItem.user_id == user_id)
-        
-        if not include_withdrawn:
-            query = query.where(InventoryItem.is_withdrawn == False)
-        
-        if rarity:
-            query = query.where(InventoryItem.rarity == rarity)
-        
-        # Добавляем сортировку и пагинацию
-        query = query.order_by(InventoryItem.created_at.desc()).limit(limit).offset(offset)
-        
-        result = await db.execute(query)
-        items = result.scalars().all()
+        items = [item for _, item in rows if item is not None]
+        if len(items) > limit:
+            items = items[:limit]
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(items[-1].created_at, items[-1].id)
         
         return [InventoryItemResponse.model_validate(item) for item in items]
         
@@ -68,82 +102,25 @@ async def get_user_inventory(
 
 
 @router.get("/{user_id}/stats")
-async def get_inventory_stats(user_id: int, db: AsyncSession = Depends(get_db)):
+async def get_inventory_stats(user_id: int, db: AsyncSession = Depends(get_read_db)):
     """
     Получить статистику инвентаря пользователя
     """
     try:
-        # Проверяем существование пользователя
-        user_exists = await db.scalar(
-            select(User.id).where(User.id == user_id)
-        )
-        
-        if not user_exists:
+        # Строки сводки вместе с проверкой пользователя одним запросом
+        rows = (await db.execute(
+            select(User.id, UserInventorySummary)
+            .outerjoin(UserInventorySummary, UserInventorySummary.user_id == User.id)
+            .where(User.id == user_id)
+        )).all()
+        
+        if not rows:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="User not found"
             )
         
-        # Статистика по редкости
-        rarity_stats = await db.execute(
-            select(
-                InventoryItem.rarity,
-                func.count(InventoryItem.id).label('count'),
-                func.sum(InventoryItem.item_value).label('total_value'),
-                func.sum(InventoryItem.item_stars).label('total_stars')
-            )
-            .where(
-                InventoryItem.user_id == user_id,
-                InventoryItem.is_withdrawn == False
-            )
-            .group_by(InventoryItem.rarity)
-        )
-        
-        rarity_data = {}
-        for row in rarity_stats:
-            rarity_data[row.rarity] = {
-                "count": row.count,
-                "total_value": float(row.total_value or 0),
-                "total_stars": row.total_stars or 0
-            }
-        
-        # Общая статистика
-        total_stats = await db.execute(
-            select(
-                func.count(InventoryItem.id).label('total_items'),
-                func.sum(InventoryItem.item_value).label('portfolio_value'),
-                func.sum(InventoryItem.item_stars).label('portfolio_stars'),
-                func.count(InventoryItem.id).filter(InventoryItem.is_withdrawn == True).label('withdrawn_items')
-            )
-            .where(InventoryItem.user_id == user_id)
-        )
-        
-        totals = total_stats.first()
-        
-        # Самый дорогой предмет
-        most_valuable_result = await db.execute(
-            select(InventoryItem)
-            .where(
-                InventoryItem.user_id == user_id,
-                InventoryItem.is_withdrawn == False
-            )
-            .order_by(InventoryItem.item_value.desc())
-            .limit(1)
-        )
-        most_valuable = most_valuable_result.scalar_one_or_none()
-        
-        return {
-            "total_items": totals.total_items or 0,
-            "portfolio_value": float(totals.portfolio_value or 0),
-            "portfolio_stars": totals.portfolio_stars or 0,
-            "withdrawn_items": totals.withdrawn_items or 0,
-            "by_rarity": rarity_data,
-            "most_valuable_item": {
-                "name": most_valuable.item_name if most_valuable else None,
-                "value": float(most_valuable.item_value) if most_valuable else 0,
-                "rarity": most_valuable.rarity if most_valuable else None
-            }
-        }
+        return summarize(summary for _, summary in rows if summary is not None)
         
     except HTTPException:
         raise
@@ -159,43 +136,51 @@ async def get_inventory_stats(user_id: int, db: AsyncSession = Depends(get_db)):
 async def sell_inventory_item(
     item_id: int,
     request: SellItemRequest,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """
     Продать предмет из инвентаря
+    
+    Повтор с тем же Idempotency-Key вернет результат первой продажи, а не 404.
     """
     try:
-        # Получаем предмет с проверкой владельца
+        idem = await idempotency.begin(
+            db, "inventory.sell", idempotency_key, {"item_id": item_id, **request.model_dump()}
+        )
+        if idem.replay is not None:
+            return idem.replay
+        
+        # Удаляем предмет с проверкой владельца одним запросом:
+        # повторная продажа того же предмета не найдет строку
         item_result = await db.execute(
-            select(InventoryItem, User)
-            .join(User)
+            delete(InventoryItem)
             .where(
                 InventoryItem.id == item_id,
                 InventoryItem.user_id == request.user_id,
                 InventoryItem.is_withdrawn == False
             )
+            .returning(
+                InventoryItem.id, InventoryItem.user_id, InventoryItem.item_name,
+                InventoryItem.item_value, InventoryItem.item_stars, InventoryItem.rarity
+            )
         )
-        row = item_result.first()
+        item = item_result.first()
         
-        if not row:
+        if not item:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Item not found or already withdrawn"
             )
         
-        item, user = row
+        await inventory_summary.remove(db, item)
         
-        # Начинаем транзакцию
         # 1. Добавляем звезды пользователю
-        new_balance = user.balance_stars + item.item_stars
-        
-        await db.execute(
-            update(User)
-            .where(User.id == request.user_id)
-            .values(
-                balance_stars=new_balance,
-                total_earned_stars=User.total_earned_stars + item.item_stars
-            )
+        new_balance = await ledger.credit(
+            db,
+            request.user_id,
+            item.item_stars,
+            total_earned_stars=item.item_stars
         )
         
         # 2. Создаем транзакцию продажи
@@ -210,10 +195,13 @@ async def sell_inventory_item(
         )
         db.add(sale_transaction)
         
-        # 3. Удаляем предмет из инвентаря
-        await db.execute(
-            delete(InventoryItem).where(InventoryItem.id == item_id)
+        response = SellItemResponse(
+            success=True,
+            stars_earned=item.item_stars,
+            new_balance=new_balance,
+            message=f"Предмет '{item.item_name}' продан за {item.item_stars:,} звёзд"
         )
+        await idem.save(response)
         
         # Сохраняем изменения
         await db.commit()
@@ -222,12 +210,7 @@ async def sell_inventory_item(
             f"User {request.user_id} sold item {item.item_name} for {item.item_stars} stars"
         )
         
-        return SellItemResponse(
-            success=True,
-            stars_earned=item.item_stars,
-            new_balance=new_balance,
-            message=f"Предмет '{item.item_name}' продан за {item.item_stars:,} звёзд"
-        )
+        return response
         
     except HTTPException:
         raise
@@ -276,15 +259,28 @@ async def request_item_withdrawal(
                 detail="Item value too low for withdrawal. Minimum: 1000 stars"
             )
         
-        # Помечаем предмет как запрошенный к выводу
-        await db.execute(
+        # Помечаем предмет как запрошенный к выводу: условие is_withdrawn
+        # повторяется в UPDATE, поэтому из параллельных запросов (или
+        # продажи) предмет получит только один
+        withdrawn = await db.execute(
             update(InventoryItem)
-            .where(InventoryItem.id == item_id)
+            .where(
+                InventoryItem.id == item_id,
+                InventoryItem.user_id == request.user_id,
+                InventoryItem.is_withdrawn == False
+            )
             .values(
                 is_withdrawn=True,
                 withdrawal_requested_at=datetime.utcnow()
             )
+            .returning(InventoryItem.id)
         )
+        if withdrawn.first() is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Item already withdrawn or sold"
+            )
+        await inventory_summary.withdraw(db, item)
         
         # Создаем транзакцию вывода
         withdrawal_transaction = Transaction(
@@ -298,10 +294,10 @@ async def request_item_withdrawal(
         )
         db.add(withdrawal_transaction)
         
-        await db.commit()
+        # Уведомление администратору уходит в очередь вместе с запросом
+        notify_admin_withdrawal_request(db, user, item, request.contact_info)
         
-        # TODO: Отправить уведомление администратору о запросе вывода
-        await notify_admin_withdrawal_request(user, item, request.contact_info)
+        await db.commit()
         
         logger.info(
             f"User {request.user_id} requested withdrawal for item {item.item_name}"
@@ -323,7 +319,7 @@ async def request_item_withdrawal(
 
 
 @router.get("/{user_id}/withdrawals")
-async def get_withdrawal_requests(user_id: int, db: AsyncSession = Depends(get_db)):
+async def get_withdrawal_requests(user_id: int, db: AsyncSession = Depends(get_read_db)):
     """
     Получить список запросов на вывод пользователя
     """
@@ -409,15 +405,21 @@ async def delete_inventory_item(
     Удалить предмет из инвентаря (только для администраторов)
     """
     try:
-        # Проверяем существование предмета
+        # Удаляем предмет с проверкой владельца одним запросом:
+        # сводка меняется только если строку удалил этот запрос
         item_result = await db.execute(
-            select(InventoryItem)
+            delete(InventoryItem)
             .where(
                 InventoryItem.id == item_id,
                 InventoryItem.user_id == user_id
             )
+            .returning(
+                InventoryItem.id, InventoryItem.user_id, InventoryItem.item_name,
+                InventoryItem.item_value, InventoryItem.item_stars, InventoryItem.rarity,
+                InventoryItem.is_withdrawn
+            )
         )
-        item = item_result.scalar_one_or_none()
+        item = item_result.first()
         
         if not item:
             raise HTTPException(
@@ -425,10 +427,7 @@ async def delete_inventory_item(
                 detail="Item not found"
             )
         
-        # Удаляем предмет
-        await db.execute(
-            delete(InventoryItem).where(InventoryItem.id == item_id)
-        )
+        await inventory_summary.remove(db, item, withdrawn=item.is_withdrawn)
         
         await db.commit()
         
@@ -448,17 +447,11 @@ async def delete_inventory_item(
         )
 
 
-async def notify_admin_withdrawal_request(user: User, item: InventoryItem, contact_info: Optional[str]):
+def notify_admin_withdrawal_request(db: AsyncSession, user: User, item: InventoryItem, contact_info: Optional[str]):
     """
-    Уведомление администратора о запросе вывода
+    Уведомление администратора о запросе вывода (через очередь сообщений)
     """
-    try:
-        from ..payments.telegram import telegram_service
-        
-        # ID администратора (нужно указать реальный)
-        ADMIN_TELEGRAM_ID = 123456789  # Замените на реальный ID
-        
-        message = f"""
+    message = f"""
 🔔 *Новый запрос на вывод*
 
 👤 Пользователь: {user.first_name or 'Unknown'} (@{user.username or 'no_username'})
@@ -473,10 +466,6 @@ async def notify_admin_withdrawal_request(user: User, item: InventoryItem, conta
 📞 Контакт: {contact_info or 'Не указан'}
 
 📅 Время запроса: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}
-        """.strip()
-        
-        await telegram_service.send_message(ADMIN_TELEGRAM_ID, message)
-        
-    except Exception as e:
-        logger.error(f"Failed to notify admin about withdrawal request: {str(e)}")
-        # Не прерываем основной процесс при ошибке уведомления
\ No newline at end of file
+    """.strip()
+    
+    notifications.enqueue(db, settings.admin_telegram_id, message, kind="withdrawal_request")
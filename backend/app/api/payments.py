@@ -1,11 +1,14 @@
 from decimal import Decimal
 from datetime import datetime
 from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+import time
+from fastapi import APIRouter, Depends, Header, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update
 
-from ..database import get_db
+from ..database import get_db, get_read_db
+from ..ledger import ledger
+from .. import idempotency, jobs, notifications
 from ..models import User, Transaction
 from ..schemas import (
     TonDepositRequest, StarsDepositRequest, TonTransactionResponse,
@@ -14,6 +17,7 @@ from ..schemas import (
 )
 from ..payments.ton import ton_service
 from ..payments.telegram import telegram_service
+from ..ton_scanner import ton_scanner, complete_deposit, message_matches
 import logging
 
 logger = logging.getLogger(__name__)
@@ -23,12 +27,19 @@ router = APIRouter()
 @router.post("/ton/deposit", response_model=TonTransactionResponse)
 async def create_ton_deposit(
     request: TonDepositRequest,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """
     Создать депозит TON
+    
+    Повтор с тем же заголовком Idempotency-Key вернет тот же депозит.
     """
     try:
+        idem = await idempotency.begin(db, "payments.ton_deposit", idempotency_key, request.model_dump())
+        if idem.replay is not None:
+            return idem.replay
+        
         # Проверяем пользователя
         user_result = await db.execute(
             select(User).where(User.id == request.user_id)
@@ -61,8 +72,7 @@ async def create_ton_deposit(
         )
         
         db.add(transaction)
-        await db.commit()
-        await db.refresh(transaction)
+        await db.flush()
         
         # Создаем TON транзакцию
         ton_transaction = await ton_service.create_deposit_transaction(
@@ -70,12 +80,16 @@ async def create_ton_deposit(
             amount_decimal
         )
         
-        logger.info(f"Created TON deposit for user {request.user_id}: {amount_decimal} TON")
-        
-        return TonTransactionResponse(
+        response = TonTransactionResponse(
             transaction_id=transaction.id,
             ton_transaction=ton_transaction
         )
+        await idem.save(response)
+        await db.commit()
+        
+        logger.info(f"Created TON deposit for user {request.user_id}: {amount_decimal} TON")
+        
+        return response
         
     except HTTPException:
         raise
@@ -90,12 +104,21 @@ async def create_ton_deposit(
 @router.post("/stars/invoice", response_model=StarsInvoiceResponse)
 async def create_stars_invoice(
     request: StarsDepositRequest,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """
     Создать инвойс для покупки Telegram Stars
+    
+    Повтор с тем же заголовком Idempotency-Key вернет тот же инвойс.
     """
+    idem = idempotency.IdempotentRequest(db)
+    transaction_id = None
     try:
+        idem = await idempotency.begin(db, "payments.stars_invoice", idempotency_key, request.model_dump())
+        if idem.replay is not None:
+            return idem.replay
+        
         # Проверяем пользователя и получаем его Telegram ID
         user_result = await db.execute(
             select(User).where(User.id == request.user_id)
@@ -126,26 +149,43 @@ async def create_stars_invoice(
         )
         
         db.add(transaction)
+        await db.flush()
+        transaction_id = transaction.id
+        telegram_id = user.telegram_id
+        # Коммит возвращает соединение в пул: запрос к Telegram идет без него
         await db.commit()
-        await db.refresh(transaction)
         
         # Создаем инвойс в Telegram
         invoice_link = await telegram_service.create_stars_invoice(
             request.user_id,
             request.stars_amount,
-            user.telegram_id
+            telegram_id
         )
         
-        logger.info(f"Created Stars invoice for user {request.user_id}: {request.stars_amount} stars")
-        
-        return StarsInvoiceResponse(
+        response = StarsInvoiceResponse(
             invoice_link=invoice_link,
-            transaction_id=transaction.id
+            transaction_id=transaction_id
         )
+        await idem.save(response)
+        await db.commit()
+        
+        logger.info(f"Created Stars invoice for user {request.user_id}: {request.stars_amount} stars")
+        
+        return response
         
     except HTTPException:
         raise
     except Exception as e:
+        # Ключ закоммичен вместе с транзакцией до запроса к Telegram - освобождаем
+        await idem.release()
+        if transaction_id is not None:
+            # Инвойс не создан - транзакция не будет оплачена
+            await db.execute(
+                update(Transaction)
+                .where(Transaction.id == transaction_id, Transaction.status == "pending")
+                .values(status="failed")
+            )
+            await db.commit()
         logger.error(f"Error creating Stars invoice: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -156,53 +196,59 @@ async def create_stars_invoice(
 @router.post("/webhook/ton", response_model=SuccessResponse)
 async def ton_webhook(
     request: WebhookTonRequest,
-    background_tasks: BackgroundTasks,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """
     Webhook для подтверждения TON платежа
+    
+    Повторная доставка (тот же Idempotency-Key или хеш транзакции)
+    получает сохраненный ответ без повторной обработки.
     """
     try:
-        # Проверяем существование транзакции
-        transaction_result = await db.execute(
-            select(Transaction).where(
+        idem = await idempotency.begin(
+            db, "webhook.ton", idempotency_key or request.tx_hash, request.model_dump()
+        )
+        if idem.replay is not None:
+            return idem.replay
+        
+        # Переводим в "processing" только ожидающую транзакцию: из одновременных
+        # доставок одного платежа обработку запустит одна
+        processing = await db.execute(
+            update(Transaction)
+            .where(
                 Transaction.id == request.transaction_id,
                 Transaction.type == "deposit_ton",
                 Transaction.status == "pending"
             )
+            .values(
+                status="processing",
+                external_id=request.tx_hash
+            )
         )
-        transaction = transaction_result.scalar_one_or_none()
         
-        if not transaction:
+        if processing.rowcount == 0:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Transaction not found or already processed"
             )
         
-        # Обновляем статус на "processing"
-        await db.execute(
-            update(Transaction)
-            .where(Transaction.id == request.transaction_id)
-            .values(
-                status="processing",
-                external_id=request.tx_hash
-            )
-        )
-        await db.commit()
+        # Задача проверки коммитится вместе со статусом и переживет перезапуск
+        jobs.enqueue(db, "payment.ton", {
+            "transaction_id": request.transaction_id,
+            "tx_hash": request.tx_hash
+        }, ref=f"transaction:{request.transaction_id}")
         
-        # Запускаем проверку в фоне
-        background_tasks.add_task(
-            process_ton_payment,
-            request.transaction_id,
-            request.tx_hash
+        response = SuccessResponse(
+            message="Payment verification started",
+            data={"transaction_id": request.transaction_id}
         )
+        await idem.save(response)
+        await db.commit()
         
         logger.info(f"TON webhook received for transaction {request.transaction_id}")
         
-        return SuccessResponse(
-            message="Payment verification started",
-            data={"transaction_id": request.transaction_id}
-        )
+        return response
         
     except HTTPException:
         raise
@@ -217,54 +263,59 @@ async def ton_webhook(
 @router.post("/webhook/telegram", response_model=SuccessResponse)
 async def telegram_webhook(
     request: WebhookTelegramRequest,
-    background_tasks: BackgroundTasks,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """
     Webhook для подтверждения Telegram Stars платежа
+    
+    Повторная доставка (тот же Idempotency-Key или ID платежа)
+    получает сохраненный ответ без повторной обработки.
     """
     try:
-        # Проверяем существование транзакции
-        transaction_result = await db.execute(
-            select(Transaction).where(
+        idem = await idempotency.begin(
+            db, "webhook.telegram", idempotency_key or request.payment_id, request.model_dump()
+        )
+        if idem.replay is not None:
+            return idem.replay
+        
+        # Переводим в "processing" только ожидающую транзакцию: из одновременных
+        # доставок одного платежа обработку запустит одна
+        processing = await db.execute(
+            update(Transaction)
+            .where(
                 Transaction.id == request.transaction_id,
                 Transaction.type == "deposit_stars",
                 Transaction.status == "pending"
             )
+            .values(
+                status="processing",
+                external_id=request.payment_id
+            )
         )
-        transaction = transaction_result.scalar_one_or_none()
         
-        if not transaction:
+        if processing.rowcount == 0:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Transaction not found or already processed"
             )
         
-        # Обновляем статус
-        await db.execute(
-            update(Transaction)
-            .where(Transaction.id == request.transaction_id)
-            .values(
-                status="processing",
-                external_id=request.payment_id
-            )
-        )
-        await db.commit()
+        jobs.enqueue(db, "payment.telegram", {
+            "transaction_id": request.transaction_id,
+            "payment_id": request.payment_id,
+            "payment_status": request.status
+        }, ref=f"transaction:{request.transaction_id}")
         
-        # Запускаем обработку в фоне
-        background_tasks.add_task(
-            process_telegram_payment,
-            request.transaction_id,
-            request.payment_id,
-            request.status
+        response = SuccessResponse(
+            message="Payment verification started",
+            data={"transaction_id": request.transaction_id}
         )
+        await idem.save(response)
+        await db.commit()
         
         logger.info(f"Telegram webhook received for transaction {request.transaction_id}")
         
-        return SuccessResponse(
-            message="Payment verification started",
-            data={"transaction_id": request.transaction_id}
-        )
+        return response
         
     except HTTPException:
         raise
@@ -277,7 +328,7 @@ async def telegram_webhook(
 
 
 @router.get("/transaction/{transaction_id}", response_model=TransactionResponse)
-async def get_transaction(transaction_id: int, db: AsyncSession = Depends(get_db)):
+async def get_transaction(transaction_id: int, db: AsyncSession = Depends(get_read_db)):
     """
     Получить информацию о транзакции
     """
@@ -295,12 +346,14 @@ async def get_transaction(transaction_id: int, db: AsyncSession = Depends(get_db
     return TransactionResponse.model_validate(transaction)
 
 
-# Фоновые задачи для обработки платежей
+# Фоновые задачи для обработки платежей (выполняет app.jobs)
 
 async def process_ton_payment(transaction_id: int, tx_hash: str):
-    """Обработка TON платежа в фоне"""
+    """Обработка TON платежа в фоне (ошибка - повтор задачи)"""
     from ..database import AsyncSessionLocal
     
+    started = time.monotonic()
+    
     async with AsyncSessionLocal() as db:
         try:
             # Получаем транзакцию
@@ -317,81 +370,74 @@ async def process_ton_payment(transaction_id: int, tx_hash: str):
             transaction, user = row
             
             # Создаем memo для проверки
-            memo = f"deposit_{user.id}_{int(transaction.amount * 100)}"
+            memo = ton_service.deposit_memo(user.id, transaction.amount)
             
-            # Проверяем транзакцию в блокчейне
-            is_valid = await ton_service.verify_transaction(
-                tx_hash, 
-                transaction.amount, 
-                memo
-            )
+            # Ищем перевод в локальном индексе сканера; если его там еще нет -
+            # одно общее сканирование на все одновременные webhook
+            message = await ton_scanner.lookup(db, tx_hash)
+            if message is None:
+                # Не держим соединение с БД во время запросов к toncenter
+                await db.commit()
+                try:
+                    await ton_scanner.refresh(since=started)
+                except Exception as e:
+                    logger.warning(f"TON scan for payment {transaction_id} failed: {str(e)}")
+                message = await ton_scanner.lookup(db, tx_hash)
             
-            if is_valid:
-                # Конвертируем TON в звезды (1 TON = 100 stars)
-                stars_amount = int(transaction.amount * 100)
+            if message is None:
+                # Перевод еще не попал в блокчейн: депозит останется в обработке,
+                # сканер зачтет его по memo, когда перевод появится
+                logger.info(f"TON payment {transaction_id}: {tx_hash} not indexed yet")
+                return
+            
+            if message.matched_transaction_id == transaction_id:
+                logger.info(f"TON payment {transaction_id} already matched by scanner")
+                return
+            
+            if message.matched_transaction_id is None and message_matches(message, transaction.amount, memo):
+                new_balance = await complete_deposit(db, transaction, user.telegram_id, message)
                 
-                # Обновляем баланс пользователя
-                await db.execute(
-                    update(User)
-                    .where(User.id == user.id)
-                    .values(balance_stars=User.balance_stars + stars_amount)
-                )
-                
-                # Обновляем статус транзакции
-                await db.execute(
-                    update(Transaction)
-                    .where(Transaction.id == transaction_id)
-                    .values(
-                        status="completed",
-                        completed_at=datetime.utcnow()
-                    )
-                )
+                # Повторный запуск не начислит звезды дважды
+                if new_balance is None:
+                    logger.warning(f"TON payment {transaction_id} already processed")
+                    return
                 
                 await db.commit()
                 
-                # Отправляем уведомление (если есть Telegram ID)
-                new_balance = user.balance_stars + stars_amount
-                await telegram_service.notify_payment_success(
-                    user.telegram_id,
-                    stars_amount,
-                    new_balance
-                )
-                
                 logger.info(f"TON payment {transaction_id} completed successfully")
                 
             else:
-                # Помечаем как неудачную
-                await db.execute(
+                # Помечаем как неудачную, только если депозит еще в обработке:
+                # сканер мог уже зачесть его по memo
+                failed = await db.execute(
                     update(Transaction)
-                    .where(Transaction.id == transaction_id)
+                    .where(
+                        Transaction.id == transaction_id,
+                        Transaction.status == "processing"
+                    )
                     .values(status="failed")
                 )
-                await db.commit()
                 
-                await telegram_service.notify_payment_failed(
-                    user.telegram_id,
-                    "Transaction verification failed"
+                if failed.rowcount != 1:
+                    logger.warning(f"TON payment {transaction_id} already processed")
+                    return
+                
+                notifications.enqueue(
+                    db, user.telegram_id,
+                    telegram_service.format_payment_failed("Transaction verification failed"),
+                    kind="payment_failed"
                 )
+                await db.commit()
                 
                 logger.warning(f"TON payment {transaction_id} verification failed")
                 
         except Exception as e:
             logger.error(f"Error processing TON payment {transaction_id}: {str(e)}")
-            
-            # Помечаем как ошибку
-            try:
-                await db.execute(
-                    update(Transaction)
-                    .where(Transaction.id == transaction_id)
-                    .values(status="failed")
-                )
-                await db.commit()
-            except:
-                pass
+            raise
 
 
 async def process_telegram_payment(transaction_id: int, payment_id: str, payment_status: str):
-    """Обработка Telegram Stars платежа в фоне"""
+    """Обработка Telegram Stars платежа в фоне (ошибка - повтор задачи)"""
     from ..database import AsyncSessionLocal
     
     async with AsyncSessionLocal() as db:
@@ -413,61 +459,82 @@ async def process_telegram_payment(transaction_id: int, payment_id: str, payment
                 # Платеж успешен
                 stars_amount = int(transaction.amount)
                 
-                # Обновляем баланс пользователя
-                await db.execute(
-                    update(User)
-                    .where(User.id == user.id)
-                    .values(balance_stars=User.balance_stars + stars_amount)
-                )
-                
-                # Обновляем статус транзакции
-                await db.execute(
+                # Завершаем транзакцию, только если она еще в обработке:
+                # повторный запуск не начислит звезды дважды
+                completed = await db.execute(
                     update(Transaction)
-                    .where(Transaction.id == transaction_id)
+                    .where(
+                        Transaction.id == transaction_id,
+                        Transaction.status == "processing"
+                    )
                     .values(
                         status="completed",
                         completed_at=datetime.utcnow()
                     )
                 )
                 
-                await db.commit()
+                if completed.rowcount == 0:
+                    logger.warning(f"Telegram payment {transaction_id} already processed")
+                    return
+                
+                # Начисляем звезды атомарно
+                new_balance = await ledger.credit(db, user.id, stars_amount)
                 
-                # Отправляем уведомление
-                new_balance = user.balance_stars + stars_amount
-                await telegram_service.notify_payment_success(
-                    user.telegram_id,
-                    stars_amount,
-                    new_balance
+                # Уведомление уходит в очередь в той же транзакции
+                notifications.enqueue(
+                    db, user.telegram_id,
+                    telegram_service.format_payment_success(stars_amount, new_balance),
+                    kind="payment_success"
                 )
                 
+                await db.commit()
+                
                 logger.info(f"Telegram payment {transaction_id} completed successfully")
                 
             else:
-                # Платеж неудачен
-                await db.execute(
+                # Платеж неудачен: помечаем, только если транзакция еще в обработке
+                failed = await db.execute(
                     update(Transaction)
-                    .where(Transaction.id == transaction_id)
+                    .where(
+                        Transaction.id == transaction_id,
+                        Transaction.status == "processing"
+                    )
                     .values(status="failed")
                 )
-                await db.commit()
                 
-                await telegram_service.notify_payment_failed(
-                    user.telegram_id,
-                    f"Payment status: {payment_status}"
+                if failed.rowcount != 1:
+                    logger.warning(f"Telegram payment {transaction_id} already processed")
+                    return
+                
+                notifications.enqueue(
+                    db, user.telegram_id,
+                    telegram_service.format_payment_failed(f"Payment status: {payment_status}"),
+                    kind="payment_failed"
                 )
+                await db.commit()
                 
                 logger.warning(f"Telegram payment {transaction_id} failed with status: {payment_status}")
                 
         except Exception as e:
             logger.error(f"Error processing Telegram payment {transaction_id}: {str(e)}")
-            
-            # Помечаем как ошибку
-            try:
-                await db.execute(
-                    update(Transaction)
-                    .where(Transaction.id == transaction_id)
-                    .values(status="failed")
-                )
-                await db.commit()
-            except:
-                pass
\ No newline at end of file
+            raise
+
+
+async def fail_payment(transaction_id: int, **payload):
+    """Попытки обработки исчерпаны - помечаем платеж как ошибку"""
+    from ..database import AsyncSessionLocal
+    
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(Transaction)
+            .where(
+                Transaction.id == transaction_id,
+                Transaction.status == "processing"
+            )
+            .values(status="failed")
+        )
+        await db.commit()
+
+
+jobs.register("payment.ton", process_ton_payment, on_dead=fail_payment)
+jobs.register("payment.telegram", process_telegram_payment, on_dead=fail_payment)
@@ -1,18 +1,27 @@
 from datetime import datetime
 from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update, func
 from sqlalchemy.orm import selectinload
 
-from ..database import get_db
-from ..models import User, InventoryItem, Transaction
+from ..cache import cache
+from ..config import settings
+from ..database import get_db, get_read_db
+from ..models import User, Transaction, UserInventorySummary
+from ..pagination import before_cursor, decode_cursor, encode_cursor
+from ..presence import presence
+from ..referrals import referral_rollup, referral_tree
+from ..registration import register_user
 from ..schemas import (
     TelegramAuthRequest, TelegramAuthResponse, UserResponse, 
     UserProfileResponse, UserUpdate, HistoryFilter, HistoryResponse,
     TransactionResponse
 )
-from ..auth import verify_telegram_auth, validate_user_data, generate_referral_code, extract_referral_code
+from ..auth import (
+    Session, create_session_token, get_session, verify_telegram_auth,
+    validate_user_data, extract_referral_code
+)
 import logging
 
 logger = logging.getLogger(__name__)
@@ -35,71 +44,56 @@ async def telegram_auth(
         user_data = validate_user_data(raw_user_data)
         
         # Ищем существующего пользователя
-        result = await db.execute(
+        user = await db.scalar(
             select(User).where(User.telegram_id == user_data['telegram_id'])
         )
-        user = result.scalar_one_or_none()
         
-        if user:
-            # Обновляем время последней активности
-            await db.execute(
-                update(User)
-                .where(User.id == user.id)
-                .values(
-                    last_active=datetime.utcnow(),
-                    username=user_data['username'],
-                    first_name=user_data['first_name'],
-                    last_name=user_data['last_name']
-                )
-            )
-            await db.commit()
-            await db.refresh(user)
-            
-            logger.info(f"User {user.telegram_id} logged in")
-        else:
-            # Создаем нового пользователя
-            referral_code = generate_referral_code(user_data['telegram_id'])
-            
-            # Проверяем реферальный код
-            referring_user_id = None
+        created = False
+        if user is None:
+            # Регистрация и реферальный бонус - одна транзакция
             ref_code = extract_referral_code(user_data)
-            if ref_code:
-                ref_result = await db.execute(
-                    select(User).where(User.referral_code == ref_code)
+            user = await register_user(db, user_data, ref_code)
+            if user is not None:
+                await db.commit()
+                created = True
+                logger.info(f"New user {user.telegram_id} registered with referral: {ref_code}")
+            else:
+                # Параллельный вход того же пользователя уже создал его
+                user = await db.scalar(
+                    select(User).where(User.telegram_id == user_data['telegram_id'])
                 )
-                referring_user = ref_result.scalar_one_or_none()
-                if referring_user:
-                    referring_user_id = referring_user.id
-            
-            user = User(
-                telegram_id=user_data['telegram_id'],
-                username=user_data['username'],
-                first_name=user_data['first_name'],
-                last_name=user_data['last_name'],
-                referral_code=referral_code,
-                referred_by=referring_user_id,
-                balance_stars=100,  # Приветственный бонус
-                last_active=datetime.utcnow()
-            )
-            
-            db.add(user)
-            await db.commit()
-            await db.refresh(user)
-            
-            # Начисляем бонус рефереру
-            if referring_user_id:
+        
+        if not created:
+            # Профиль пишем только если Telegram данные изменились,
+            # last_active запишет буфер присутствия пакетом
+            profile = {
+                field: user_data[field]
+                for field in ('username', 'first_name', 'last_name')
+                if getattr(user, field) != user_data[field]
+            }
+            if profile:
                 await db.execute(
                     update(User)
-                    .where(User.id == referring_user_id)
-                    .values(balance_stars=User.balance_stars + 50)
+                    .where(User.id == user.id)
+                    .values(**profile)
                 )
                 await db.commit()
+                await db.refresh(user)
             
-            logger.info(f"New user {user.telegram_id} registered with referral: {ref_code}")
+            logger.info(f"User {user.telegram_id} logged in")
+        
+        presence.touch(user.id)
+        user_response = UserResponse.model_validate(user)
+        user_response.last_active = datetime.utcnow()
+        
+        # Дальше клиент ходит с токеном сессии, повторная проверка initData не нужна
+        access_token, expires_in = create_session_token(user.id, user.telegram_id)
         
         return TelegramAuthResponse(
             success=True,
-            user=UserResponse.model_validate(user)
+            user=user_response,
+            access_token=access_token,
+            expires_in=expires_in
         )
         
     except HTTPException:
@@ -112,8 +106,31 @@ async def telegram_auth(
         )
 
 
+@router.get("/me", response_model=UserResponse)
+async def get_current_user(
+    session: Session = Depends(get_session),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Текущий пользователь по токену сессии
+    
+    Токен проверяется без обращения к БД, сам запрос только читает
+    пользователя: открытие страницы не пишет в базу.
+    """
+    user = await db.scalar(select(User).where(User.id == session.user_id))
+    if not user or user.telegram_id != session.telegram_id:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired session token",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    
+    presence.touch(user.id)
+    return UserResponse.model_validate(user)
+
+
 @router.get("/{user_id}/profile", response_model=UserProfileResponse)
-async def get_user_profile(user_id: int, db: AsyncSession = Depends(get_db)):
+async def get_user_profile(user_id: int, db: AsyncSession = Depends(get_read_db)):
     """Получить полный профиль пользователя"""
     result = await db.execute(
         select(User).where(User.id == user_id)
@@ -126,6 +143,7 @@ async def get_user_profile(user_id: int, db: AsyncSession = Depends(get_db)):
             detail="User not found"
         )
     
+    presence.touch(user_id)
     return UserProfileResponse.model_validate(user)
 
 
@@ -162,8 +180,15 @@ async def update_user_profile(
 
 
 @router.get("/{user_id}/balance")
-async def get_user_balance(user_id: int, db: AsyncSession = Depends(get_db)):
-    """Получить баланс пользователя"""
+async def get_user_balance(user_id: int, db: AsyncSession = Depends(get_read_db)):
+    """
+    Получить баланс пользователя
+    
+    Баланс не кешируется: это одно чтение по первичному ключу, а запись
+    в кеш после чтения могла бы вернуть устаревшее значение, сброшенное
+    параллельным изменением баланса.
+    """
+    presence.touch(user_id)
     result = await db.execute(
         select(User.balance_stars, User.balance_ton).where(User.id == user_id)
     )
@@ -183,7 +208,7 @@ async def get_user_balance(user_id: int, db: AsyncSession = Depends(get_db)):
 
 
 @router.get("/{user_id}/stats")
-async def get_user_stats(user_id: int, db: AsyncSession = Depends(get_db)):
+async def get_user_stats(user_id: int, db: AsyncSession = Depends(get_read_db)):
     """Получить статистику пользователя"""
     # Основная информация о пользователе
     user_result = await db.execute(
@@ -197,39 +222,14 @@ async def get_user_stats(user_id: int, db: AsyncSession = Depends(get_db)):
             detail="User not found"
         )
     
-    # Статистика по предметам
-    inventory_stats = await db.execute(
-        select(
-            func.count(InventoryItem.id).label('total_items'),
-            func.count(InventoryItem.id).filter(InventoryItem.rarity == 'common').label('common_items'),
-            func.count(InventoryItem.id).filter(InventoryItem.rarity == 'rare').label('rare_items'),
-            func.count(InventoryItem.id).filter(InventoryItem.rarity == 'epic').label('epic_items'),
-            func.count(InventoryItem.id).filter(InventoryItem.rarity == 'legendary').label('legendary_items'),
-            func.count(InventoryItem.id).filter(InventoryItem.rarity == 'mythic').label('mythic_items'),
-        ).where(
-            InventoryItem.user_id == user_id,
-            InventoryItem.is_withdrawn == False
-        )
-    )
-    inventory = inventory_stats.first()
+    # Предметы по редкости - из сводки инвентаря (чтение по первичному ключу)
+    summary = (await db.scalars(
+        select(UserInventorySummary).where(UserInventorySummary.user_id == user_id)
+    )).all()
+    items_by_rarity = {row.rarity: row.items for row in summary}
     
-    # Статистика по транзакциям
-    transaction_stats = await db.execute(
-        select(
-            func.count(Transaction.id).filter(Transaction.type == 'case_purchase').label('total_purchases'),
-            func.sum(Transaction.amount).filter(Transaction.type == 'case_purchase').label('total_spent'),
-            func.sum(Transaction.amount).filter(Transaction.type == 'item_sale').label('total_earned'),
-        ).where(
-            Transaction.user_id == user_id,
-            Transaction.status == 'completed'
-        )
-    )
-    transactions = transaction_stats.first()
-    
-    # Количество рефералов
-    referrals_count = await db.scalar(
-        select(func.count(User.id)).where(User.referred_by == user_id)
-    )
+    # Количество рефералов - из итогов по рефералам
+    referral_stats = await referral_rollup.get(db, user_id)
     
     return {
         "user_id": user_id,
@@ -237,19 +237,20 @@ async def get_user_stats(user_id: int, db: AsyncSession = Depends(get_db)):
         "total_spent_stars": user.total_spent_stars,
         "total_earned_stars": user.total_earned_stars,
         "inventory": {
-            "total_items": inventory.total_items or 0,
-            "common_items": inventory.common_items or 0,
-            "rare_items": inventory.rare_items or 0,
-            "epic_items": inventory.epic_items or 0,
-            "legendary_items": inventory.legendary_items or 0,
-            "mythic_items": inventory.mythic_items or 0,
+            "total_items": sum(items_by_rarity.values()),
+            "common_items": items_by_rarity.get("common", 0),
+            "rare_items": items_by_rarity.get("rare", 0),
+            "epic_items": items_by_rarity.get("epic", 0),
+            "legendary_items": items_by_rarity.get("legendary", 0),
+            "mythic_items": items_by_rarity.get("mythic", 0),
         },
+        # Счетчики пользователя обновляются ledger вместе с покупками и продажами
         "transactions": {
-            "total_purchases": transactions.total_purchases or 0,
-            "total_spent": float(transactions.total_spent or 0),
-            "total_earned": float(transactions.total_earned or 0),
+            "total_purchases": user.total_cases_opened or 0,
+            "total_spent": float(user.total_spent_stars or 0),
+            "total_earned": float(user.total_earned_stars or 0),
         },
-        "referrals_count": referrals_count or 0,
+        "referrals_count": referral_stats["total_referrals"],
         "member_since": user.created_at.isoformat(),
         "last_active": user.last_active.isoformat() if user.last_active else None
     }
@@ -260,55 +261,96 @@ async def get_user_history(
     user_id: int,
     transaction_type: Optional[str] = None,
     currency: Optional[str] = None,
-    status: Optional[str] = None,
-    limit: int = 50,
-    offset: int = 0,
-    db: AsyncSession = Depends(get_db)
+    status_filter: Optional[str] = Query(None, alias="status"),
+    limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    include_total: bool = False,
+    db: AsyncSession = Depends(get_read_db)
 ):
-    """Получить историю операций пользователя"""
-    # Проверяем существование пользователя
-    user_exists = await db.scalar(
-        select(User.id).where(User.id == user_id)
-    )
-    
-    if not user_exists:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
+    """
+    Получить историю операций пользователя
     
-    # Строим запрос с фильтрами
-    query = select(Transaction).where(Transaction.user_id == user_id)
+    Keyset пагинация по (created_at, id): следующая страница запрашивается
+    с cursor=next_cursor и стоит одинаково на любой глубине. offset оставлен
+    для старых клиентов. Точное total считается только с include_total=true.
+    """
+    filters = [Transaction.user_id == user_id]
     
     if transaction_type:
-        query = query.where(Transaction.type == transaction_type)
+        filters.append(Transaction.type == transaction_type)
     
     if currency:
-        query = query.where(Transaction.currency == currency)
+        filters.append(Transaction.currency == currency)
     
-    if status:
-        query = query.where(Transaction.status == status)
+    if status_filter:
+        filters.append(Transaction.status == status_filter)
     
-    # Получаем общее количество
-    count_query = select(func.count()).select_from(query.subquery())
-    total = await db.scalar(count_query)
+    # Страница по индексу (user_id, created_at DESC, id DESC)
+    query = (
+        select(Transaction)
+        .where(*filters)
+        .order_by(Transaction.created_at.desc(), Transaction.id.desc())
+        .limit(limit + 1)
+    )
     
-    # Добавляем пагинацию и сортировку
-    query = query.order_by(Transaction.created_at.desc()).limit(limit).offset(offset)
+    if cursor:
+        try:
+            cursor_created_at, cursor_id = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+        query = query.where(
+            before_cursor(Transaction.created_at, Transaction.id, cursor_created_at, cursor_id)
+        )
+    elif offset:
+        query = query.offset(offset)
     
     result = await db.execute(query)
     transactions = result.scalars().all()
     
+    # Пустая страница - проверяем, существует ли пользователь
+    if not transactions:
+        user_exists = await db.scalar(
+            select(User.id).where(User.id == user_id)
+        )
+        
+        if not user_exists:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="User not found"
+            )
+    
+    has_more = len(transactions) > limit
+    transactions = transactions[:limit]
+    
+    total = None
+    if include_total:
+        total = await db.scalar(select(func.count(Transaction.id)).where(*filters))
+    
     return HistoryResponse(
         transactions=[TransactionResponse.model_validate(t) for t in transactions],
-        total=total or 0,
-        has_more=(offset + limit) < (total or 0)
+        total=total,
+        has_more=has_more,
+        next_cursor=encode_cursor(transactions[-1].created_at, transactions[-1].id) if has_more else None
     )
 
 
 @router.get("/{user_id}/referrals")
-async def get_user_referrals(user_id: int, db: AsyncSession = Depends(get_db)):
-    """Получить информацию о рефералах пользователя"""
+async def get_user_referrals(
+    user_id: int,
+    limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Получить информацию о рефералах пользователя
+    
+    Итоги читаются из referral_stats, список - страница по индексу
+    (referred_by, created_at DESC, id DESC) с keyset курсором next_cursor.
+    """
     # Проверяем существование пользователя
     user_result = await db.execute(
         select(User.referral_code).where(User.id == user_id)
@@ -321,8 +363,8 @@ async def get_user_referrals(user_id: int, db: AsyncSession = Depends(get_db)):
             detail="User not found"
         )
     
-    # Получаем список рефералов
-    referrals_result = await db.execute(
+    # Страница рефералов
+    query = (
         select(
             User.id,
             User.first_name,
@@ -331,13 +373,26 @@ async def get_user_referrals(user_id: int, db: AsyncSession = Depends(get_db)):
             User.total_cases_opened,
             User.last_active
         ).where(User.referred_by == user_id)
-        .order_by(User.created_at.desc())
+        .order_by(User.created_at.desc(), User.id.desc())
+        .limit(limit + 1)
     )
-    referrals = referrals_result.all()
+    
+    if cursor:
+        try:
+            cursor_created_at, cursor_id = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+        query = query.where(before_cursor(User.created_at, User.id, cursor_created_at, cursor_id))
+    
+    referrals = (await db.execute(query)).all()
+    has_more = len(referrals) > limit
+    referrals = referrals[:limit]
     
     # Статистика по рефералам
-    total_referrals = len(referrals)
-    active_referrals = sum(1 for ref in referrals if ref.total_cases_opened > 0)
+    referral_stats = await referral_rollup.get(db, user_id)
     
     # Реферальная ссылка
     referral_link = f"https://t.me/your_bot?start=ref_{user.referral_code}"
@@ -345,8 +400,7 @@ async def get_user_referrals(user_id: int, db: AsyncSession = Depends(get_db)):
     return {
         "referral_code": user.referral_code,
         "referral_link": referral_link,
-        "total_referrals": total_referrals,
-        "active_referrals": active_referrals,
+        **referral_stats,
         "referrals": [
             {
                 "id": ref.id,
@@ -358,5 +412,45 @@ async def get_user_referrals(user_id: int, db: AsyncSession = Depends(get_db)):
                 "is_active": ref.total_cases_opened > 0
             }
             for ref in referrals
-        ]
-    }
\ No newline at end of file
+        ],
+        "has_more": has_more,
+        "next_cursor": encode_cursor(referrals[-1].created_at, referrals[-1].id) if has_more else None
+    }
+
+
+@router.get("/{user_id}/referrals/tree")
+async def get_referral_tree(
+    user_id: int,
+    depth: int = Query(3, ge=1),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Рефералы по уровням (рефералы рефералов и т.д.)
+    
+    Рекурсивный запрос с ограничением глубины referral_tree_max_depth,
+    результат кешируется на referral_tree_cache_ttl секунд.
+    """
+    depth = min(depth, settings.referral_tree_max_depth)
+    cache_key = f"referrals:tree:{user_id}:{depth}"
+    
+    cached = await cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    user_exists = await db.scalar(select(User.id).where(User.id == user_id))
+    if not user_exists:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    
+    levels = await referral_tree(db, user_id, depth)
+    response = {
+        "user_id": user_id,
+        "depth": depth,
+        "total_referrals": sum(level["referrals"] for level in levels),
+        "levels": levels
+    }
+    
+    await cache.set(cache_key, response, ttl=settings.referral_tree_cache_ttl)
+    return response
@@ -2,10 +2,30 @@ import hmac
 import hashlib
 import json
 import time
+from dataclasses import dataclass
+from functools import lru_cache
 from urllib.parse import unquote, parse_qsl
-from typing import Optional, Dict, Any
-from fastapi import HTTPException, status
-from .config import settings
+from typing import Optional, Dict, Any, Tuple
+from fastapi import Header, HTTPException, status
+from jose import JWTError, jwt
+from .config import DEFAULT_SECRET_KEY, settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Тип токена сессии (claim typ), чтобы не принимать другие JWT с тем же ключом
+SESSION_TOKEN_TYPE = "session"
+
+
+@lru_cache(maxsize=4)
+def webapp_secret_key(bot_token: str) -> bytes:
+    """
+    Ключ проверки initData: HMAC-SHA256 токена бота с ключом "WebAppData"
+    
+    Зависит только от токена бота, поэтому вычисляется один раз
+    (при старте приложения) и дальше берется из кеша.
+    """
+    return hmac.new("WebAppData".encode(), bot_token.encode(), hashlib.sha256).digest()
 
 
 def verify_telegram_auth(init_data: str) -> Dict[str, Any]:
@@ -58,16 +78,9 @@ def verify_telegram_auth(init_data: str) -> Dict[str, Any]:
             for key, value in sorted(parsed_data.items())
         )
         
-        # Создаем секретный ключ
-        secret_key = hmac.new(
-            "WebAppData".encode(),
-            settings.telegram_bot_token.encode(),
-            hashlib.sha256
-        ).digest()
-        
         # Вычисляем ожидаемый hash
         calculated_hash = hmac.new(
-            secret_key,
+            webapp_secret_key(settings.telegram_bot_token),
             check_string.encode(),
             hashlib.sha256
         ).hexdigest()
@@ -121,6 +134,121 @@ def verify_telegram_auth(init_data: str) -> Dict[str, Any]:
         )
 
 
+@dataclass
+class Session:
+    """Пользователь из проверенного токена сессии"""
+    user_id: int
+    telegram_id: int
+    expires_at: int
+
+
+def session_secret_key() -> str:
+    """
+    Ключ подписи токенов сессии
+    
+    Ключ по умолчанию известен всем: без DEBUG токены с ним не выдаются
+    и не принимаются (иначе кто угодно выпустит токен любого пользователя).
+    
+    Raises:
+        HTTPException: SECRET_KEY не задан
+    """
+    if settings.secret_key == DEFAULT_SECRET_KEY and not settings.debug:
+        logger.error("Session tokens disabled: SECRET_KEY is not configured")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Session tokens are not configured"
+        )
+    return settings.secret_key
+
+
+def create_session_token(user_id: int, telegram_id: int) -> Tuple[str, int]:
+    """
+    Выпустить подписанный токен сессии после проверки initData
+    
+    Args:
+        user_id: ID пользователя
+        telegram_id: Telegram ID пользователя
+        
+    Returns:
+        Кортеж (токен, срок жизни в секундах)
+    """
+    expires_in = settings.access_token_expire_minutes * 60
+    now = int(time.time())
+    token = jwt.encode(
+        {
+            "sub": str(user_id),
+            "tg": telegram_id,
+            "typ": SESSION_TOKEN_TYPE,
+            "iat": now,
+            "exp": now + expires_in,
+        },
+        session_secret_key(),
+        algorithm=settings.algorithm
+    )
+    return token, expires_in
+
+
+def verify_session_token(token: str) -> Session:
+    """
+    Проверить токен сессии без обращения к БД (подпись и срок жизни)
+    
+    Raises:
+        HTTPException: Токен поврежден, подписан другим ключом или истек
+            (401); SECRET_KEY не задан (503)
+    """
+    secret_key = session_secret_key()
+    try:
+        claims = jwt.decode(token, secret_key, algorithms=[settings.algorithm])
+        if claims.get("typ") != SESSION_TOKEN_TYPE:
+            raise JWTError("Unexpected token type")
+        return Session(user_id=int(claims["sub"]), telegram_id=int(claims["tg"]), expires_at=int(claims["exp"]))
+    except (JWTError, KeyError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired session token",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+
+def get_session(authorization: Optional[str] = Header(None)) -> Session:
+    """
+    Dependency: сессия из заголовка Authorization: Bearer <токен>
+    
+    Raises:
+        HTTPException: Заголовка нет или токен невалиден
+    """
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Missing session token",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    return verify_session_token(token.strip())
+
+
+def require_metrics_access(x_metrics_token: Optional[str] = Header(None)):
+    """
+    Dependency: доступ к внутренним метрикам процесса
+    
+    Если задан METRICS_TOKEN, нужен заголовок X-Metrics-Token с ним;
+    иначе метрики открыты только в DEBUG. Без доступа эндпоинт
+    выглядит несуществующим (404).
+    
+    Raises:
+        HTTPException: Доступа нет
+    """
+    if settings.metrics_token:
+        allowed = x_metrics_token is not None and hmac.compare_digest(
+            x_metrics_token.encode(), settings.metrics_token.encode()
+        )
+    else:
+        allowed = settings.debug
+    
+    if not allowed:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+
+
 def extract_referral_code(user_data: Dict[str, Any]) -> Optional[str]:
     """
     Извлекает реферальный код из start_param
@@ -138,29 +266,93 @@ def extract_referral_code(user_data: Dict[str, Any]) -> Optional[str]:
     # Формат: start=ref_CODE или просто CODE
     if start_param.startswith('ref_'):
         return start_param[4:]  # Убираем префикс 'ref_'
-    elif start_param.startswith('CG'):
+    elif start_param.upper().startswith('CG'):
         return start_param  # Уже валидный код
     
     return None
 
 
-def generate_referral_code(telegram_id: int) -> str:
+# Алфавит Crockford base32: без I, L, O, U (не путаются с 1 и 0)
+REFERRAL_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+# Префикс кодов: CG + маркер схемы (старые коды - CG и 7 цифр)
+REFERRAL_PREFIX = "CGR"
+_REFERRAL_SYMBOLS = {symbol: index for index, symbol in enumerate(REFERRAL_ALPHABET)}
+_REFERRAL_SYMBOLS.update({"O": 0, "I": 1, "L": 1})
+
+
+def _referral_check_symbol(body: str) -> str:
     """
-    Генерирует уникальный реферальный код для пользователя
+    Контрольный символ Luhn mod 32
+    
+    Ловит любую ошибку в одном символе и перестановку соседних
+    символов (кроме пары 0 и Z).
+    """
+    base = len(REFERRAL_ALPHABET)
+    total = 0
+    factor = 2
+    for symbol in reversed(body):
+        addend = factor * _REFERRAL_SYMBOLS[symbol]
+        total += addend // base + addend % base
+        factor = 1 if factor == 2 else 2
+    return REFERRAL_ALPHABET[(base - total % base) % base]
+
+
+def generate_referral_code(user_id: int) -> str:
+    """
+    Генерирует реферальный код пользователя
+    
+    Биективная base32 запись User.id и контрольный символ: разные
+    пользователи всегда получают разные коды, а код декодируется
+    обратно в ID без запроса к БД (decode_referral_code).
     
     Args:
-        telegram_id: Telegram ID пользователя
+        user_id: ID пользователя
         
     Returns:
         Реферальный код
     """
-    # Простой алгоритм: CG + последние 6 цифр от telegram_id + checksum
-    base = str(telegram_id)[-6:].zfill(6)
+    if user_id < 1:
+        raise ValueError("User ID must be positive")
+    
+    base = len(REFERRAL_ALPHABET)
+    digits = []
+    value = user_id
+    while value > 0:
+        value -= 1
+        digits.append(REFERRAL_ALPHABET[value % base])
+        value //= base
+    body = "".join(reversed(digits))
     
-    # Простая контрольная сумма
-    checksum = sum(int(digit) for digit in base) % 10
+    return f"{REFERRAL_PREFIX}{body}{_referral_check_symbol(body)}"
+
+
+def decode_referral_code(code: str) -> Optional[int]:
+    """
+    ID пользователя из реферального кода без запроса к БД
+    
+    Регистр не важен, O, I и L читаются как 0, 1 и 1.
+    
+    Returns:
+        ID пользователя или None, если код не в текущей схеме
+        (старый код или ошибка в символах)
+    """
+    code = code.strip().upper()
+    if not code.startswith(REFERRAL_PREFIX) or len(code) < len(REFERRAL_PREFIX) + 2:
+        return None
+    
+    try:
+        symbols = [REFERRAL_ALPHABET[_REFERRAL_SYMBOLS[symbol]] for symbol in code[len(REFERRAL_PREFIX):]]
+    except KeyError:
+        return None
+    body, check = "".join(symbols[:-1]), symbols[-1]
+    if _referral_check_symbol(body) != check:
+        return None
     
-    return f"CG{base}{checksum}"
+    base = len(REFERRAL_ALPHABET)
+    user_id = 0
+    for symbol in body:
+        user_id = user_id * base + _REFERRAL_SYMBOLS[symbol] + 1
+    return user_id
 
 
 def validate_user_data(user_data: Dict[str, Any]) -> Dict[str, Any]:
@@ -0,0 +1,535 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Обработчики межпроцессной инвалидации: namespace -> [handler(key)]
+InvalidationHandler = Callable[[Optional[Any]], None]
+_handlers: Dict[str, List[InvalidationHandler]] = {}
+
+# Фоновые рассылки инвалидаций после коммита (ссылки держим до завершения)
+_broadcasts: Set[asyncio.Task] = set()
+
+
+def register_invalidation_handler(namespace: str, handler: InvalidationHandler):
+    """
+    Подписать локальный кеш процесса на инвалидацию
+
+    Args:
+        namespace: Пространство ключей (например "case" или "balance")
+        handler: Функция, принимающая ключ (None - сбросить все)
+    """
+    _handlers.setdefault(namespace, []).append(handler)
+
+
+def _run_handlers(namespace: str, key: Optional[Any]):
+    for handler in _handlers.get(namespace, []):
+        try:
+            handler(key)
+        except Exception as e:
+            logger.error(f"Invalidation handler for {namespace} failed: {str(e)}")
+
+
+def _run_all_handlers():
+    for namespace in list(_handlers):
+        _run_handlers(namespace, None)
+
+
+class CacheBackend:
+    """
+    Базовый интерфейс кеша
+
+    Значения должны быть JSON-совместимыми, ключи - строками.
+    Инвалидация по namespace удаляет общий ключ "<namespace>:<key>"
+    и рассылает событие всем процессам, которые сбрасывают свои
+    локальные кеши через зарегистрированные обработчики.
+    """
+
+    def __init__(self, default_ttl: int):
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations_sent = 0
+        self.invalidations_received = 0
+
+    async def start(self):
+        """Запуск фоновых задач бэкенда"""
+
+    async def close(self):
+        """Остановка бэкенда и закрытие соединений"""
+
+    async def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        raise NotImplementedError
+
+    async def delete(self, *keys: str):
+        raise NotImplementedError
+
+    async def publish(self, namespace: str, keys: List[Any]):
+        """Разослать событие инвалидации другим процессам"""
+        raise NotImplementedError
+
+    def invalidate_local(self, namespace: str, keys: Iterable[Any]):
+        """Сбросить ключи в текущем процессе (синхронно)"""
+        for key in keys:
+            _run_handlers(namespace, key)
+
+    async def broadcast(self, namespace: str, keys: Iterable[Any]):
+        """Удалить общие ключи и разослать событие другим процессам"""
+        keys = list(keys)
+        if not keys:
+            return
+
+        await self.delete(*(f"{namespace}:{key}" for key in keys if key is not None))
+        await self.publish(namespace, keys)
+        self.invalidations_sent += 1
+
+    async def invalidate(self, namespace: str, keys: Iterable[Any]):
+        """
+        Инвалидация ключей во всех процессах
+
+        Локальные обработчики вызываются сразу, общие ключи удаляются,
+        остальные процессы получают событие через pub/sub.
+        """
+        keys = list(keys)
+        self.invalidate_local(namespace, keys)
+        await self.broadcast(namespace, keys)
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики кеша"""
+        total = self.hits + self.misses
+        return {
+            "backend": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "invalidations_sent": self.invalidations_sent,
+            "invalidations_received": self.invalidations_received
+        }
+
+
+class MemoryCache(CacheBackend):
+    """
+    LRU кеш с TTL в памяти процесса
+
+    Подходит для одного воркера: события инвалидации никуда
+    не рассылаются, обработчики вызываются локально.
+    """
+
+    name = "memory"
+
+    def __init__(self, max_entries: int, default_ttl: int):
+        super().__init__(default_ttl)
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        ttl = self.default_ttl if ttl is None else ttl
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def invalidate_local(self, namespace: str, keys: Iterable[Any]):
+        keys = list(keys)
+        super().invalidate_local(namespace, keys)
+        # Для кеша в памяти процесса общие ключи тоже локальные
+        for key in keys:
+            if key is not None:
+                self._entries.pop(f"{namespace}:{key}", None)
+
+    async def publish(self, namespace: str, keys: List[Any]):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats.update(entries=len(self._entries), evictions=self.evictions)
+        return stats
+
+
+class RedisProtocolError(Exception):
+    """Ошибка ответа Redis-сервера"""
+
+
+class RedisConnection:
+    """
+    Минимальное соединение по протоколу RESP2
+
+    Поддерживает только то, что нужно кешу: команды с ответами
+    простых типов и чтение push-сообщений подписки.
+    """
+
+    def __init__(self, host: str, port: int, password: Optional[str] = None, db: int = 0):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.db = db
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self, timeout: float):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), timeout
+        )
+
+        if self.password:
+            await self.execute("AUTH", self.password)
+        if self.db:
+            await self.execute("SELECT", self.db)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+        self._reader = self._writer = None
+
+    def abort(self):
+        """Закрыть соединение без ожидания (безопасно при отмене задачи)"""
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def send(self, *args: Any):
+        self._writer.write(self._encode(args))
+        await self._writer.drain()
+
+    async def execute(self, *args: Any) -> Any:
+        await self.send(*args)
+        return await self.read_reply()
+
+    async def read_reply(self) -> Any:
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+
+        prefix, payload = line[:1], line[1:-2]
+
+        if prefix == b"+":
+            return payload.decode()
+        if prefix == b"-":
+            raise RedisProtocolError(payload.decode())
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            length = int(payload)
+            if length == -1:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2]
+        if prefix == b"*":
+            length = int(payload)
+            if length == -1:
+                return None
+            return [await self.read_reply() for _ in range(length)]
+
+        raise RedisProtocolError(f"Unexpected reply prefix: {prefix!r}")
+
+    @staticmethod
+    def _encode(args: Iterable[Any]) -> bytes:
+        parts = []
+        args = list(args)
+        parts.append(b"*%d\r\n" % len(args))
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+
+class RedisCache(CacheBackend):
+    """
+    Общий кеш на Redis (или любом сервере с протоколом Redis)
+
+    Значения хранятся в JSON, соединения берутся из небольшого пула.
+    Отдельное соединение держит подписку на канал инвалидации; после
+    переподключения локальные кеши сбрасываются полностью, так как
+    события за время разрыва могли быть потеряны.
+    """
+
+    name = "redis"
+
+    def __init__(
+        self,
+        url: str,
+        default_ttl: int,
+        channel: str,
+        pool_size: int = 4,
+        timeout: float = 2.0
+    ):
+        super().__init__(default_ttl)
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.channel = channel
+        self.timeout = timeout
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.errors = 0
+
+        self._pool: asyncio.Queue = asyncio.Queue()
+        self._pool_size = pool_size
+        self._created = 0
+        self._subscriber: Optional[asyncio.Task] = None
+        self._subscribed = asyncio.Event()
+
+    def _new_connection(self) -> RedisConnection:
+        return RedisConnection(self.host, self.port, self.password, self.db)
+
+    async def _acquire(self) -> RedisConnection:
+        if self._pool.empty() and self._created < self._pool_size:
+            self._created += 1
+            return self._new_connection()
+        return await self._pool.get()
+
+    async def _execute(self, *args: Any) -> Any:
+        conn = await self._acquire()
+        try:
+            if not conn.connected:
+                await conn.connect(self.timeout)
+            result = await asyncio.wait_for(conn.execute(*args), self.timeout)
+        except BaseException:
+            # Ошибка, таймаут или отмена могли оставить в сокете недочитанный
+            # ответ - соединение закрываем, его место в пуле занимает новое
+            conn.abort()
+            self._pool.put_nowait(self._new_connection())
+            raise
+
+        self._pool.put_nowait(conn)
+        return result
+
+    async def get(self, key: str) -> Optional[Any]:
+        try:
+            raw = await self._execute("GET", key)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Cache GET {key} failed: {str(e)}")
+            return None
+
+        if raw is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return json.loads(raw)
+
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        ttl = self.default_ttl if ttl is None else ttl
+        try:
+            await self._execute(
+                "SET", key, json.dumps(value, separators=(",", ":")), "PX", int(ttl * 1000)
+            )
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Cache SET {key} failed: {str(e)}")
+
+    async def delete(self, *keys: str):
+        if not keys:
+            return
+        try:
+            await self._execute("DEL", *keys)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Cache DEL failed: {str(e)}")
+
+    async def publish(self, namespace: str, keys: List[Any]):
+        message = json.dumps({"origin": self.origin, "ns": namespace, "keys": keys})
+        try:
+            await self._execute("PUBLISH", self.channel, message)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Cache PUBLISH failed: {str(e)}")
+
+    async def start(self):
+        if self._subscriber is None:
+            self._subscriber = asyncio.create_task(self._listen())
+
+    async def wait_subscribed(self, timeout: float = 5.0):
+        """Дождаться активной подписки на канал инвалидации"""
+        await asyncio.wait_for(self._subscribed.wait(), timeout)
+
+    async def close(self):
+        if self._subscriber is not None:
+            self._subscriber.cancel()
+            try:
+                await self._subscriber
+            except asyncio.CancelledError:
+                pass
+            self._subscriber = None
+
+        while not self._pool.empty():
+            await self._pool.get_nowait().close()
+        self._created = 0
+
+    async def _listen(self):
+        """Цикл подписки на канал инвалидации с переподключением"""
+        delay = 0.5
+        first = True
+
+        while True:
+            conn = self._new_connection()
+            try:
+                await conn.connect(self.timeout)
+                await conn.send("SUBSCRIBE", self.channel)
+                await conn.read_reply()
+
+                if not first:
+                    # Пока подписки не было, события могли потеряться
+                    logger.warning("Cache subscriber reconnected, dropping local caches")
+                    _run_all_handlers()
+                first = False
+                delay = 0.5
+                self._subscribed.set()
+
+                while True:
+                    reply = await conn.read_reply()
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                        self._handle_message(reply[2])
+
+            except asyncio.CancelledError:
+                await conn.close()
+                raise
+            except Exception as e:
+                self.errors += 1
+                self._subscribed.clear()
+                logger.warning(f"Cache subscriber error: {str(e)}, retry in {delay}s")
+                await conn.close()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 10)
+
+    def _handle_message(self, raw: bytes):
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            logger.warning(f"Invalid invalidation message: {raw!r}")
+            return
+
+        if message.get("origin") == self.origin:
+            return
+
+        self.invalidations_received += 1
+        for key in message.get("keys") or [None]:
+            _run_handlers(message.get("ns", ""), key)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats.update(
+            errors=self.errors,
+            subscribed=self._subscribed.is_set(),
+            pool_connections=self._created
+        )
+        return stats
+
+
+def create_cache() -> CacheBackend:
+    """Создать бэкенд кеша по настройкам"""
+    if settings.cache_backend == "redis":
+        return RedisCache(
+            url=settings.cache_url,
+            default_ttl=settings.cache_default_ttl,
+            channel=settings.cache_channel,
+            pool_size=settings.cache_pool_size
+        )
+
+    if settings.cache_backend != "memory":
+        logger.warning(f"Unknown cache backend {settings.cache_backend!r}, using memory")
+
+    return MemoryCache(
+        max_entries=settings.cache_max_entries,
+        default_ttl=settings.cache_default_ttl
+    )
+
+
+# Создаем глобальный экземпляр кеша
+cache = create_cache()
+
+
+def mark_invalidated(db, namespace: str, key: Any):
+    """
+    Запланировать инвалидацию ключа после коммита транзакции
+
+    Args:
+        db: Сессия БД (AsyncSession или Session)
+        namespace: Пространство ключей
+        key: Ключ внутри пространства
+    """
+    session = getattr(db, "sync_session", db)
+    pending = session.info.setdefault("cache_invalidations", {})
+    pending.setdefault(namespace, set()).add(key)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_invalidations(session):
+    """После коммита сбрасываем локальные кеши и рассылаем инвалидации"""
+    pending = session.info.pop("cache_invalidations", None)
+    if not pending:
+        return
+
+    for namespace, keys in pending.items():
+        cache.invalidate_local(namespace, keys)
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Вне event loop (миграции, скрипты) рассылать некому
+        return
+
+    for namespace, keys in pending.items():
+        task = loop.create_task(cache.broadcast(namespace, list(keys)))
+        _broadcasts.add(task)
+        task.add_done_callback(_broadcast_done)
+
+
+def _broadcast_done(task: asyncio.Task):
+    _broadcasts.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Cache invalidation broadcast failed: {task.exception()!r}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_invalidations(session):
+    """Откат транзакции - инвалидировать нечего"""
+    session.info.pop("cache_invalidations", None)
@@ -0,0 +1,233 @@
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from pydantic import TypeAdapter
+from sqlalchemy import select, event
+from fastapi import Request, Response, status
+
+from .cache import register_invalidation_handler
+from .config import settings
+from .models import Case, CaseItem
+from .schemas import CaseResponse, CaseDetailResponse
+import logging
+
+logger = logging.getLogger(__name__)
+
+_case_list_adapter = TypeAdapter(List[CaseResponse])
+
+
+class CatalogSnapshot:
+    """
+    Неизменяемый снимок каталога кейсов
+
+    Содержит все кейсы с предметами и мемоизирует уже сериализованные
+    ответы (тело + ETag) для каждого варианта запроса.
+    """
+
+    def __init__(self, version: int, cases: List[Case], items: Dict[int, List[dict]]):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.cases = sorted(cases, key=lambda case: case.price_stars)
+        self.items = items
+        self.by_id = {case.id: case for case in cases}
+        self._responses: Dict[Any, Tuple[bytes, str]] = {}
+
+    def active_cases(self) -> List[Case]:
+        return [case for case in self.cases if case.active]
+
+    def render(self, key: Any, build: Callable[["CatalogSnapshot"], Any]) -> Tuple[bytes, str]:
+        """
+        Получить сериализованный ответ из снимка
+
+        Args:
+            key: Ключ варианта ответа (эндпоинт + параметры)
+            build: Функция, строящая тело ответа (bytes или JSON-совместимый объект)
+
+        Returns:
+            Кортеж (тело ответа, ETag)
+        """
+        cached = self._responses.get(key)
+        if cached is not None:
+            return cached
+
+        body = build(self)
+        if not isinstance(body, bytes):
+            body = json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self._responses[key] = (body, etag)
+        return body, etag
+
+
+class CatalogCache:
+    """
+    Read-through кеш публичного каталога кейсов
+
+    Снимок пересобирается при изменении кейсов (версия увеличивается
+    событиями ORM) или по истечении TTL - чтобы подтянуть счетчики
+    total_opened, которые меняются при каждом открытии.
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._version = 0
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.not_modified = 0
+
+    def invalidate(self):
+        """Пометить текущий снимок устаревшим"""
+        self._version += 1
+
+    def _is_fresh(self, snapshot: Optional[CatalogSnapshot]) -> bool:
+        return (
+            snapshot is not None
+            and snapshot.version == self._version
+            and time.monotonic() - snapshot.built_at < self.ttl
+        )
+
+    async def get_snapshot(self) -> CatalogSnapshot:
+        """Текущий снимок каталога (пересобирается при необходимости)"""
+        snapshot = self._snapshot
+        if self._is_fresh(snapshot):
+            self.hits += 1
+            return snapshot
+
+        # Пересборку выполняет один запрос, остальные ждут ее результата
+        async with self._lock:
+            snapshot = self._snapshot
+            if self._is_fresh(snapshot):
+                self.hits += 1
+                return snapshot
+
+            self.misses += 1
+            snapshot = await self._build()
+            self._snapshot = snapshot
+            return snapshot
+
+    async def _build(self) -> CatalogSnapshot:
+        from .database import ReadSessionLocal
+
+        version = self._version
+        start = time.perf_counter()
+
+        async with ReadSessionLocal() as db:
+            cases = (await db.execute(select(Case))).scalars().all()
+            case_items = (await db.execute(
+                select(CaseItem).order_by(CaseItem.case_id, CaseItem.position)
+            )).scalars().all()
+
+        items: Dict[int, List[dict]] = {}
+        for item in case_items:
+            items.setdefault(item.case_id, []).append(item.to_dict())
+
+        self.rebuilds += 1
+        logger.info(
+            f"Catalog snapshot v{version} rebuilt: {len(cases)} cases "
+            f"in {(time.perf_counter() - start) * 1000:.1f}ms"
+        )
+
+        return CatalogSnapshot(version, list(cases), items)
+
+    def respond(
+        self,
+        request: Request,
+        snapshot: CatalogSnapshot,
+        key: Any,
+        build: Callable[[CatalogSnapshot], Any]
+    ) -> Response:
+        """
+        Ответ из снимка с ETag и Cache-Control
+
+        Если If-None-Match совпадает с текущим ETag, отдается 304 без тела.
+        """
+        body, etag = snapshot.render(key, build)
+
+        headers = {
+            "ETag": etag,
+            "Cache-Control": f"public, max-age={self.ttl}"
+        }
+
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            self.not_modified += 1
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики кеша"""
+        return {
+            "version": self._version,
+            "snapshot_version": self._snapshot.version if self._snapshot else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "rebuilds": self.rebuilds,
+            "not_modified": self.not_modified
+        }
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Сравнение ETag из If-None-Match (слабое сравнение по RFC 9110)"""
+    if not if_none_match:
+        return False
+
+    if if_none_match.strip() == "*":
+        return True
+
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+
+    return False
+
+
+def serialize_cases(cases: List[Case]) -> bytes:
+    """Список кейсов в формате List[CaseResponse]"""
+    return _case_list_adapter.dump_json(
+        [CaseResponse.model_validate(case) for case in cases]
+    )
+
+
+def serialize_case_detail(case: Case, items: List[dict]) -> bytes:
+    """Детали кейса в формате CaseDetailResponse"""
+    return CaseDetailResponse(
+        id=case.id,
+        name=case.name,
+        description=case.description,
+        price_stars=case.price_stars,
+        image_url=case.image_url,
+        category=case.category,
+        active=case.active,
+        total_opened=case.total_opened,
+        created_at=case.created_at,
+        items=items
+    ).model_dump_json().encode("utf-8")
+
+
+# Создаем глобальный экземпляр кеша
+catalog_cache = CatalogCache(ttl=settings.catalog_cache_ttl)
+
+# Изменение любого кейса на другом воркере делает снимок устаревшим
+register_invalidation_handler("case", lambda case_id: catalog_cache.invalidate())
+
+
+@event.listens_for(Case, "after_insert")
+@event.listens_for(Case, "after_update")
+@event.listens_for(Case, "after_delete")
+@event.listens_for(CaseItem, "after_insert")
+@event.listens_for(CaseItem, "after_update")
+@event.listens_for(CaseItem, "after_delete")
+def _invalidate_catalog(mapper, connection, target):
+    """Любое изменение кейсов через ORM делает снимок устаревшим
+
+    Остальным воркерам событие рассылает sampler после коммита.
+    """
+    catalog_cache.invalidate()
@@ -0,0 +1,58 @@
+import random
+from typing import Dict, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import settings
+from .database import dialect_insert
+from .models import GlobalCounter
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Имена счетчиков
+USERS = "users"
+CASES_OPENED = "cases_opened"
+
+
+class GlobalCounters:
+    """
+    Глобальные счетчики для публичной статистики
+
+    Счетчик хранится в stats_counter_shards строках global_counters:
+    инкремент попадает в случайный шард, поэтому параллельные регистрации
+    и открытия кейсов не ждут блокировку одной строки. Значение - сумма
+    шардов (десятки строк вместо сканирования таблицы users). Коммит
+    остается за вызывающим кодом.
+    """
+
+    async def increment(self, db: AsyncSession, name: str, amount: int = 1, shard: Optional[int] = None):
+        """
+        Увеличить счетчик в текущей транзакции
+
+        Args:
+            db: Сессия БД
+            name: Имя счетчика
+            amount: Приращение
+            shard: Номер шарда (по умолчанию случайный)
+        """
+        if shard is None:
+            shard = random.randrange(settings.stats_counter_shards)
+
+        statement = dialect_insert(GlobalCounter).values(name=name, shard=shard, value=amount)
+        await db.execute(statement.on_conflict_do_update(
+            index_elements=["name", "shard"],
+            set_={"value": GlobalCounter.value + statement.excluded.value}
+        ))
+
+    async def totals(self, db: AsyncSession) -> Dict[str, int]:
+        """Значения всех счетчиков"""
+        rows = await db.execute(
+            select(GlobalCounter.name, func.sum(GlobalCounter.value)).group_by(GlobalCounter.name)
+        )
+        return {name: int(value or 0) for name, value in rows}
+
+
+# Создаем глобальный экземпляр счетчиков
+global_counters = GlobalCounters()
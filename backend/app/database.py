@@ -1,11 +1,20 @@
+from fastapi import Request
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import StaticPool, AsyncAdaptedQueuePool
 from .config import settings
 
+# Профиль SQLite для файловой БД: WAL, прагмы и отдельный пул для чтения
+sqlite_tuned = (
+    settings.database_url.startswith("sqlite")
+    and ":memory:" not in settings.database_url
+    and settings.sqlite_tuning
+)
+
 # Создаем движок БД
-if settings.database_url.startswith("sqlite"):
-    # SQLite настройки
+if settings.database_url.startswith("sqlite") and ":memory:" in settings.database_url:
+    # SQLite в памяти живет только внутри одного соединения
     engine = create_async_engine(
         settings.database_url,
         echo=settings.debug,
@@ -14,13 +23,85 @@ if settings.database_url.startswith("sqlite"):
             "check_same_thread": False,
         },
     )
+elif settings.database_url.startswith("sqlite"):
+    # SQLite настройки: одно пишущее соединение, которое сессии получают
+    # по очереди (очередь пула - это и есть очередь записи). Общее соединение
+    # без очереди (StaticPool) смешивает транзакции параллельных запросов:
+    # rollback одного откатывает чужие изменения.
+    engine = create_async_engine(
+        settings.database_url,
+        echo=settings.debug,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=settings.sqlite_write_timeout,
+        connect_args={
+            "check_same_thread": False,
+        },
+    )
+    
+    if sqlite_tuned:
+        # В режиме WAL читатели не блокируют писателя и друг друга,
+        # поэтому GET запросы идут через отдельный пул read-only соединений
+        read_engine = create_async_engine(
+            settings.database_url,
+            echo=settings.debug,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=settings.sqlite_read_pool_size,
+            max_overflow=0,
+            connect_args={
+                "check_same_thread": False,
+            },
+        )
 else:
-    # PostgreSQL настройки (для будущего использования)
+    # PostgreSQL (asyncpg): пул соединений и серверные подготовленные выражения.
+    # Каждое выражение asyncpg готовит на сервере один раз на соединение и
+    # дальше переиспользует из кеша, поэтому повторяющиеся запросы не парсятся заново.
     engine = create_async_engine(
         settings.database_url,
         echo=settings.debug,
-        pool_pre_ping=True,
-        pool_recycle=300,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        # Горячие соединения переиспользуются, лишние простаивают и закрываются по recycle
+        pool_use_lifo=True,
+        connect_args={
+            "statement_cache_size": settings.db_statement_cache_size,
+            "prepared_statement_cache_size": settings.db_prepared_statement_cache_size,
+            "command_timeout": settings.db_command_timeout,
+            "server_settings": {"application_name": settings.app_name},
+        },
+    )
+
+if not sqlite_tuned:
+    # Для PostgreSQL и SQLite без профиля читаем через основной пул
+    read_engine = engine
+
+
+def _apply_sqlite_pragmas(dbapi_connection, read_only: bool):
+    """Прагмы производительности SQLite для нового соединения"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+    cursor.execute(f"PRAGMA mmap_size={settings.sqlite_mmap_size}")
+    cursor.execute(f"PRAGMA cache_size=-{settings.sqlite_cache_size_kb}")
+    cursor.execute(f"PRAGMA busy_timeout={settings.sqlite_busy_timeout}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    if read_only:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+if sqlite_tuned:
+    event.listen(
+        engine.sync_engine, "connect",
+        lambda dbapi_connection, record: _apply_sqlite_pragmas(dbapi_connection, read_only=False)
+    )
+    event.listen(
+        read_engine.sync_engine, "connect",
+        lambda dbapi_connection, record: _apply_sqlite_pragmas(dbapi_connection, read_only=True)
     )
 
 # Создаем фабрику сессий
@@ -30,13 +111,40 @@ AsyncSessionLocal = async_sessionmaker(
     expire_on_commit=False
 )
 
+# Сессии только для чтения (GET эндпоинты)
+ReadSessionLocal = async_sessionmaker(
+    bind=read_engine,
+    class_=AsyncSession,
+    expire_on_commit=False
+)
+
 # Базовый класс для моделей
 Base = declarative_base()
 
 
-async def get_db() -> AsyncSession:
-    """Dependency для получения сессии БД"""
+def dialect_insert(table):
+    """
+    INSERT текущего диалекта с ON CONFLICT (on_conflict_do_nothing / do_update)
+
+    SQLite и PostgreSQL поддерживают одинаковый синтаксис.
+    """
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+async def get_db(request: Request) -> AsyncSession:
+    """
+    Dependency для получения сессии БД
+
+    Соединение берется из пула только при первом запросе к БД и
+    возвращается сразу после обработки запроса (release_request_session),
+    а не после отправки ответа клиенту.
+    """
     async with AsyncSessionLocal() as session:
+        request.state.db_session = session
         try:
             yield session
         except Exception:
@@ -46,8 +154,86 @@ async def get_db() -> AsyncSession:
             await session.close()
 
 
+async def get_read_db(request: Request) -> AsyncSession:
+    """Dependency для сессии только для чтения (отдельный пул для SQLite)"""
+    async with ReadSessionLocal() as session:
+        request.state.db_read_session = session
+        try:
+            yield session
+        finally:
+            await session.close()
+
+
+async def release_request_session(request: Request):
+    """Вернуть соединения сессий запроса в пул"""
+    for name in ("db_session", "db_read_session"):
+        session = getattr(request.state, name, None)
+        if session is not None:
+            setattr(request.state, name, None)
+            await session.close()
+
+
+class PoolMetrics:
+    """Счетчики использования пула соединений"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.checkouts = 0
+        self.connects = 0
+
+        event.listen(engine.sync_engine, "checkout", self.on_checkout)
+        event.listen(engine.sync_engine, "checkin", self.on_checkin)
+        event.listen(engine.sync_engine, "connect", self.on_connect)
+
+    def on_checkout(self, *args):
+        self.checkouts += 1
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def on_checkin(self, *args):
+        self.in_use = max(self.in_use - 1, 0)
+
+    def on_connect(self, *args):
+        self.connects += 1
+
+    def stats(self) -> dict:
+        """Текущее состояние пула"""
+        pool = self.engine.pool
+        stats = {
+            "pool": type(pool).__name__,
+            "in_use": self.in_use,
+            "peak_in_use": self.peak_in_use,
+            "checkouts": self.checkouts,
+            "connects": self.connects,
+        }
+
+        if hasattr(pool, "size"):
+            stats.update(
+                size=pool.size(),
+                checked_in=pool.checkedin(),
+                overflow=pool.overflow(),
+                max_overflow=getattr(pool, "_max_overflow", 0),
+            )
+
+        return stats
+
+
+pool_metrics = PoolMetrics(engine)
+read_pool_metrics = PoolMetrics(read_engine) if read_engine is not engine else None
+
+
+def pool_stats() -> dict:
+    """Использование пулов соединений (основной и, если есть, для чтения)"""
+    stats = pool_metrics.stats()
+    if read_pool_metrics is not None:
+        stats["read_pool"] = read_pool_metrics.stats()
+    return stats
+
+
 async def init_db():
-    """Создание всех таблиц в БД"""
+    """Создание всех таблиц в БД (для тестов и бенчмарков, в остальных случаях - миграции)"""
     async with engine.begin() as conn:
         # Импортируем все модели чтобы они были зарегистрированы
         from . import models
@@ -57,7 +243,16 @@ async def init_db():
         print("✅ Database tables created successfully")
 
 
+def dispose_after_fork():
+    """Забыть соединения пулов, унаследованные от родительского процесса"""
+    engine.sync_engine.dispose(close=False)
+    if read_engine is not engine:
+        read_engine.sync_engine.dispose(close=False)
+
+
 async def close_db():
     """Закрытие соединения с БД"""
     await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
     print("✅ Database connection closed")
\ No newline at end of file
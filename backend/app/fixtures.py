@@ -0,0 +1,97 @@
+import json
+from sqlalchemy import select, func
+
+from .database import AsyncSessionLocal
+from .models import Case, CaseItem
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+async def load_test_data():
+    """Загрузка тестовых данных для разработки
+
+    Returns:
+        Количество созданных кейсов (0, если данные уже есть)
+    """
+    logger.info("📦 Loading test data...")
+    
+    async with AsyncSessionLocal() as db:
+        # Проверяем, есть ли уже кейсы
+        existing_cases = await db.scalar(select(func.count(Case.id)))
+        
+        if existing_cases > 0:
+            logger.info("Test data already exists, skipping...")
+            return 0
+        
+        # Создаем тестовые кейсы
+        test_cases = [
+            {
+                "name": "Telegram Case #1",
+                "description": "Базовый кейс с обычными предметами",
+                "price_stars": 150,
+                "category": "basic",
+                "image_url": "assets/cases/case1.png",
+                "items": [
+                    {"id": 1, "name": "Blue Bow Tie", "value": 25.6, "stars": 2556, "rarity": "common", "weight": 40, "image": "assets/gifts/gift2.png"},
+                    {"id": 2, "name": "Pink Teddy Bear", "value": 45.5, "stars": 4550, "rarity": "common", "weight": 30, "image": "assets/gifts/gift3.png"},
+                    {"id": 3, "name": "Telegram Cap", "value": 65.0, "stars": 6500, "rarity": "rare", "weight": 20, "image": "assets/gifts/gift4.png"},
+                    {"id": 4, "name": "Golden Star", "value": 125.0, "stars": 12500, "rarity": "epic", "weight": 10, "image": "assets/gifts/gift5.png"}
+                ]
+            },
+            {
+                "name": "Telegram Case #2", 
+                "description": "Улучшенный кейс с редкими предметами",
+                "price_stars": 250,
+                "category": "premium",
+                "image_url": "assets/cases/case2.png",
+                "items": [
+                    {"id": 5, "name": "Magic Hat", "value": 85.0, "stars": 8500, "rarity": "rare", "weight": 35, "image": "assets/gifts/gift6.png"},
+                    {"id": 6, "name": "Diamond Ring", "value": 180.5, "stars": 18050, "rarity": "epic", "weight": 25, "image": "assets/gifts/gift7.png"},
+                    {"id": 7, "name": "Crown", "value": 350.0, "stars": 35000, "rarity": "legendary", "weight": 15, "image": "assets/gifts/gift8.png"},
+                    {"id": 8, "name": "Mystic Scroll", "value": 750.0, "stars": 75000, "rarity": "mythic", "weight": 5, "image": "assets/gifts/gift9.png"}
+                ]
+            },
+            {
+                "name": "Premium Case",
+                "description": "Эксклюзивный кейс с легендарными предметами",
+                "price_stars": 500,
+                "category": "premium",
+                "image_url": "assets/cases/case_mock.png",
+                "items": [
+                    {"id": 9, "name": "Rare Artifact", "value": 450.0, "stars": 45000, "rarity": "legendary", "weight": 40, "image": "assets/gifts/gift10.png"},
+                    {"id": 10, "name": "Ancient Relic", "value": 850.0, "stars": 85000, "rarity": "mythic", "weight": 30, "image": "assets/gifts/gift11.png"},
+                    {"id": 11, "name": "Dragon Egg", "value": 1500.0, "stars": 150000, "rarity": "mythic", "weight": 20, "image": "assets/gifts/gift12.png"},
+                    {"id": 12, "name": "Ultimate Prize", "value": 3000.0, "stars": 300000, "rarity": "mythic", "weight": 10, "image": "assets/gifts/gift1.png"}
+                ]
+            }
+        ]
+        
+        for case_data in test_cases:
+            case = Case(
+                name=case_data["name"],
+                description=case_data["description"],
+                price_stars=case_data["price_stars"],
+                category=case_data["category"],
+                image_url=case_data["image_url"],
+                items=json.dumps(case_data["items"]),
+                active=True,
+                case_items=[
+                    CaseItem(
+                        item_id=item["id"],
+                        name=item["name"],
+                        value=item["value"],
+                        stars=item["stars"],
+                        rarity=item["rarity"],
+                        image_url=item["image"],
+                        weight=item["weight"],
+                        position=position
+                    )
+                    for position, item in enumerate(case_data["items"])
+                ]
+            )
+            db.add(case)
+        
+        await db.commit()
+        logger.info(f"✅ Created {len(test_cases)} test cases")
+        return len(test_cases)
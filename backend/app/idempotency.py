@@ -0,0 +1,169 @@
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import settings
+from .database import dialect_insert
+from .models import IdempotencyKey
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Заголовок ответа, повторенного из сохраненного результата
+REPLAY_HEADER = "Idempotent-Replayed"
+# Просроченных ключей за одну очистку
+CLEANUP_BATCH = 1000
+# Секунды, на которые захватывается ключ до сохранения ответа
+# (после падения процесса посреди запроса повтор выполнится заново)
+IN_PROGRESS_LEASE = 60
+
+_last_cleanup = 0.0
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+class IdempotentRequest:
+    """
+    Запрос, захвативший ключ идемпотентности
+
+    Ключ вставляется в транзакции запроса, поэтому фиксируется вместе
+    с результатом (или откатывается вместе с ним). Запрос без ключа -
+    пустая обертка, save и release ничего не делают.
+    """
+
+    def __init__(self, db: AsyncSession, key: Optional[str] = None, replay: Optional[JSONResponse] = None):
+        self.db = db
+        self.key = key
+        self.replay = replay
+
+    async def save(self, response: BaseModel, status_code: int = status.HTTP_200_OK):
+        """Сохранить ответ (до коммита транзакции запроса)"""
+        if self.key is None:
+            return
+        await self.db.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.key == self.key)
+            .values(
+                status_code=status_code,
+                response=response.model_dump_json(),
+                expires_at=datetime.utcnow() + timedelta(hours=settings.idempotency_ttl_hours)
+            )
+        )
+
+    async def release(self):
+        """
+        Освободить ключ после ошибки, если он уже закоммичен без ответа
+        (запрос с промежуточным коммитом), чтобы повтор выполнился заново
+
+        Незакоммиченные изменения запроса откатываются, ключ удаляется в
+        сессии запроса: отдельная сессия на SQLite ждала бы единственное
+        соединение записи, занятое этой же сессией.
+        """
+        if self.key is None:
+            return
+        await self.db.rollback()
+        await self.db.execute(
+            delete(IdempotencyKey).where(
+                IdempotencyKey.key == self.key,
+                IdempotencyKey.status_code.is_(None)
+            )
+        )
+        await self.db.commit()
+
+
+async def begin(db: AsyncSession, scope: str, key: Optional[str], params: Dict[str, Any]) -> IdempotentRequest:
+    """
+    Захватить ключ идемпотентности или получить сохраненный ответ
+
+    Args:
+        db: Сессия запроса
+        scope: Область ключа (эндпоинт), один ключ в разных областях независим
+        key: Idempotency-Key или внешний ID платежа (None - без идемпотентности)
+        params: Параметры запроса; тот же ключ с другими параметрами - ошибка 422
+
+    Returns:
+        IdempotentRequest; если replay не None, его нужно вернуть без выполнения запроса
+
+    Raises:
+        HTTPException: 409, если запрос с этим ключом еще выполняется; 422 при
+            повторном использовании ключа с другими параметрами
+    """
+    if not key:
+        return IdempotentRequest(db)
+
+    key_hash = _digest(f"{scope}:{key}")
+    fingerprint = _digest(json.dumps(params, sort_keys=True, default=str))
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=IN_PROGRESS_LEASE)
+
+    await _cleanup(db, now)
+
+    inserted = await db.execute(
+        dialect_insert(IdempotencyKey)
+        .values(key=key_hash, fingerprint=fingerprint, expires_at=expires_at)
+        .on_conflict_do_nothing(index_elements=["key"])
+    )
+    if inserted.rowcount == 1:
+        return IdempotentRequest(db, key_hash)
+
+    # Просроченный (или брошенный упавшим процессом) ключ можно занять заново
+    reclaimed = await db.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.key == key_hash, IdempotencyKey.expires_at < now)
+        .values(fingerprint=fingerprint, status_code=None, response=None, expires_at=expires_at)
+    )
+    if reclaimed.rowcount == 1:
+        return IdempotentRequest(db, key_hash)
+
+    stored = (await db.execute(
+        select(IdempotencyKey.fingerprint, IdempotencyKey.status_code, IdempotencyKey.response)
+        .where(IdempotencyKey.key == key_hash)
+    )).first()
+
+    if stored is None or stored.status_code is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Request with this idempotency key is in progress"
+        )
+
+    if stored.fingerprint != fingerprint:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency key was already used with different parameters"
+        )
+
+    logger.info(f"Replaying stored response for {scope} request")
+    return IdempotentRequest(db, replay=JSONResponse(
+        status_code=stored.status_code,
+        content=json.loads(stored.response),
+        headers={REPLAY_HEADER: "true"}
+    ))
+
+
+async def _cleanup(db: AsyncSession, now: datetime):
+    """Удалить пачку просроченных ключей (не чаще раза в минуту на процесс)"""
+    global _last_cleanup
+    if time.monotonic() - _last_cleanup < 60:
+        return
+    _last_cleanup = time.monotonic()
+
+    expired = (
+        select(IdempotencyKey.key)
+        .where(IdempotencyKey.expires_at < now)
+        .limit(CLEANUP_BATCH)
+    )
+    await db.execute(
+        delete(IdempotencyKey)
+        .where(IdempotencyKey.key.in_(expired.scalar_subquery()))
+        .execution_options(synchronize_session=False)
+    )
@@ -0,0 +1,236 @@
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import DateTime, case, delete, func, insert, literal, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import dialect_insert
+from .models import InventoryItem, UserInventorySummary
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class InventorySummary:
+    """
+    Сводка инвентаря пользователя, обновляемая при записи
+
+    Строка на (пользователь, редкость): количество и суммы предметов в
+    инвентаре и выведенных, самый дорогой предмет. Меняется атомарными
+    UPDATE/upsert в транзакции открытия, продажи, вывода и удаления,
+    поэтому статистика инвентаря - чтение нескольких строк по первичному
+    ключу вместо агрегатов по всему инвентарю. Коммит остается за
+    вызывающим кодом.
+    """
+
+    async def add(self, db: AsyncSession, items: Iterable[Any]):
+        """
+        Учесть новые предметы (после flush/INSERT ... RETURNING - нужен id)
+
+        Args:
+            db: Сессия БД
+            items: Предметы инвентаря (атрибуты InventoryItem)
+        """
+        groups: Dict[tuple, List[Any]] = defaultdict(list)
+        for item in items:
+            groups[(item.user_id, item.rarity)].append(item)
+
+        now = datetime.utcnow()
+        for (user_id, rarity), group in groups.items():
+            best = max(group, key=lambda item: Decimal(str(item.item_value)))
+            statement = dialect_insert(UserInventorySummary).values(
+                user_id=user_id,
+                rarity=rarity,
+                items=len(group),
+                items_value=sum(Decimal(str(item.item_value)) for item in group),
+                items_stars=sum(item.item_stars for item in group),
+                withdrawn_items=0,
+                withdrawn_value=0,
+                withdrawn_stars=0,
+                best_item_id=best.id,
+                best_item_name=best.item_name,
+                best_item_value=best.item_value,
+                updated_at=now
+            )
+            # excluded["items"]: атрибут items у коллекции колонок занят методом
+            new = statement.excluded
+            # В SET видны значения строки до обновления
+            better = or_(
+                UserInventorySummary.best_item_id.is_(None),
+                new["best_item_value"] > UserInventorySummary.best_item_value
+            )
+            await db.execute(statement.on_conflict_do_update(
+                index_elements=["user_id", "rarity"],
+                set_={
+                    "items": UserInventorySummary.items + new["items"],
+                    "items_value": UserInventorySummary.items_value + new["items_value"],
+                    "items_stars": UserInventorySummary.items_stars + new["items_stars"],
+                    "best_item_id": case((better, new["best_item_id"]), else_=UserInventorySummary.best_item_id),
+                    "best_item_name": case((better, new["best_item_name"]), else_=UserInventorySummary.best_item_name),
+                    "best_item_value": case((better, new["best_item_value"]), else_=UserInventorySummary.best_item_value),
+                    "updated_at": now,
+                }
+            ))
+
+    async def remove(self, db: AsyncSession, item: Any, withdrawn: bool = False):
+        """
+        Учесть удаление предмета (после DELETE)
+
+        Args:
+            db: Сессия БД
+            item: Удаленный предмет
+            withdrawn: Предмет был выведен
+        """
+        if withdrawn:
+            values = {
+                "withdrawn_items": UserInventorySummary.withdrawn_items - 1,
+                "withdrawn_value": UserInventorySummary.withdrawn_value - item.item_value,
+                "withdrawn_stars": UserInventorySummary.withdrawn_stars - item.item_stars,
+            }
+        else:
+            values = {
+                "items": UserInventorySummary.items - 1,
+                "items_value": UserInventorySummary.items_value - item.item_value,
+                "items_stars": UserInventorySummary.items_stars - item.item_stars,
+            }
+        await self._update(db, item, values, refresh_best=not withdrawn)
+
+    async def withdraw(self, db: AsyncSession, item: Any):
+        """Учесть вывод предмета (после UPDATE is_withdrawn)"""
+        await self._update(db, item, {
+            "items": UserInventorySummary.items - 1,
+            "items_value": UserInventorySummary.items_value - item.item_value,
+            "items_stars": UserInventorySummary.items_stars - item.item_stars,
+            "withdrawn_items": UserInventorySummary.withdrawn_items + 1,
+            "withdrawn_value": UserInventorySummary.withdrawn_value + item.item_value,
+            "withdrawn_stars": UserInventorySummary.withdrawn_stars + item.item_stars,
+        }, refresh_best=True)
+
+    async def _update(self, db: AsyncSession, item: Any, values: Dict[str, Any], refresh_best: bool):
+        best_item_id = await db.scalar(
+            update(UserInventorySummary)
+            .where(UserInventorySummary.user_id == item.user_id, UserInventorySummary.rarity == item.rarity)
+            .values(**values, updated_at=datetime.utcnow())
+            .returning(UserInventorySummary.best_item_id)
+        )
+        if refresh_best and best_item_id == item.id:
+            # Ушел самый дорогой предмет - ищем следующий по индексу (user_id, rarity)
+            best = (await db.execute(
+                select(InventoryItem.id, InventoryItem.item_name, InventoryItem.item_value)
+                .where(
+                    InventoryItem.user_id == item.user_id,
+                    InventoryItem.rarity == item.rarity,
+                    InventoryItem.is_withdrawn == False
+                )
+                .order_by(InventoryItem.item_value.desc(), InventoryItem.id)
+                .limit(1)
+            )).first()
+            await db.execute(
+                update(UserInventorySummary)
+                .where(UserInventorySummary.user_id == item.user_id, UserInventorySummary.rarity == item.rarity)
+                .values(
+                    best_item_id=best.id if best else None,
+                    best_item_name=best.item_name if best else None,
+                    best_item_value=best.item_value if best else None
+                )
+            )
+
+    async def rebuild(self, db: AsyncSession, user_id: Optional[int] = None) -> int:
+        """
+        Пересчитать сводку по инвентарю (восстановление после ручных правок)
+
+        Args:
+            db: Сессия БД
+            user_id: Пользователь (по умолчанию - все)
+
+        Returns:
+            Количество строк сводки
+        """
+        items_scope = [InventoryItem.user_id == user_id] if user_id is not None else []
+        summary_scope = [UserInventorySummary.user_id == user_id] if user_id is not None else []
+        await db.execute(delete(UserInventorySummary).where(*summary_scope))
+
+        active = InventoryItem.is_withdrawn == False
+        withdrawn = InventoryItem.is_withdrawn == True
+        result = await db.execute(insert(UserInventorySummary).from_select(
+            ["user_id", "rarity", "items", "items_value", "items_stars",
+             "withdrawn_items", "withdrawn_value", "withdrawn_stars", "updated_at"],
+            select(
+                InventoryItem.user_id,
+                InventoryItem.rarity,
+                func.count(InventoryItem.id).filter(active),
+                func.coalesce(func.sum(InventoryItem.item_value).filter(active), 0),
+                func.coalesce(func.sum(InventoryItem.item_stars).filter(active), 0),
+                func.count(InventoryItem.id).filter(withdrawn),
+                func.coalesce(func.sum(InventoryItem.item_value).filter(withdrawn), 0),
+                func.coalesce(func.sum(InventoryItem.item_stars).filter(withdrawn), 0),
+                literal(datetime.utcnow(), DateTime),
+            )
+            .where(*items_scope)
+            .group_by(InventoryItem.user_id, InventoryItem.rarity)
+        ))
+
+        best = (
+            select(InventoryItem.id)
+            .where(
+                InventoryItem.user_id == UserInventorySummary.user_id,
+                InventoryItem.rarity == UserInventorySummary.rarity,
+                active
+            )
+            .order_by(InventoryItem.item_value.desc(), InventoryItem.id)
+            .limit(1)
+            .scalar_subquery()
+        )
+        await db.execute(update(UserInventorySummary).where(*summary_scope).values(best_item_id=best))
+
+        best_item = InventoryItem.id == UserInventorySummary.best_item_id
+        await db.execute(
+            update(UserInventorySummary)
+            .where(*summary_scope, UserInventorySummary.best_item_id.is_not(None))
+            .values(
+                best_item_name=select(InventoryItem.item_name).where(best_item).scalar_subquery(),
+                best_item_value=select(InventoryItem.item_value).where(best_item).scalar_subquery()
+            )
+        )
+        return max(result.rowcount, 0)
+
+
+def summarize(rows: Iterable[UserInventorySummary]) -> Dict[str, Any]:
+    """
+    Итоги по строкам сводки пользователя
+
+    Returns:
+        Словарь с total_items, portfolio_value, portfolio_stars,
+        withdrawn_items, by_rarity и most_valuable_item
+    """
+    rows = list(rows)
+    best = max(
+        (row for row in rows if row.best_item_id is not None),
+        key=lambda row: row.best_item_value,
+        default=None
+    )
+    return {
+        "total_items": sum(row.items + row.withdrawn_items for row in rows),
+        "portfolio_value": float(sum(row.items_value + row.withdrawn_value for row in rows)),
+        "portfolio_stars": sum(row.items_stars + row.withdrawn_stars for row in rows),
+        "withdrawn_items": sum(row.withdrawn_items for row in rows),
+        "by_rarity": {
+            row.rarity: {
+                "count": row.items,
+                "total_value": float(row.items_value),
+                "total_stars": row.items_stars
+            }
+            for row in rows if row.items > 0
+        },
+        "most_valuable_item": {
+            "name": best.best_item_name if best else None,
+            "value": float(best.best_item_value) if best else 0,
+            "rarity": best.rarity if best else None
+        }
+    }
+
+
+# Создаем глобальный экземпляр сводки
+inventory_summary = InventorySummary()
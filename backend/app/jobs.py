@@ -0,0 +1,327 @@
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from sqlalchemy import and_, delete, event, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .database import AsyncSessionLocal
+from .models import Job
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class JobHandler:
+    """Обработчик задачи и действие после окончательной ошибки"""
+    run: Callable[..., Awaitable[Any]]
+    on_dead: Optional[Callable[..., Awaitable[Any]]] = None
+
+
+# Обработчики по типу задачи (регистрируются модулями, которые ставят задачи)
+HANDLERS: Dict[str, JobHandler] = {}
+
+
+def register(kind: str, run: Callable[..., Awaitable[Any]], on_dead: Optional[Callable[..., Awaitable[Any]]] = None):
+    """
+    Зарегистрировать обработчик задач типа kind
+
+    Обработчик вызывается с аргументами из payload и должен быть
+    идемпотентным: после падения воркера задача выполнится повторно.
+    on_dead вызывается с теми же аргументами, когда попытки исчерпаны.
+    """
+    HANDLERS[kind] = JobHandler(run=run, on_dead=on_dead)
+
+
+def enqueue(
+    db,
+    kind: str,
+    payload: Dict[str, Any],
+    delay: float = 0,
+    max_attempts: Optional[int] = None,
+    ref: Optional[str] = None
+):
+    """
+    Поставить задачу в очередь в текущей транзакции
+
+    Задача появляется в очереди только вместе с коммитом (например,
+    вместе с переводом платежа в processing), выполняет ее воркер.
+
+    Args:
+        db: Сессия БД (AsyncSession или Session)
+        kind: Тип задачи (ключ в HANDLERS)
+        payload: Аргументы обработчика (JSON)
+        delay: Задержка до первого запуска, секунды
+        max_attempts: Попыток до dead (по умолчанию jobs_max_attempts)
+        ref: Объект задачи (transaction:<id>) для поиска задач по объекту
+    """
+    db.add(Job(
+        kind=kind,
+        payload=json.dumps(payload),
+        ref=ref,
+        max_attempts=max_attempts or settings.jobs_max_attempts,
+        run_at=datetime.utcnow() + timedelta(seconds=delay)
+    ))
+    session = getattr(db, "sync_session", db)
+    session.info["jobs_enqueued"] = True
+
+
+def backoff(attempts: int) -> float:
+    """Задержка перед следующей попыткой (экспонента с полным джиттером)"""
+    return random.uniform(0, min(settings.jobs_backoff_max, settings.jobs_backoff_base * 2 ** attempts))
+
+
+class JobRunner:
+    """
+    Воркер очереди фоновых задач
+
+    Захватывает готовые задачи на jobs_lease секунд: на PostgreSQL через
+    SELECT ... FOR UPDATE SKIP LOCKED, на SQLite условным UPDATE (запись
+    в SQLite и так последовательна). Задачи, брошенные упавшим процессом,
+    захватываются снова после истечения аренды. Одновременно выполняется
+    не больше jobs_concurrency задач; ошибки повторяются с экспоненциальной
+    задержкой, после max_attempts задача остается в статусе dead.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, concurrency: Optional[int] = None):
+        self.session_factory = session_factory
+        self.concurrency = concurrency or settings.jobs_concurrency
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._running: Set[asyncio.Task] = set()
+        self._last_cleanup = 0.0
+
+        self.completed = 0
+        self.retried = 0
+        self.dead = 0
+
+    async def start(self):
+        """Запустить фоновое выполнение задач"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self, timeout: float = 0):
+        """
+        Остановить выполнение: новые задачи не захватываются,
+        текущим дается timeout секунд, остальные вернутся в очередь по аренде
+        """
+        if self._task is not None:
+            # Одной отмены мало: на Python < 3.12 asyncio.wait_for теряет ее,
+            # если пробуждение (освободился слот) пришло в тот же момент,
+            # и цикл продолжил бы опрос - поэтому цикл проверяет флаг
+            self._stopping = True
+            self.wake()
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._stopping = False
+
+        if self._running:
+            done, pending = await asyncio.wait(self._running, timeout=timeout or None)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def wake(self):
+        """Разбудить воркер (после коммита с новыми задачами)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            # Сбрасываем до захвата: пробуждение во время захвата не теряется
+            self._wakeup.clear()
+            free = self.concurrency - len(self._running)
+            claimed = 0
+            if free > 0:
+                try:
+                    claimed = len(await self.run_once(limit=free, wait=False))
+                    await self._cleanup()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Job runner error: {str(e)}")
+
+            if claimed < free or free <= 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), settings.jobs_poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def run_once(self, limit: Optional[int] = None, wait: bool = True) -> List[Job]:
+        """
+        Захватить и запустить пачку задач
+
+        Args:
+            limit: Сколько задач захватить (по умолчанию concurrency)
+            wait: Дождаться выполнения захваченных задач
+
+        Returns:
+            Захваченные задачи
+        """
+        token = uuid.uuid4().hex
+        jobs = await self._claim(token, limit or self.concurrency)
+
+        tasks = []
+        for job in jobs:
+            task = asyncio.create_task(self._execute(token, job))
+            self._running.add(task)
+            task.add_done_callback(self._finished)
+            tasks.append(task)
+
+        if wait and tasks:
+            await asyncio.gather(*tasks)
+        return jobs
+
+    def _finished(self, task: asyncio.Task):
+        self._running.discard(task)
+        # Освободился слот - можно захватить следующую задачу
+        self.wake()
+
+    async def _claim(self, token: str, limit: int) -> List[Job]:
+        """Захватить готовые задачи (включая задачи с истекшей арендой)"""
+        now = datetime.utcnow()
+        ready = or_(
+            and_(Job.status == "pending", Job.run_at <= now),
+            and_(Job.status == "running", Job.locked_until < now),
+        )
+
+        async with self.session_factory() as db:
+            batch = select(Job.id).where(ready).order_by(Job.run_at, Job.id).limit(limit)
+            if db.bind.dialect.name == "postgresql":
+                # Параллельные воркеры пропускают строки, захваченные другими
+                batch = batch.with_for_update(skip_locked=True)
+
+            ids = list((await db.scalars(batch)).all())
+            if not ids:
+                await db.commit()
+                return []
+
+            await db.execute(
+                update(Job)
+                .where(Job.id.in_(ids), ready)
+                .values(
+                    status="running",
+                    locked_by=token,
+                    locked_until=now + timedelta(seconds=settings.jobs_lease),
+                    attempts=Job.attempts + 1
+                )
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+            result = await db.scalars(
+                select(Job).where(Job.locked_by == token, Job.status == "running").order_by(Job.id)
+            )
+            return list(result.all())
+
+    async def _execute(self, token: str, job: Job):
+        """Выполнить задачу и записать результат"""
+        handler = HANDLERS.get(job.kind)
+        if handler is None:
+            await self._finish(token, job, status="dead", last_error=f"Unknown job kind: {job.kind}")
+            self.dead += 1
+            return
+
+        payload = json.loads(job.payload)
+        try:
+            # Задача не должна пережить свою аренду, иначе ее захватит другой воркер
+            await asyncio.wait_for(handler.run(**payload), settings.jobs_lease)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if job.attempts >= job.max_attempts:
+                logger.error(f"Job {job.id} ({job.kind}) failed permanently: {error}")
+                await self._finish(token, job, status="dead", last_error=error)
+                self.dead += 1
+                if handler.on_dead is not None:
+                    try:
+                        await handler.on_dead(**payload)
+                    except Exception as dead_error:
+                        logger.error(f"Job {job.id} dead handler failed: {str(dead_error)}")
+                return
+
+            delay = backoff(job.attempts)
+            logger.warning(f"Job {job.id} ({job.kind}) failed ({error}), retry in {delay:.1f}s")
+            await self._finish(
+                token, job,
+                status="pending",
+                last_error=error,
+                run_at=datetime.utcnow() + timedelta(seconds=delay)
+            )
+            self.retried += 1
+            return
+
+        await self._finish(token, job, status="done", finished_at=datetime.utcnow(), last_error=None)
+        self.completed += 1
+
+    async def _finish(self, token: str, job: Job, **values):
+        """Обновить задачу, если она все еще захвачена этим воркером"""
+        async with self.session_factory() as db:
+            await db.execute(
+                update(Job)
+                .where(Job.id == job.id, Job.locked_by == token)
+                .values(locked_until=None, **values)
+            )
+            await db.commit()
+
+    async def _cleanup(self):
+        """Удалить старые выполненные задачи (не чаще раза в минуту)"""
+        if time.monotonic() - self._last_cleanup < 60:
+            return
+        self._last_cleanup = time.monotonic()
+
+        async with self.session_factory() as db:
+            await db.execute(
+                delete(Job).where(
+                    Job.status == "done",
+                    Job.finished_at < datetime.utcnow() - timedelta(hours=settings.jobs_retention_hours)
+                )
+            )
+            await db.commit()
+
+    async def queue_stats(self) -> Dict[str, int]:
+        """Количество задач по статусам"""
+        async with self.session_factory() as db:
+            rows = await db.execute(select(Job.status, func.count(Job.id)).group_by(Job.status))
+            return {row[0]: row[1] for row in rows}
+
+    def stats(self) -> dict:
+        """Счетчики выполнения"""
+        return {
+            "running": self._task is not None,
+            "active": len(self._running),
+            "concurrency": self.concurrency,
+            "completed": self.completed,
+            "retried": self.retried,
+            "dead": self.dead,
+        }
+
+
+# Создаем глобальный экземпляр воркера
+job_runner = JobRunner()
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_runner(session):
+    """Новые задачи закоммичены - не ждем следующего опроса очереди"""
+    if session.info.pop("jobs_enqueued", None):
+        job_runner.wake()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_wakeup(session):
+    session.info.pop("jobs_enqueued", None)
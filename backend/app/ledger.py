@@ -0,0 +1,104 @@
+from typing import Optional
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import User
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BalanceLedger:
+    """
+    Атомарные операции с балансом звезд
+
+    Баланс меняется одним условным UPDATE ... RETURNING, поэтому
+    параллельные списания не теряют обновления и не уводят баланс в минус
+    без блокировок на стороне приложения. Коммит остается за вызывающим кодом.
+    """
+
+    async def debit(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        amount: int,
+        **counters: int
+    ) -> Optional[int]:
+        """
+        Списание звезд
+
+        Args:
+            db: Сессия БД
+            user_id: ID пользователя
+            amount: Сумма списания в звездах
+            **counters: Дополнительные счетчики User для инкремента
+                (например total_cases_opened=1)
+
+        Returns:
+            Новый баланс или None, если средств недостаточно
+            или пользователь не найден
+        """
+        if amount < 0:
+            raise ValueError("Debit amount must be non-negative")
+
+        return await db.scalar(
+            update(User)
+            .where(
+                User.id == user_id,
+                User.balance_stars >= amount
+            )
+            .values(
+                balance_stars=User.balance_stars - amount,
+                **self._increments(counters)
+            )
+            .returning(User.balance_stars)
+        )
+
+    async def credit(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        amount: int,
+        **counters: int
+    ) -> Optional[int]:
+        """
+        Начисление звезд
+
+        Args:
+            db: Сессия БД
+            user_id: ID пользователя
+            amount: Сумма начисления в звездах
+            **counters: Дополнительные счетчики User для инкремента
+
+        Returns:
+            Новый баланс или None, если пользователь не найден
+        """
+        if amount < 0:
+            raise ValueError("Credit amount must be non-negative")
+
+        return await db.scalar(
+            update(User)
+            .where(User.id == user_id)
+            .values(
+                balance_stars=User.balance_stars + amount,
+                **self._increments(counters)
+            )
+            .returning(User.balance_stars)
+        )
+
+    async def get_balance(self, db: AsyncSession, user_id: int) -> Optional[int]:
+        """Текущий баланс или None, если пользователь не найден"""
+        return await db.scalar(
+            select(User.balance_stars).where(User.id == user_id)
+        )
+
+    @staticmethod
+    def _increments(counters: dict) -> dict:
+        return {
+            name: getattr(User, name) + value
+            for name, value in counters.items()
+        }
+
+
+# Создаем глобальный экземпляр сервиса
+ledger = BalanceLedger()
@@ -1,13 +1,23 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request, status
+from fastapi import Depends, FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 import time
 import logging
 
-from .config import settings
-from .database import init_db, close_db
+from .auth import require_metrics_access, webapp_secret_key
+from .cache import cache
+from .config import DEFAULT_SECRET_KEY, settings
+from .database import engine, close_db, release_request_session
+from .payments.telegram import telegram_service
+from .payments.ton import ton_service
+from .jobs import job_runner
+from .notifications import notification_dispatcher
+from .presence import presence
+from .reaper import transaction_reaper
+from .ton_scanner import ton_scanner
+from .schema import check_schema, SchemaOutdatedError
 
 
 # Настройка логирования
@@ -24,20 +34,67 @@ async def lifespan(app: FastAPI):
     """Управление жизненным циклом приложения"""
     # Startup
     logger.info("🚀 Starting CrazyGift API...")
+    start = time.perf_counter()
     
-    # Инициализируем базу данных
-    await init_db()
+    # Токен сессии с ключом по умолчанию может выпустить кто угодно
+    if settings.secret_key == DEFAULT_SECRET_KEY and not settings.debug:
+        raise RuntimeError("SECRET_KEY must be set when DEBUG is off")
     
-    # Загружаем тестовые данные если в режиме разработки
-    if settings.debug:
-        await load_test_data()
+    # Только проверка версии схемы: миграции и тестовые данные
+    # применяются отдельно (crazygift-admin migrate / seed).
+    # Pre-fork супервизор проверяет схему один раз до форка.
+    if not getattr(app.state, "schema_ready", False):
+        try:
+            await check_schema(engine)
+        except SchemaOutdatedError as e:
+            if not settings.debug:
+                raise
+            logger.warning(f"⚠️  {e}")
     
-    logger.info("✅ CrazyGift API started successfully")
+    # Ключ проверки initData Telegram вычисляется один раз
+    webapp_secret_key(settings.telegram_bot_token)
+    
+    # Подключаем общий кеш и подписку на инвалидацию
+    await cache.start()
+    
+    # Общие HTTP клиенты внешних API (соединения живут между запросами)
+    await telegram_service.start()
+    await ton_service.start()
+    
+    # Фоновые задачи (платежи) - здесь или в отдельном crazygift-worker
+    if settings.jobs_runner:
+        await job_runner.start()
+    
+    # Отправка очереди уведомлений Telegram
+    if settings.notify_dispatcher:
+        await notification_dispatcher.start()
+    
+    # Индекс входящих TON переводов для проверки депозитов
+    if settings.ton_scanner and settings.ton_wallet_address:
+        await ton_scanner.start()
+    
+    # Очистка зависших депозитов
+    if settings.reaper:
+        await transaction_reaper.start()
+    
+    # Пакетная запись last_active
+    await presence.start()
+    
+    app.state.startup_ms = round((time.perf_counter() - start) * 1000, 1)
+    logger.info(f"✅ CrazyGift API started in {app.state.startup_ms}ms")
     
     yield
     
     # Shutdown
     logger.info("🔄 Shutting down CrazyGift API...")
+    await job_runner.close(timeout=settings.graceful_timeout)
+    await transaction_reaper.close()
+    await presence.close()
+    await ton_scanner.close()
+    await notification_dispatcher.close()
+    await telegram_service.close()
+    await ton_service.close()
+    await cache.close()
     await close_db()
     logger.info("✅ CrazyGift API stopped")
 
@@ -84,6 +141,9 @@ async def log_requests(request: Request, call_next):
     
     response = await call_next(request)
     
+    # Обработчик завершен - соединение БД больше не нужно
+    await release_request_session(request)
+    
     # Логируем время выполнения
     process_time = time.time() - start_time
     logger.info(f"🟢 {request.method} {request.url.path} - {response.status_code} - {process_time:.3f}s")
@@ -140,6 +200,20 @@ app.include_router(cases.router, prefix="/api/cases", tags=["Cases"])
 app.include_router(payments.router, prefix="/api/payments", tags=["Payments"])
 app.include_router(inventory.router, prefix="/api/inventory", tags=["Inventory"])
 
+# Статика фронтенда из того же процесса
+if settings.serve_static:
+    from .static import CachedStaticFiles, get_static_dir
+    
+    static_dir = get_static_dir()
+    if static_dir.is_dir():
+        app.mount(
+            settings.static_url,
+            CachedStaticFiles(directory=static_dir, html=True, max_age=settings.static_max_age),
+            name="frontend"
+        )
+    else:
+        logger.warning(f"Static directory {static_dir} not found, frontend is not served")
+
 
 # Основные эндпоинты
 @app.get("/")
@@ -165,111 +239,70 @@ async def health_check():
 
 @app.get("/api/stats")
 async def get_public_stats():
-    """Публичная статистика"""
-    from sqlalchemy import select, func
-    from .database import AsyncSessionLocal
-    from .models import User, Transaction, Case
+    """
+    Публичная статистика
     
-    async with AsyncSessionLocal() as db:
-        # Общее количество пользователей
-        users_count = await db.scalar(select(func.count(User.id)))
-        
-        # Общее количество открытых кейсов
-        total_cases_opened = await db.scalar(select(func.sum(User.total_cases_opened))) or 0
-        
-        # Активные кейсы
-        active_cases = await db.scalar(select(func.count(Case.id)).where(Case.active == True))
+    Счетчики читаются из шардов global_counters, онлайн - по last_active
+    за presence_window, все кешируется на stats_cache_ttl секунд.
+    Активные кейсы - из снимка каталога. Чтение идет через пул только для
+    чтения и не ждет записей; активность этого процесса попадает в
+    last_active со своим интервалом сброса (presence_flush_interval).
+    """
+    from .catalog import catalog_cache
+    from .counters import CASES_OPENED, USERS, global_counters
+    from .database import ReadSessionLocal
+    
+    stats = await cache.get("stats:public")
+    if stats is None:
+        async with ReadSessionLocal() as db:
+            totals = await global_counters.totals(db)
+            online_now = await presence.count_online(db)
+        snapshot = await catalog_cache.get_snapshot()
         
-        return {
-            "total_users": users_count or 0,
-            "total_cases_opened": total_cases_opened,
-            "active_cases": active_cases or 0,
-            "online_now": "~300"  # Заглушка для фронтенда
+        stats = {
+            "total_users": totals.get(USERS, 0),
+            "total_cases_opened": totals.get(CASES_OPENED, 0),
+            "active_cases": len(snapshot.active_cases()),
+            "online_now": online_now,
         }
+        await cache.set("stats:public", stats, ttl=settings.stats_cache_ttl)
+    
+    return stats
 
 
-async def load_test_data():
-    """Загрузка тестовых данных для разработки"""
-    import json
-    from sqlalchemy import select, func  # Добавили func
-    from .database import AsyncSessionLocal
-    from .models import Case
-    
-    logger.info("📦 Loading test data...")
+@app.get("/api/metrics/db", dependencies=[Depends(require_metrics_access)])
+async def get_db_metrics():
+    """Использование пула соединений БД (DEBUG или METRICS_TOKEN)"""
+    from .database import pool_stats
     
-    async with AsyncSessionLocal() as db:
-        # Проверяем, есть ли уже кейсы
-        existing_cases = await db.scalar(select(func.count(Case.id)))
-        
-        if existing_cases > 0:
-            logger.info("Test data already exists, skipping...")
-            return
-        
-        # Создаем тестовые кейсы
-        test_cases = [
-            {
-                "name": "Telegram Case #1",
-                "description": "Базовый кейс с обычными предметами",
-                "price_stars": 150,
-                "category": "basic",
-                "image_url": "assets/cases/case1.png",
-                "items": [
-                    {"id": 1, "name": "Blue Bow Tie", "value": 25.6, "stars": 2556, "rarity": "common", "weight": 40, "image": "assets/gifts/gift2.png"},
-                    {"id": 2, "name": "Pink Teddy Bear", "value": 45.5, "stars": 4550, "rarity": "common", "weight": 30, "image": "assets/gifts/gift3.png"},
-                    {"id": 3, "name": "Telegram Cap", "value": 65.0, "stars": 6500, "rarity": "rare", "weight": 20, "image": "assets/gifts/gift4.png"},
-                    {"id": 4, "name": "Golden Star", "value": 125.0, "stars": 12500, "rarity": "epic", "weight": 10, "image": "assets/gifts/gift5.png"}
-                ]
-            },
-            {
-                "name": "Telegram Case #2", 
-                "description": "Улучшенный кейс с редкими предметами",
-                "price_stars": 250,
-                "category": "premium",
-                "image_url": "assets/cases/case2.png",
-                "items": [
-                    {"id": 5, "name": "Magic Hat", "value": 85.0, "stars": 8500, "rarity": "rare", "weight": 35, "image": "assets/gifts/gift6.png"},
-                    {"id": 6, "name": "Diamond Ring", "value": 180.5, "stars": 18050, "rarity": "epic", "weight": 25, "image": "assets/gifts/gift7.png"},
-                    {"id": 7, "name": "Crown", "value": 350.0, "stars": 35000, "rarity": "legendary", "weight": 15, "image": "assets/gifts/gift8.png"},
-                    {"id": 8, "name": "Mystic Scroll", "value": 750.0, "stars": 75000, "rarity": "mythic", "weight": 5, "image": "assets/gifts/gift9.png"}
-                ]
-            },
-            {
-                "name": "Premium Case",
-                "description": "Эксклюзивный кейс с легендарными предметами",
-                "price_stars": 500,
-                "category": "premium",
-                "image_url": "assets/cases/case_mock.png",
-                "items": [
-                    {"id": 9, "name": "Rare Artifact", "value": 450.0, "stars": 45000, "rarity": "legendary", "weight": 40, "image": "assets/gifts/gift10.png"},
-                    {"id": 10, "name": "Ancient Relic", "value": 850.0, "stars": 85000, "rarity": "mythic", "weight": 30, "image": "assets/gifts/gift11.png"},
-                    {"id": 11, "name": "Dragon Egg", "value": 1500.0, "stars": 150000, "rarity": "mythic", "weight": 20, "image": "assets/gifts/gift12.png"},
-                    {"id": 12, "name": "Ultimate Prize", "value": 3000.0, "stars": 300000, "rarity": "mythic", "weight": 10, "image": "assets/gifts/gift1.png"}
-                ]
-            }
-        ]
-        
-        for case_data in test_cases:
-            case = Case(
-                name=case_data["name"],
-                description=case_data["description"],
-                price_stars=case_data["price_stars"],
-                category=case_data["category"],
-                image_url=case_data["image_url"],
-                items=json.dumps(case_data["items"]),
-                active=True
-            )
-            db.add(case)
-        
-        await db.commit()
-        logger.info(f"✅ Created {len(test_cases)} test cases")
+    return pool_stats()
+
+
+@app.get("/api/metrics", dependencies=[Depends(require_metrics_access)])
+async def get_metrics():
+    """Внутренние метрики процесса (кеши, счетчики; DEBUG или METRICS_TOKEN)"""
+    from .catalog import catalog_cache
+    from .database import pool_stats
+    from .sampler import sampler_cache
+
+    return {
+        "sampler_cache": sampler_cache.stats(),
+        "catalog_cache": catalog_cache.stats(),
+        "cache": cache.stats(),
+        "db_pool": pool_stats(),
+        "jobs": {**job_runner.stats(), "queue": await job_runner.queue_stats()},
+        "notifications": notification_dispatcher.stats(),
+        "ton_scanner": ton_scanner.stats(),
+        "reaper": transaction_reaper.stats(),
+        "presence": presence.stats(),
+        "http": {
+            "telegram": telegram_service.http.stats(),
+            "ton": ton_service.http.stats(),
+        },
+        "startup_ms": getattr(app.state, "startup_ms", None)
+    }
 
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(
-        "app.main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=settings.debug,
-        log_level="info" if settings.debug else "warning"
-    )
\ No newline at end of file
+    from .server import run
+    run()
\ No newline at end of file
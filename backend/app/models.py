@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, Boolean, DECIMAL, DateTime, Text, ForeignKey, Index
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DECIMAL, DateTime, Text, ForeignKey, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
+from datetime import datetime
 from .database import Base
 
 
@@ -124,6 +125,8 @@ class Case(Base):
     price_stars = Column(Integer, nullable=False)
     
     # Содержимое кейса (JSON)
+    # Устаревшее поле: предметы хранятся в таблице case_items, JSON остается
+    # как исходные данные для миграции и обратной совместимости
     items = Column(Text, nullable=False)  # JSON строка с предметами и их весами
     
     # Статус и метаданные
@@ -140,11 +143,55 @@ class Case(Base):
     
     # Relationships
     items_in_inventory = relationship("InventoryItem", back_populates="case")
+    case_items = relationship(
+        "CaseItem",
+        back_populates="case",
+        order_by="CaseItem.position",
+        cascade="all, delete-orphan"
+    )
 
     def __repr__(self):
         return f"<Case(id={self.id}, name={self.name}, price={self.price_stars})>"
 
 
+class CaseItem(Base):
+    """Модель предмета внутри кейса"""
+    __tablename__ = "case_items"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    case_id = Column(Integer, ForeignKey("cases.id", ondelete="CASCADE"), nullable=False)
+    
+    # Информация о предмете
+    item_id = Column(Integer, nullable=False)  # ID предмета в каталоге подарков
+    name = Column(String(255), nullable=False)
+    value = Column(DECIMAL(10, 2), nullable=False)
+    stars = Column(Integer, nullable=False)
+    rarity = Column(String(50), nullable=False)
+    image_url = Column(String(500), nullable=True)
+    
+    # Вес для случайного выбора и порядок отображения
+    weight = Column(Integer, default=1, nullable=False)
+    position = Column(Integer, default=0, nullable=False)
+    
+    # Relationships
+    case = relationship("Case", back_populates="case_items")
+
+    def to_dict(self) -> dict:
+        """Предмет в формате CaseItem схемы (как в JSON Case.items)"""
+        return {
+            "id": self.item_id,
+            "name": self.name,
+            "value": float(self.value),
+            "stars": self.stars,
+            "rarity": self.rarity,
+            "weight": self.weight,
+            "image": self.image_url or ""
+        }
+
+    def __repr__(self):
+        return f"<CaseItem(id={self.id}, case_id={self.case_id}, name={self.name})>"
+
+
 class ReferralTransaction(Base):
     """Модель реферальных транзакций"""
     __tablename__ = "referral_transactions"
@@ -169,8 +216,186 @@ class ReferralTransaction(Base):
         return f"<ReferralTransaction(referrer_id={self.referrer_id}, amount={self.commission_amount})>"
 
 
+class OutboundMessage(Base):
+    """Исходящее сообщение Telegram в очереди отправки"""
+    __tablename__ = "outbound_messages"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    chat_id = Column(BigInteger, nullable=False)
+    kind = Column(String(50), default="text", nullable=False)  # payment_success, payment_failed, withdrawal_request, text
+    text = Column(Text, nullable=False)
+    
+    # Статус
+    status = Column(String(20), default="pending", nullable=False)
+    # Возможные статусы: pending, sending (захвачено диспетчером до next_attempt_at), sent, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    claimed_by = Column(String(32), nullable=True)
+    last_error = Column(Text, nullable=True)
+    
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<OutboundMessage(id={self.id}, chat_id={self.chat_id}, status={self.status})>"
+
+
+class Job(Base):
+    """Фоновая задача в очереди (обработка платежей и т.п.)"""
+    __tablename__ = "jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(50), nullable=False)  # payment.ton, payment.telegram
+    payload = Column(Text, nullable=False)  # JSON строка с аргументами обработчика
+    ref = Column(String(64), nullable=True)  # Объект задачи, например transaction:15
+    
+    # Статус
+    status = Column(String(20), default="pending", nullable=False)
+    # Возможные статусы: pending, running (захвачена воркером до locked_until), done, dead
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=5, nullable=False)
+    run_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    locked_by = Column(String(32), nullable=True)
+    locked_until = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<Job(id={self.id}, kind={self.kind}, status={self.status})>"
+
+
+class IdempotencyKey(Base):
+    """Сохраненный ответ на запрос с ключом идемпотентности"""
+    __tablename__ = "idempotency_keys"
+    
+    key = Column(String(64), primary_key=True)  # sha256 от "scope:ключ"
+    fingerprint = Column(String(64), nullable=False)  # sha256 параметров запроса
+    status_code = Column(Integer, nullable=True)  # None - запрос еще выполняется
+    response = Column(Text, nullable=True)  # JSON тело ответа
+    expires_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<IdempotencyKey(key={self.key[:12]}, status_code={self.status_code})>"
+
+
+class TonScanCursor(Base):
+    """Позиция сканера входящих транзакций TON кошелька"""
+    __tablename__ = "ton_scan_cursors"
+    
+    address = Column(String(100), primary_key=True)
+    last_lt = Column(BigInteger, nullable=False)  # Logical time последней обработанной транзакции
+    last_hash = Column(String(100), nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<TonScanCursor(address={self.address}, last_lt={self.last_lt})>"
+
+
+class TonIncomingMessage(Base):
+    """Входящий перевод на кошелек TON (индекс по memo и хешу)"""
+    __tablename__ = "ton_incoming_messages"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    tx_hash = Column(String(100), unique=True, nullable=False)
+    lt = Column(BigInteger, nullable=False)
+    utime = Column(Integer, nullable=False)
+    
+    # Входящее сообщение
+    source = Column(String(100), nullable=True)
+    value_nanotons = Column(BigInteger, nullable=False)
+    memo = Column(String(255), nullable=True)
+    success = Column(Boolean, default=True, nullable=False)
+    
+    # Депозит, которому зачтен перевод
+    matched_transaction_id = Column(Integer, ForeignKey("transactions.id"), nullable=True, unique=True)
+    
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<TonIncomingMessage(tx_hash={self.tx_hash}, memo={self.memo}, value={self.value_nanotons})>"
+
+
+class UserInventorySummary(Base):
+    """Сводка инвентаря пользователя по редкости (обновляется вместе с инвентарем)"""
+    __tablename__ = "user_inventory_summary"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    rarity = Column(String(50), primary_key=True)
+    
+    # Предметы в инвентаре
+    items = Column(Integer, default=0, nullable=False)
+    items_value = Column(DECIMAL(18, 2), default=0, nullable=False)
+    items_stars = Column(BigInteger, default=0, nullable=False)
+    
+    # Выведенные предметы
+    withdrawn_items = Column(Integer, default=0, nullable=False)
+    withdrawn_value = Column(DECIMAL(18, 2), default=0, nullable=False)
+    withdrawn_stars = Column(BigInteger, default=0, nullable=False)
+    
+    # Самый дорогой предмет в инвентаре (без FK: предмет удаляется раньше пересчета)
+    best_item_id = Column(Integer, nullable=True)
+    best_item_name = Column(String(255), nullable=True)
+    best_item_value = Column(DECIMAL(10, 2), nullable=True)
+    
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<UserInventorySummary(user_id={self.user_id}, rarity={self.rarity}, items={self.items})>"
+
+
+class GlobalCounter(Base):
+    """Шард глобального счетчика (значение счетчика - сумма по шардам)"""
+    __tablename__ = "global_counters"
+    
+    name = Column(String(50), primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    value = Column(BigInteger, default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<GlobalCounter(name={self.name}, shard={self.shard}, value={self.value})>"
+
+
+class ReferralCodeAlias(Base):
+    """Старый реферальный код пользователя (до кодов из User.id)"""
+    __tablename__ = "referral_code_aliases"
+    
+    code = Column(String(20), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+
+    def __repr__(self):
+        return f"<ReferralCodeAlias(code={self.code}, user_id={self.user_id})>"
+
+
+class ReferralStats(Base):
+    """Итоги по рефералам пользователя (обновляются при записи)"""
+    __tablename__ = "referral_stats"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    referrals = Column(Integer, default=0, nullable=False)
+    active_referrals = Column(Integer, default=0, nullable=False)  # Открыли хотя бы один кейс
+    updated_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<ReferralStats(user_id={self.user_id}, referrals={self.referrals})>"
+
+
 # Создаем индексы для оптимизации запросов
 Index('idx_user_telegram_id', User.telegram_id)
+Index('idx_user_last_active', User.last_active)
+Index('idx_user_referred_created', User.referred_by, User.created_at.desc(), User.id.desc())
 Index('idx_inventory_user_rarity', InventoryItem.user_id, InventoryItem.rarity)
+Index('idx_inventory_user_listing', InventoryItem.user_id, InventoryItem.is_withdrawn, InventoryItem.created_at.desc(), InventoryItem.id.desc())
 Index('idx_transaction_user_type', Transaction.user_id, Transaction.type)
-Index('idx_transaction_status_created', Transaction.status, Transaction.created_at)
\ No newline at end of file
+Index('idx_transaction_status_created', Transaction.status, Transaction.created_at)
+Index('idx_transaction_user_created', Transaction.user_id, Transaction.created_at.desc(), Transaction.id.desc())
+Index('idx_case_items_case_position', CaseItem.case_id, CaseItem.position)
+Index('idx_case_items_rarity_case', CaseItem.rarity, CaseItem.case_id)
+Index('idx_outbound_status_next', OutboundMessage.status, OutboundMessage.next_attempt_at)
+Index('idx_ton_incoming_memo', TonIncomingMessage.memo)
+Index('idx_jobs_status_run_at', Job.status, Job.run_at)
+Index('idx_jobs_ref', Job.ref)
+Index('idx_idempotency_expires', IdempotencyKey.expires_at)
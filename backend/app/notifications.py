@@ -0,0 +1,341 @@
+import asyncio
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, event, select, update
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .database import AsyncSessionLocal
+from .models import OutboundMessage
+from .payments.telegram import TelegramSendError, telegram_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Лимит длины сообщения Bot API
+MAX_MESSAGE_LENGTH = 4096
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        """Взять токен, если он есть"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self) -> float:
+        """Секунды до появления токена"""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    async def acquire(self):
+        """Дождаться токена"""
+        while not self.try_acquire():
+            await asyncio.sleep(self.wait_time())
+
+    @property
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+def enqueue(db, chat_id: int, text: str, kind: str = "text"):
+    """
+    Поставить сообщение в очередь в текущей транзакции
+
+    Сообщение появляется в очереди только вместе с коммитом (например,
+    вместе с начислением платежа), отправляет его диспетчер.
+
+    Args:
+        db: Сессия БД (AsyncSession или Session)
+        chat_id: Telegram chat ID
+        text: Текст сообщения (Markdown)
+        kind: Тип уведомления (для логов и метрик)
+    """
+    db.add(OutboundMessage(chat_id=chat_id, text=text, kind=kind))
+    session = getattr(db, "sync_session", db)
+    session.info["notifications_enqueued"] = True
+
+
+class NotificationDispatcher:
+    """
+    Диспетчер очереди исходящих сообщений Telegram
+
+    Захватывает пачку сообщений на notify_lease секунд (несколько процессов
+    не отправят одно сообщение дважды; после падения процесса захват
+    истекает), склеивает сообщения одному чату в одно, соблюдает лимиты
+    Telegram (ведро токенов на бота и на чат) и повторяет ошибки с
+    экспоненциальной задержкой. Соединение с БД не удерживается во время
+    запросов к Bot API.
+    """
+
+    def __init__(self, sender=telegram_service, session_factory=AsyncSessionLocal):
+        self.sender = sender
+        self.session_factory = session_factory
+        self.global_bucket = TokenBucket(settings.notify_global_rate, capacity=settings.notify_global_rate)
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._last_cleanup = 0.0
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+
+    async def start(self):
+        """Запустить фоновую отправку"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Остановить фоновую отправку"""
+        if self._task is not None:
+            # Отмена теряется в asyncio.wait_for (Python < 3.12), если
+            # пробуждение пришло одновременно с ней - цикл проверяет флаг
+            self._stopping = True
+            self.wake()
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._stopping = False
+
+    def wake(self):
+        """Разбудить диспетчер (после коммита с новыми сообщениями)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            # Сбрасываем до захвата: пробуждение во время отправки не теряется
+            self._wakeup.clear()
+            try:
+                processed = await self.dispatch_once()
+                await self._cleanup()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Notification dispatcher error: {str(e)}")
+                processed = 0
+
+            if processed < settings.notify_batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), settings.notify_poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def dispatch_once(self) -> int:
+        """
+        Отправить одну пачку сообщений
+
+        Returns:
+            Количество захваченных сообщений
+        """
+        token = uuid.uuid4().hex
+        messages = await self._claim(token)
+        if not messages:
+            return 0
+
+        by_chat: Dict[int, List[OutboundMessage]] = {}
+        for message in messages:
+            by_chat.setdefault(message.chat_id, []).append(message)
+
+        semaphore = asyncio.Semaphore(settings.notify_concurrency)
+
+        async def deliver(chat_id, chat_messages):
+            async with semaphore:
+                await self._deliver(token, chat_id, chat_messages)
+
+        await asyncio.gather(*(deliver(chat_id, items) for chat_id, items in by_chat.items()))
+        return len(messages)
+
+    async def _claim(self, token: str) -> List[OutboundMessage]:
+        """Захватить готовые к отправке сообщения (включая брошенные упавшим процессом)"""
+        now = datetime.utcnow()
+        ready = (
+            OutboundMessage.status.in_(("pending", "sending")),
+            OutboundMessage.next_attempt_at <= now,
+        )
+
+        async with self.session_factory() as db:
+            batch = (
+                select(OutboundMessage.id)
+                .where(*ready)
+                .order_by(OutboundMessage.id)
+                .limit(settings.notify_batch_size)
+            )
+            await db.execute(
+                update(OutboundMessage)
+                .where(OutboundMessage.id.in_(batch.scalar_subquery()), *ready)
+                .values(
+                    status="sending",
+                    claimed_by=token,
+                    next_attempt_at=now + timedelta(seconds=settings.notify_lease)
+                )
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+            result = await db.scalars(
+                select(OutboundMessage)
+                .where(OutboundMessage.claimed_by == token, OutboundMessage.status == "sending")
+                .order_by(OutboundMessage.id)
+            )
+            return list(result.all())
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                # Полные ведра ничего не ограничивают - их можно забыть
+                self.chat_buckets = {key: value for key, value in self.chat_buckets.items() if not value.full}
+            bucket = self.chat_buckets[chat_id] = TokenBucket(settings.notify_chat_rate)
+        return bucket
+
+    async def _deliver(self, token: str, chat_id: int, messages: List[OutboundMessage]):
+        """Отправить сообщения одного чата одним сообщением"""
+        # Склеиваем, пока помещается в лимит длины; остальное - следующим сообщением
+        batch, length = [], 0
+        for message in messages:
+            if batch and length + len(message.text) + 2 > MAX_MESSAGE_LENGTH:
+                break
+            batch.append(message)
+            length += len(message.text) + 2
+        rest = messages[len(batch):]
+
+        bucket = self._chat_bucket(chat_id)
+        if not bucket.try_acquire():
+            self.rate_limited += 1
+            await self._release(token, messages, bucket.wait_time())
+            return
+
+        if rest:
+            await self._release(token, rest, bucket.wait_time())
+
+        await self.global_bucket.acquire()
+
+        try:
+            await self.sender.deliver_message(
+                chat_id, "\n\n".join(message.text for message in batch), retries=0
+            )
+        except TelegramSendError as e:
+            await self._fail(token, batch, e)
+            return
+        except Exception as e:
+            await self._fail(token, batch, TelegramSendError(str(e)))
+            return
+
+        await self._update(token, batch, status="sent", sent_at=datetime.utcnow(), last_error=None)
+        self.sent += 1
+        self.coalesced += len(batch) - 1
+
+    async def _release(self, token: str, messages: List[OutboundMessage], delay: float):
+        """Вернуть сообщения в очередь без попытки отправки"""
+        await self._update(
+            token, messages,
+            status="pending",
+            next_attempt_at=datetime.utcnow() + timedelta(seconds=delay)
+        )
+
+    async def _fail(self, token: str, messages: List[OutboundMessage], error: TelegramSendError):
+        """Повтор с задержкой или окончательная ошибка"""
+        attempts = max(message.attempts for message in messages) + 1
+
+        if error.permanent or attempts >= settings.notify_max_attempts:
+            logger.error(f"Notification to chat {messages[0].chat_id} failed: {error}")
+            await self._update(token, messages, status="failed", attempts=attempts, last_error=str(error))
+            self.failed += len(messages)
+            return
+
+        delay = error.retry_after or random.uniform(0, min(3600, 2 ** attempts))
+        logger.warning(f"Notification to chat {messages[0].chat_id} failed ({error}), retry in {delay:.1f}s")
+        await self._update(
+            token, messages,
+            status="pending",
+            attempts=attempts,
+            last_error=str(error),
+            next_attempt_at=datetime.utcnow() + timedelta(seconds=delay)
+        )
+        self.retried += 1
+
+    async def _update(self, token: str, messages: List[OutboundMessage], **values):
+        """Обновить захваченные этим диспетчером сообщения"""
+        async with self.session_factory() as db:
+            await db.execute(
+                update(OutboundMessage)
+                .where(
+                    OutboundMessage.id.in_([message.id for message in messages]),
+                    OutboundMessage.claimed_by == token
+                )
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+    async def _cleanup(self):
+        """Удалить старые отправленные сообщения (не чаще раза в минуту)"""
+        if time.monotonic() - self._last_cleanup < 60:
+            return
+        self._last_cleanup = time.monotonic()
+
+        async with self.session_factory() as db:
+            await db.execute(
+                delete(OutboundMessage).where(
+                    OutboundMessage.status == "sent",
+                    OutboundMessage.sent_at < datetime.utcnow() - timedelta(hours=settings.notify_retention_hours)
+                )
+            )
+            await db.commit()
+
+    def stats(self) -> dict:
+        """Счетчики отправки"""
+        return {
+            "running": self._task is not None,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "coalesced": self.coalesced,
+            "rate_limited": self.rate_limited,
+            "chats_tracked": len(self.chat_buckets),
+        }
+
+
+# Создаем глобальный экземпляр диспетчера
+notification_dispatcher = NotificationDispatcher()
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_dispatcher(session):
+    """Новые сообщения закоммичены - не ждем следующего опроса очереди"""
+    if session.info.pop("notifications_enqueued", None):
+        notification_dispatcher.wake()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_wakeup(session):
+    session.info.pop("notifications_enqueued", None)
@@ -0,0 +1,54 @@
+import base64
+from datetime import datetime
+from typing import Tuple
+
+from sqlalchemy import String, func, literal, select, tuple_
+
+from .database import engine
+
+# Заголовок с курсором следующей страницы (для эндпоинтов, отдающих список)
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Непрозрачный курсор keyset пагинации по (created_at, id)"""
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Разобрать курсор
+
+    Raises:
+        ValueError: Курсор поврежден
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.split("|")
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def before_cursor(created_column, id_column, created_at: datetime, row_id: int):
+    """
+    Условие "строка после курсора" для сортировки (created_at DESC, id DESC)
+
+    SQLite хранит DateTime текстом и сравнивает строки: server_default
+    (CURRENT_TIMESTAMP) пишет время без долей секунды, datetime из Python -
+    с шестью знаками после точки, и одно и то же время из курсора не равно
+    ни одной из записей другого вида. Поэтому границей служит сохраненное
+    значение самой строки курсора (подзапрос по первичному ключу), а если
+    строку уже удалили - время курсора текстом в формате server_default
+    без нулевых долей секунды. Порядок строк в таком тексте совпадает с
+    порядком времени, индекс по (created_at, id) по-прежнему используется.
+    """
+    bound = created_at
+    if engine.dialect.name == "sqlite":
+        text = created_at.strftime("%Y-%m-%d %H:%M:%S")
+        if created_at.microsecond:
+            text += f".{created_at.microsecond:06d}"
+        stored = select(created_column).where(id_column == row_id).scalar_subquery()
+        bound = func.coalesce(stored, literal(text, String))
+    return tuple_(created_column, id_column) < tuple_(bound, row_id)
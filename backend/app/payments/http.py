@@ -0,0 +1,192 @@
+import asyncio
+import importlib.util
+import logging
+import random
+from typing import Dict, Optional
+
+import httpx
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+# Статусы, после которых запрос имеет смысл повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def http2_available() -> bool:
+    """HTTP/2 в httpx работает только с установленным пакетом h2 (httpx[http2])"""
+    return importlib.util.find_spec("h2") is not None
+
+
+class ServiceHttpClient:
+    """
+    Долгоживущий HTTP клиент внешнего API (Telegram, TON)
+
+    Один httpx.AsyncClient на сервис: соединения (TCP + TLS) остаются
+    открытыми между запросами. Клиент создается при старте приложения
+    (start) или при первом запросе, закрывается при остановке (close).
+
+    Повторы с экспоненциальной задержкой и случайным разбросом (full jitter):
+    - ошибка подключения - всегда (запрос не ушел на сервер);
+    - 429 - всегда, с учетом retry_after от сервера;
+    - таймаут чтения и 5xx - только для идемпотентных запросов.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        timeout: float = settings.http_timeout,
+        endpoint_timeouts: Optional[Dict[str, float]] = None,
+        retries: int = settings.http_retries,
+        backoff_base: float = settings.http_backoff_base,
+        backoff_max: float = settings.http_backoff_max,
+    ):
+        self.name = name
+        self.base_url = base_url
+        self.timeout = timeout
+        self.endpoint_timeouts = endpoint_timeouts or {}
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.http2 = settings.http_http2 and http2_available()
+        self._client: Optional[httpx.AsyncClient] = None
+
+        self.requests = 0
+        self.retried = 0
+        self.failures = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+
+    async def start(self):
+        """Создать клиент (пул соединений)"""
+        self._get_client()
+
+    async def close(self):
+        """Закрыть клиент и все открытые соединения"""
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aclose()
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            if settings.http_http2 and not self.http2:
+                logger.warning(f"{self.name}: package h2 is not installed, using HTTP/1.1")
+
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=settings.http_max_connections,
+                    max_keepalive_connections=settings.http_max_keepalive,
+                    keepalive_expiry=settings.http_keepalive_expiry,
+                ),
+                timeout=httpx.Timeout(self.timeout, connect=settings.http_connect_timeout),
+            )
+        return self._client
+
+    async def _trace(self, event_name: str, info: dict):
+        """События httpcore: считаем новые соединения (остальные запросы - переиспользование)"""
+        if event_name == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+        elif event_name == "connection.start_tls.complete":
+            self.tls_handshakes += 1
+
+    def _backoff(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        """Задержка перед повтором: retry_after сервера или full jitter"""
+        if response is not None and response.status_code == 429:
+            retry_after = response.headers.get("Retry-After")
+            try:
+                retry_after = retry_after or response.json().get("parameters", {}).get("retry_after")
+            except ValueError:
+                pass
+            if retry_after:
+                return float(retry_after)
+
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def request(
+        self,
+        method: str,
+        endpoint: str,
+        idempotent: Optional[bool] = None,
+        retries: Optional[int] = None,
+        **kwargs
+    ) -> httpx.Response:
+        """
+        Запрос к API с повторами
+
+        Args:
+            method: HTTP метод
+            endpoint: Путь относительно base_url (например "sendMessage")
+            idempotent: Можно ли повторять после таймаута чтения и 5xx
+                (по умолчанию - только GET)
+            retries: Число повторов (None - из настроек клиента)
+            **kwargs: Параметры httpx (params, json, data, ...)
+
+        Returns:
+            Последний полученный ответ
+
+        Raises:
+            httpx.HTTPError: Сетевая ошибка после всех повторов
+        """
+        if idempotent is None:
+            idempotent = method == "GET"
+        if retries is None:
+            retries = self.retries
+
+        client = self._get_client()
+        timeout = self.endpoint_timeouts.get(endpoint)
+        if timeout is not None:
+            kwargs["timeout"] = httpx.Timeout(timeout, connect=settings.http_connect_timeout)
+
+        attempt = 0
+        while True:
+            self.requests += 1
+            try:
+                response = await client.request(
+                    method, endpoint, extensions={"trace": self._trace}, **kwargs
+                )
+            except httpx.TransportError as e:
+                retryable = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)) or idempotent
+                if not retryable or attempt >= retries:
+                    self.failures += 1
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(f"{self.name} {endpoint}: {type(e).__name__}, retry in {delay:.2f}s")
+            else:
+                retryable = response.status_code == 429 or (
+                    idempotent and response.status_code in RETRY_STATUSES
+                )
+                if not retryable or attempt >= retries:
+                    if response.status_code >= 500:
+                        self.failures += 1
+                    return response
+                delay = self._backoff(attempt, response)
+                if delay > self.backoff_max * 10:
+                    # Сервер просит ждать слишком долго - отдаем ответ вызывающему
+                    return response
+                logger.warning(f"{self.name} {endpoint}: HTTP {response.status_code}, retry in {delay:.2f}s")
+
+            attempt += 1
+            self.retried += 1
+            await asyncio.sleep(delay)
+
+    async def get(self, endpoint: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", endpoint, **kwargs)
+
+    async def post(self, endpoint: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", endpoint, **kwargs)
+
+    def stats(self) -> dict:
+        """Метрики запросов и переиспользования соединений"""
+        return {
+            "http2": self.http2,
+            "requests": self.requests,
+            "retries": self.retried,
+            "failures": self.failures,
+            "connections_opened": self.connections_opened,
+            "connections_reused": max(self.requests - self.connections_opened, 0),
+            "tls_handshakes": self.tls_handshakes,
+        }
@@ -1,18 +1,45 @@
-import httpx
 import json
 from typing import Optional, Dict, Any
+import httpx
 from ..config import settings
+from .http import ServiceHttpClient
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+class TelegramSendError(Exception):
+    """Ошибка отправки сообщения через Bot API"""
+    
+    def __init__(self, description: str, retry_after: Optional[float] = None, permanent: bool = False):
+        super().__init__(description)
+        self.retry_after = retry_after
+        self.permanent = permanent  # Повтор не поможет (бот заблокирован, чат не найден)
+
+
 class TelegramStarsService:
     """Сервис для работы с Telegram Stars"""
     
-    def __init__(self):
+    # Таймауты методов Bot API, секунды
+    TIMEOUTS = {
+        "getMe": 5,
+        "sendMessage": 10,
+        "createInvoiceLink": 10,
+        "getPayment": 10,
+    }
+    
+    def __init__(self, api_url: Optional[str] = None):
         self.bot_token = settings.telegram_bot_token
-        self.api_url = f"https://api.telegram.org/bot{self.bot_token}"
+        self.api_url = f"{api_url or settings.telegram_api_url}/bot{self.bot_token}"
+        self.http = ServiceHttpClient("telegram", self.api_url, endpoint_timeouts=self.TIMEOUTS)
+    
+    async def start(self):
+        """Открыть общий HTTP клиент"""
+        await self.http.start()
+    
+    async def close(self):
+        """Закрыть общий HTTP клиент"""
+        await self.http.close()
     
     async def create_stars_invoice(self, user_id: int, stars_amount: int, telegram_user_id: int) -> str:
         """
@@ -46,27 +73,28 @@ class TelegramStarsService:
                 }])
             }
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{self.api_url}/createInvoiceLink",
-                    data=invoice_data
-                )
-                
-                if response.status_code != 200:
-                    logger.error(f"Telegram API error: {response.status_code}")
-                    raise Exception(f"Telegram API error: {response.status_code}")
-                
-                data = response.json()
-                
-                if not data.get("ok"):
-                    error_msg = data.get("description", "Unknown error")
-                    logger.error(f"Telegram API error: {error_msg}")
-                    raise Exception(f"Telegram API error: {error_msg}")
-                
-                invoice_link = data["result"]
-                logger.info(f"Created Stars invoice for user {user_id}: {stars_amount} stars")
-                
-                return invoice_link
+            # Повтор безопасен: каждый вызов только создает новую ссылку
+            response = await self.http.post(
+                "createInvoiceLink",
+                data=invoice_data,
+                idempotent=True
+            )
+            
+            if response.status_code != 200:
+                logger.error(f"Telegram API error: {response.status_code}")
+                raise Exception(f"Telegram API error: {response.status_code}")
+            
+            data = response.json()
+            
+            if not data.get("ok"):
+                error_msg = data.get("description", "Unknown error")
+                logger.error(f"Telegram API error: {error_msg}")
+                raise Exception(f"Telegram API error: {error_msg}")
+            
+            invoice_link = data["result"]
+            logger.info(f"Created Stars invoice for user {user_id}: {stars_amount} stars")
+            
+            return invoice_link
                 
         except Exception as e:
             logger.error(f"Failed to create Stars invoice: {str(e)}")
@@ -87,36 +115,78 @@ class TelegramStarsService:
             # для проверки платежа по ID. Обычно информация приходит через webhook
             # Этот метод для демонстрации структуры
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{self.api_url}/getPayment",  # Гипотетический метод
-                    json={"payment_id": payment_id}
-                )
-                
-                if response.status_code != 200:
-                    return None
-                
-                data = response.json()
-                
-                if not data.get("ok"):
-                    return None
-                
-                payment_info = data.get("result", {})
-                
-                return {
-                    "payment_id": payment_id,
-                    "amount": payment_info.get("total_amount"),
-                    "currency": payment_info.get("currency"),
-                    "status": payment_info.get("status"),
-                    "payload": payment_info.get("invoice_payload"),
-                    "user_id": payment_info.get("from", {}).get("id"),
-                    "paid_at": payment_info.get("payment_date")
-                }
+            response = await self.http.post(
+                "getPayment",  # Гипотетический метод
+                json={"payment_id": payment_id},
+                idempotent=True
+            )
+            
+            if response.status_code != 200:
+                return None
+            
+            data = response.json()
+            
+            if not data.get("ok"):
+                return None
+            
+            payment_info = data.get("result", {})
+            
+            return {
+                "payment_id": payment_id,
+                "amount": payment_info.get("total_amount"),
+                "currency": payment_info.get("currency"),
+                "status": payment_info.get("status"),
+                "payload": payment_info.get("invoice_payload"),
+                "user_id": payment_info.get("from", {}).get("id"),
+                "paid_at": payment_info.get("payment_date")
+            }
                 
         except Exception as e:
             logger.error(f"Error verifying Stars payment: {str(e)}")
             return None
     
+    async def deliver_message(self, chat_id: int, text: str, retries: Optional[int] = None):
+        """
+        Отправка сообщения с подробной ошибкой (для очереди уведомлений)
+        
+        Args:
+            chat_id: Telegram chat ID
+            text: Текст сообщения
+            retries: Повторов внутри вызова (None - по настройкам клиента)
+            
+        Raises:
+            TelegramSendError: Сообщение не отправлено
+        """
+        try:
+            # Не идемпотентно: после таймаута чтения или 5xx сообщение могло
+            # уже уйти, повторяем только ошибки подключения и 429
+            response = await self.http.post(
+                "sendMessage",
+                json={
+                    "chat_id": chat_id,
+                    "text": text,
+                    "parse_mode": "Markdown"
+                },
+                retries=retries
+            )
+        except httpx.HTTPError as e:
+            raise TelegramSendError(f"{type(e).__name__}: {e}")
+        
+        try:
+            data = response.json()
+        except ValueError:
+            data = {}
+        
+        if response.status_code == 200 and data.get("ok"):
+            return
+        
+        description = data.get("description") or f"HTTP {response.status_code}"
+        raise TelegramSendError(
+            description,
+            retry_after=data.get("parameters", {}).get("retry_after"),
+            permanent=response.status_code in (400, 403)
+        )
+    
     async def send_message(self, chat_id: int, text: str) -> bool:
         """
         Отправка сообщения пользователю
@@ -129,26 +199,34 @@ class TelegramStarsService:
             True если сообщение отправлено успешно
         """
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{self.api_url}/sendMessage",
-                    json={
-                        "chat_id": chat_id,
-                        "text": text,
-                        "parse_mode": "Markdown"
-                    }
-                )
-                
-                if response.status_code != 200:
-                    return False
-                
-                data = response.json()
-                return data.get("ok", False)
-                
+            await self.deliver_message(chat_id, text)
+            return True
         except Exception as e:
             logger.error(f"Error sending message: {str(e)}")
             return False
     
+    def format_payment_success(self, stars_amount: int, new_balance: int) -> str:
+        """Текст уведомления об успешном платеже"""
+        return f"""
+🎉 *Платёж успешно обработан!*
+
+💰 Получено: {stars_amount:,} звёзд
+⭐ Ваш баланс: {new_balance:,} звёзд
+
+Теперь вы можете открывать кейсы и выигрывать призы!
+        """.strip()
+    
+    def format_payment_failed(self, reason: str = "") -> str:
+        """Текст уведомления о неудачном платеже"""
+        return f"""
+❌ *Ошибка платежа*
+
+К сожалению, не удалось обработать ваш платёж.
+{f"Причина: {reason}" if reason else ""}
+
+Попробуйте ещё раз или обратитесь в поддержку.
+        """.strip()
+    
     async def notify_payment_success(self, telegram_user_id: int, stars_amount: int, new_balance: int) -> bool:
         """
         Уведомление об успешном платеже
@@ -161,16 +239,9 @@ class TelegramStarsService:
         Returns:
             True если уведомление отправлено
         """
-        message = f"""
-🎉 *Платёж успешно обработан!*
-
-💰 Получено: {stars_amount:,} звёзд
-⭐ Ваш баланс: {new_balance:,} звёзд
-
-Теперь вы можете открывать кейсы и выигрывать призы!
-        """.strip()
-        
-        return await self.send_message(telegram_user_id, message)
+        return await self.send_message(
+            telegram_user_id, self.format_payment_success(stars_amount, new_balance)
+        )
     
     async def notify_payment_failed(self, telegram_user_id: int, reason: str = "") -> bool:
         """
@@ -183,16 +254,7 @@ class TelegramStarsService:
         Returns:
             True если уведомление отправлено
         """
-        message = f"""
-❌ *Ошибка платежа*
-
-К сожалению, не удалось обработать ваш платёж.
-{f"Причина: {reason}" if reason else ""}
-
-Попробуйте ещё раз или обратитесь в поддержку.
-        """.strip()
-        
-        return await self.send_message(telegram_user_id, message)
+        return await self.send_message(telegram_user_id, self.format_payment_failed(reason))
     
     def parse_payment_payload(self, payload: str) -> Optional[Dict[str, Any]]:
         """
@@ -228,18 +290,17 @@ class TelegramStarsService:
             Информация о боте или None
         """
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(f"{self.api_url}/getMe")
-                
-                if response.status_code != 200:
-                    return None
-                
-                data = response.json()
-                
-                if not data.get("ok"):
-                    return None
-                
-                return data.get("result")
+            response = await self.http.get("getMe")
+            
+            if response.status_code != 200:
+                return None
+            
+            data = response.json()
+            
+            if not data.get("ok"):
+                return None
+            
+            return data.get("result")
                 
         except Exception as e:
             logger.error(f"Error getting bot info: {str(e)}")
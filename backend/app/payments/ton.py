@@ -1,8 +1,8 @@
-import httpx
 import asyncio
 from decimal import Decimal
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 from ..config import settings
+from .http import ServiceHttpClient
 import logging
 
 logger = logging.getLogger(__name__)
@@ -11,11 +11,88 @@ logger = logging.getLogger(__name__)
 class TonPaymentService:
     """Сервис для работы с TON платежами"""
     
-    def __init__(self):
-        self.api_url = "https://testnet.toncenter.com/api/v2" if settings.ton_testnet else "https://toncenter.com/api/v2"
+    # Таймауты методов toncenter, секунды
+    TIMEOUTS = {
+        "getTransactions": 20,
+        "getAddressBalance": 10,
+    }
+    
+    def __init__(self, api_url: Optional[str] = None):
+        self.api_url = api_url or settings.ton_api_url or (
+            "https://testnet.toncenter.com/api/v2" if settings.ton_testnet else "https://toncenter.com/api/v2"
+        )
         self.api_key = settings.ton_api_key
         self.wallet_address = settings.ton_wallet_address
+        self.http = ServiceHttpClient("ton", self.api_url, endpoint_timeouts=self.TIMEOUTS)
+    
+    async def start(self):
+        """Открыть общий HTTP клиент"""
+        await self.http.start()
+    
+    async def close(self):
+        """Закрыть общий HTTP клиент"""
+        await self.http.close()
+        
+    @staticmethod
+    def deposit_memo(user_id: int, amount: Decimal) -> str:
+        """Memo депозита: пользователь и сумма в сотых TON"""
+        return f"deposit_{user_id}_{int(amount * 100)}"
+    
+    @staticmethod
+    def parse_deposit_memo(memo: Optional[str]) -> Optional[Tuple[int, int]]:
+        """
+        Разбор memo депозита
+        
+        Returns:
+            Кортеж (user_id, сумма в сотых TON) или None
+        """
+        parts = (memo or "").strip().split("_")
+        if len(parts) != 3 or parts[0] != "deposit":
+            return None
+        try:
+            return int(parts[1]), int(parts[2])
+        except ValueError:
+            return None
+    
+    async def get_transactions(
+        self,
+        limit: int = 100,
+        lt: Optional[int] = None,
+        tx_hash: Optional[str] = None,
+        to_lt: int = 0
+    ) -> List[Dict[str, Any]]:
+        """
+        Страница транзакций кошелька (от новых к старым)
         
+        Args:
+            limit: Размер страницы
+            lt: Начать с этой транзакции (включительно), вместе с tx_hash
+            tx_hash: Хеш транзакции, с которой начать
+            to_lt: Не возвращать транзакции старше этого lt
+            
+        Returns:
+            Список транзакций toncenter
+        """
+        params = {
+            "address": self.wallet_address,
+            "limit": limit,
+            "to_lt": to_lt,
+            "api_key": self.api_key
+        }
+        if lt is not None:
+            params.update(lt=lt, hash=tx_hash)
+        
+        response = await self.http.get("getTransactions", params=params)
+        
+        if response.status_code != 200:
+            raise Exception(f"TON API error: {response.status_code}")
+        
+        data = response.json()
+        if not data.get("ok"):
+            raise Exception(f"TON API response error: {data.get('error', 'Unknown error')}")
+        
+        return data.get("result", [])
+    
     async def create_deposit_transaction(self, user_id: int, amount: Decimal) -> Dict[str, Any]:
         """
         Создание транзакции для депозита TON
@@ -32,7 +109,7 @@ class TonPaymentService:
             nanotons = str(int(amount * 10**9))
             
             # Создаем memo для идентификации платежа
-            memo = f"deposit_{user_id}_{int(amount * 100)}"
+            memo = self.deposit_memo(user_id, amount)
             
             # Формируем транзакцию для TON Connect
             transaction = {
@@ -67,60 +144,59 @@ class TonPaymentService:
             True если транзакция валидна
         """
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                # Получаем информацию о транзакции
-                response = await client.get(
-                    f"{self.api_url}/getTransactions",
-                    params={
-                        "address": self.wallet_address,
-                        "limit": 100,
-                        "api_key": self.api_key
-                    }
-                )
-                
-                if response.status_code != 200:
-                    logger.error(f"TON API error: {response.status_code}")
-                    return False
-                
-                data = response.json()
-                if not data.get("ok"):
-                    logger.error(f"TON API response error: {data.get('error', 'Unknown error')}")
-                    return False
-                
-                transactions = data.get("result", [])
-                
-                # Ищем нашу транзакцию
-                for tx in transactions:
-                    tx_id = tx.get("transaction_id", {})
-                    if tx_id.get("hash") == tx_hash:
-                        # Проверяем входящее сообщение
-                        in_msg = tx.get("in_msg", {})
-                        if not in_msg:
-                            continue
-                        
-                        # Проверяем сумму (конвертируем из nanotons)
-                        value_nanotons = int(in_msg.get("value", 0))
-                        value_ton = Decimal(value_nanotons) / Decimal(10**9)
-                        
-                        # Допускаем погрешность в 0.001 TON
-                        if abs(value_ton - expected_amount) > Decimal("0.001"):
-                            logger.warning(f"Amount mismatch: expected {expected_amount}, got {value_ton}")
-                            continue
-                        
-                        # Проверяем memo (если есть)
-                        tx_memo = in_msg.get("message", "")
-                        if memo and memo not in tx_memo:
-                            logger.warning(f"Memo mismatch: expected {memo}, got {tx_memo}")
-                            continue
-                        
-                        # Проверяем, что транзакция успешна
-                        if tx.get("out_msgs") is not None:  # Есть исходящие сообщения = успешна
-                            logger.info(f"Transaction verified: {tx_hash}")
-                            return True
-                
-                logger.warning(f"Transaction not found or invalid: {tx_hash}")
+            # Получаем информацию о транзакции
+            response = await self.http.get(
+                "getTransactions",
+                params={
+                    "address": self.wallet_address,
+                    "limit": 100,
+                    "api_key": self.api_key
+                }
+            )
+            
+            if response.status_code != 200:
+                logger.error(f"TON API error: {response.status_code}")
                 return False
-                
+            
+            data = response.json()
+            if not data.get("ok"):
+                logger.error(f"TON API response error: {data.get('error', 'Unknown error')}")
+                return False
+            
+            transactions = data.get("result", [])
+            
+            # Ищем нашу транзакцию
+            for tx in transactions:
+                tx_id = tx.get("transaction_id", {})
+                if tx_id.get("hash") == tx_hash:
+                    # Проверяем входящее сообщение
+                    in_msg = tx.get("in_msg", {})
+                    if not in_msg:
+                        continue
+                    
+                    # Проверяем сумму (конвертируем из nanotons)
+                    value_nanotons = int(in_msg.get("value", 0))
+                    value_ton = Decimal(value_nanotons) / Decimal(10**9)
+                    
+                    # Допускаем погрешность в 0.001 TON
+                    if abs(value_ton - expected_amount) > Decimal("0.001"):
+                        logger.warning(f"Amount mismatch: expected {expected_amount}, got {value_ton}")
+                        continue
+                    
+                    # Проверяем memo (если есть)
+                    tx_memo = in_msg.get("message", "")
+                    if memo and memo not in tx_memo:
+                        logger.warning(f"Memo mismatch: expected {memo}, got {tx_memo}")
+                        continue
+                    
+                    # Проверяем, что транзакция успешна
+                    if tx.get("out_msgs") is not None:  # Есть исходящие сообщения = успешна
+                        logger.info(f"Transaction verified: {tx_hash}")
+                        return True
+            
+            logger.warning(f"Transaction not found or invalid: {tx_hash}")
+            return False
+            
         except Exception as e:
             logger.error(f"Error verifying TON transaction: {str(e)}")
             return False
@@ -133,28 +209,27 @@ class TonPaymentService:
             Баланс в TON или None при ошибке
         """
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(
-                    f"{self.api_url}/getAddressBalance",
-                    params={
-                        "address": self.wallet_address,
-                        "api_key": self.api_key
-                    }
-                )
-                
-                if response.status_code != 200:
-                    return None
-                
-                data = response.json()
-                if not data.get("ok"):
-                    return None
-                
-                # Конвертируем из nanotons в TON
-                balance_nanotons = int(data.get("result", 0))
-                balance_ton = Decimal(balance_nanotons) / Decimal(10**9)
-                
-                return balance_ton
-                
+            response = await self.http.get(
+                "getAddressBalance",
+                params={
+                    "address": self.wallet_address,
+                    "api_key": self.api_key
+                }
+            )
+            
+            if response.status_code != 200:
+                return None
+            
+            data = response.json()
+            if not data.get("ok"):
+                return None
+            
+            # Конвертируем из nanotons в TON
+            balance_nanotons = int(data.get("result", 0))
+            balance_ton = Decimal(balance_nanotons) / Decimal(10**9)
+            
+            return balance_ton
+            
         except Exception as e:
             logger.error(f"Error getting wallet balance: {str(e)}")
             return None
@@ -170,42 +245,41 @@ class TonPaymentService:
             Детали транзакции или None
         """
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(
-                    f"{self.api_url}/getTransactions",
-                    params={
-                        "address": self.wallet_address,
-                        "limit": 100,
-                        "api_key": self.api_key
-                    }
-                )
-                
-                if response.status_code != 200:
-                    return None
-                
-                data = response.json()
-                if not data.get("ok"):
-                    return None
-                
-                transactions = data.get("result", [])
-                
-                for tx in transactions:
-                    tx_id = tx.get("transaction_id", {})
-                    if tx_id.get("hash") == tx_hash:
-                        in_msg = tx.get("in_msg", {})
-                        
-                        return {
-                            "hash": tx_hash,
-                            "timestamp": tx.get("utime", 0),
-                            "value_nanotons": int(in_msg.get("value", 0)),
-                            "value_ton": float(Decimal(in_msg.get("value", 0)) / Decimal(10**9)),
-                            "from_address": in_msg.get("source", ""),
-                            "message": in_msg.get("message", ""),
-                            "success": tx.get("out_msgs") is not None
-                        }
-                
+            response = await self.http.get(
+                "getTransactions",
+                params={
+                    "address": self.wallet_address,
+                    "limit": 100,
+                    "api_key": self.api_key
+                }
+            )
+            
+            if response.status_code != 200:
+                return None
+            
+            data = response.json()
+            if not data.get("ok"):
                 return None
-                
+            
+            transactions = data.get("result", [])
+            
+            for tx in transactions:
+                tx_id = tx.get("transaction_id", {})
+                if tx_id.get("hash") == tx_hash:
+                    in_msg = tx.get("in_msg", {})
+                    
+                    return {
+                        "hash": tx_hash,
+                        "timestamp": tx.get("utime", 0),
+                        "value_nanotons": int(in_msg.get("value", 0)),
+                        "value_ton": float(Decimal(in_msg.get("value", 0)) / Decimal(10**9)),
+                        "from_address": in_msg.get("source", ""),
+                        "message": in_msg.get("message", ""),
+                        "success": tx.get("out_msgs") is not None
+                    }
+            
+            return None
+            
         except Exception as e:
             logger.error(f"Error getting transaction details: {str(e)}")
             return None
@@ -0,0 +1,166 @@
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import bindparam, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import settings
+from .database import AsyncSessionLocal
+from .models import User
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceTracker:
+    """
+    Активность пользователей с отложенной записью last_active
+
+    Отметка активности не пишет в БД: время последнего обращения
+    копится в памяти и раз в presence_flush_interval секунд записывается
+    одним пакетным UPDATE (повторные обращения пользователя между
+    сбросами схлопываются в одну строку). По записанному last_active
+    считаются пользователи онлайн во всех процессах (count_online).
+
+    Дополнительно хранит скользящее окно presence_window секунд в порядке
+    обращений: устаревшие записи снимаются с начала, поэтому отметка и
+    локальный подсчет (online) стоят O(1) в среднем.
+    """
+
+    def __init__(
+        self,
+        window: Optional[float] = None,
+        session_factory=AsyncSessionLocal,
+        flush_interval: Optional[float] = None
+    ):
+        self.window = window or settings.presence_window
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval or settings.presence_flush_interval
+        self._seen: "OrderedDict[int, float]" = OrderedDict()
+        self._pending: Dict[int, datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.touches = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+
+    def touch(self, user_id: int):
+        """Отметить активность пользователя"""
+        now = time.monotonic()
+        self._seen[user_id] = now
+        self._seen.move_to_end(user_id)
+        self._pending[user_id] = datetime.utcnow()
+        self.touches += 1
+        self._expire(now)
+
+    def _expire(self, now: float):
+        while self._seen:
+            user_id, seen_at = next(iter(self._seen.items()))
+            if now - seen_at < self.window:
+                break
+            del self._seen[user_id]
+
+    def online(self) -> int:
+        """Количество пользователей, активных за окно в этом процессе"""
+        self._expire(time.monotonic())
+        return len(self._seen)
+
+    async def count_online(self, db: AsyncSession) -> int:
+        """
+        Количество пользователей, активных за окно во всех процессах
+
+        Считается по last_active (индекс idx_user_last_active), поэтому
+        видит активность, уже сброшенную в БД: отметки из буфера попадут
+        в подсчет после очередного сброса (не позже flush_interval).
+        """
+        since = datetime.utcnow() - timedelta(seconds=self.window)
+        return await db.scalar(select(func.count(User.id)).where(User.last_active >= since)) or 0
+
+    async def start(self):
+        """Запустить периодический сброс активности в БД"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Остановить сброс и записать накопленную активность"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Presence flush error: {str(e)}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Presence flush error: {str(e)}")
+
+    async def flush(self) -> int:
+        """
+        Записать накопленную активность одним пакетным UPDATE
+
+        last_active только увеличивается: запись от другого процесса
+        с более поздним временем не затирается. При ошибке отметки
+        возвращаются в буфер и уйдут со следующим сбросом.
+
+        Returns:
+            Количество пользователей в пакете
+        """
+        async with self._lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            users = User.__table__
+            statement = (
+                update(users)
+                .where(
+                    users.c.id == bindparam("user_id"),
+                    or_(users.c.last_active.is_(None), users.c.last_active < bindparam("seen_at"))
+                )
+                .values(last_active=bindparam("seen_at"))
+            )
+            rows = [{"user_id": user_id, "seen_at": seen_at} for user_id, seen_at in pending.items()]
+
+            try:
+                async with self.session_factory() as db:
+                    await db.execute(statement, rows)
+                    await db.commit()
+            except BaseException:
+                # Более свежие отметки, пришедшие во время сброса, важнее
+                for user_id, seen_at in pending.items():
+                    self._pending.setdefault(user_id, seen_at)
+                raise
+
+            self.flushes += 1
+            self.flushed_rows += len(rows)
+            return len(rows)
+
+    def stats(self) -> dict:
+        """Счетчики присутствия"""
+        return {
+            "online": self.online(),
+            "window": self.window,
+            "touches": self.touches,
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+        }
+
+
+# Создаем глобальный экземпляр трекера
+presence = PresenceTracker()
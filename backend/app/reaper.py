@@ -0,0 +1,199 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import select, update
+
+from . import jobs
+from .config import settings
+from .database import AsyncSessionLocal
+from .models import Job, Transaction
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ReapRule:
+    """Переход status -> new_status для транзакций type старше max_age"""
+    name: str
+    type: str
+    status: str
+    new_status: str
+    max_age: timedelta
+
+
+def default_rules() -> List[ReapRule]:
+    """Правила из настроек"""
+    fail_after = timedelta(hours=settings.reaper_processing_fail_hours)
+    return [
+        ReapRule("ton_pending", "deposit_ton", "pending", "cancelled",
+                 timedelta(minutes=settings.reaper_ton_pending_minutes)),
+        ReapRule("stars_pending", "deposit_stars", "pending", "cancelled",
+                 timedelta(minutes=settings.reaper_stars_pending_minutes)),
+        ReapRule("ton_processing", "deposit_ton", "processing", "failed", fail_after),
+        ReapRule("stars_processing", "deposit_stars", "processing", "failed", fail_after),
+    ]
+
+
+class TransactionReaper:
+    """
+    Периодическая очистка зависших депозитов
+
+    Брошенные депозиты (pending) отменяются, платежи, зависшие в processing,
+    помечаются failed. Отмена TON депозита не окончательна: перевод с его
+    memo, пришедший позже, сканер все равно зачтет (PAYABLE_STATUSES). Строки выбираются по индексу (status, created_at)
+    и обновляются пачками по reaper_batch_size в отдельных коротких
+    транзакциях: запись не блокирует БД надолго. TON платежи в processing
+    без активной задачи проверки (задача потеряна или перевод еще не был
+    проиндексирован) до перевода в failed проверяются повторно.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, rules: Optional[List[ReapRule]] = None):
+        self.session_factory = session_factory
+        self.rules = rules
+        self._task: Optional[asyncio.Task] = None
+
+        self.sweeps = 0
+        self.totals: Dict[str, int] = {}
+        self.last_report: Dict[str, object] = {}
+
+    async def start(self):
+        """Запустить периодическую очистку"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Остановить периодическую очистку"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Transaction reaper error: {str(e)}")
+            await asyncio.sleep(settings.reaper_interval)
+
+    async def sweep(self) -> Dict[str, object]:
+        """
+        Один проход по всем правилам
+
+        Returns:
+            Отчет: количество строк по правилам, повторные проверки, время (мс)
+        """
+        start = time.perf_counter()
+        now = datetime.utcnow()
+        counts: Dict[str, int] = {}
+
+        counts["ton_processing_retried"] = await self.retry_processing(now)
+        for rule in self.rules or default_rules():
+            counts[rule.name] = await self.apply(rule, now)
+
+        for name, value in counts.items():
+            self.totals[name] = self.totals.get(name, 0) + value
+        self.sweeps += 1
+        self.last_report = {
+            **counts,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+            "finished_at": datetime.utcnow().isoformat(),
+        }
+
+        if any(counts.values()):
+            logger.info(f"Transaction reaper: {self.last_report}")
+        return self.last_report
+
+    async def apply(self, rule: ReapRule, now: datetime) -> int:
+        """Перевести подходящие под правило строки пачками"""
+        cutoff = now - rule.max_age
+        stale = (
+            Transaction.status == rule.status,
+            Transaction.created_at < cutoff,
+            Transaction.type == rule.type,
+        )
+        total = 0
+
+        for _ in range(settings.reaper_max_batches):
+            async with self.session_factory() as db:
+                batch = (
+                    select(Transaction.id)
+                    .where(*stale)
+                    .order_by(Transaction.created_at)
+                    .limit(settings.reaper_batch_size)
+                )
+                result = await db.execute(
+                    update(Transaction)
+                    # Статус проверяется повторно: строку мог завершить платеж
+                    .where(Transaction.id.in_(batch.scalar_subquery()), *stale)
+                    .values(status=rule.new_status)
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+
+            total += result.rowcount
+            if result.rowcount < settings.reaper_batch_size:
+                break
+
+        return total
+
+    async def retry_processing(self, now: datetime) -> int:
+        """
+        Поставить повторную проверку TON платежам в processing, у которых
+        нет задачи за последние reaper_processing_retry_minutes
+        """
+        retry_after = now - timedelta(minutes=settings.reaper_processing_retry_minutes)
+        fail_after = now - timedelta(hours=settings.reaper_processing_fail_hours)
+
+        async with self.session_factory() as db:
+            rows = (await db.execute(
+                select(Transaction.id, Transaction.external_id)
+                .where(
+                    Transaction.status == "processing",
+                    Transaction.created_at < retry_after,
+                    Transaction.created_at >= fail_after,
+                    Transaction.type == "deposit_ton",
+                    Transaction.external_id.is_not(None)
+                )
+                .order_by(Transaction.created_at)
+                .limit(settings.reaper_batch_size)
+            )).all()
+            if not rows:
+                return 0
+
+            refs = {f"transaction:{row.id}": row for row in rows}
+            recent = set((await db.scalars(
+                select(Job.ref).where(Job.ref.in_(refs), Job.created_at >= retry_after)
+            )).all())
+
+            retried = 0
+            for ref, row in refs.items():
+                if ref in recent:
+                    continue
+                jobs.enqueue(db, "payment.ton", {"transaction_id": row.id, "tx_hash": row.external_id}, ref=ref)
+                retried += 1
+            await db.commit()
+
+        return retried
+
+    def stats(self) -> dict:
+        """Счетчики очистки"""
+        return {
+            "running": self._task is not None,
+            "sweeps": self.sweeps,
+            "totals": self.totals,
+            "last": self.last_report,
+        }
+
+
+# Создаем глобальный экземпляр очистки
+transaction_reaper = TransactionReaper()
@@ -0,0 +1,145 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import DateTime, case, delete, func, insert, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import dialect_insert
+from .models import ReferralStats, User
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ReferralRollup:
+    """
+    Итоги по рефералам пользователя, обновляемые при записи
+
+    Строка на реферера: сколько пользователей он пригласил и сколько из них
+    открыли хотя бы один кейс. Меняется атомарным upsert при регистрации
+    реферала и условным UPDATE при первом открытии кейса рефералом,
+    поэтому статистика рефералов - чтение одной строки по первичному
+    ключу вместо подсчета по users. Коммит остается за вызывающим кодом.
+    """
+
+    async def add_referral(self, db: AsyncSession, referrer_id: int):
+        """Учесть нового реферала (в транзакции регистрации)"""
+        now = datetime.utcnow()
+        statement = dialect_insert(ReferralStats).values(
+            user_id=referrer_id,
+            referrals=1,
+            active_referrals=0,
+            updated_at=now
+        )
+        await db.execute(statement.on_conflict_do_update(
+            index_elements=["user_id"],
+            set_={"referrals": ReferralStats.referrals + 1, "updated_at": now}
+        ))
+
+    async def activate(self, db: AsyncSession, user_id: int, opened: int):
+        """
+        Учесть первое открытие кейса рефералом (после списания в той же транзакции)
+
+        Списание уже увеличило total_cases_opened на opened, поэтому
+        total_cases_opened == opened означает, что до этого открытий не было.
+        Строка пользователя заблокирована списанием, так что параллельные
+        открытия не засчитают реферала дважды. Для пользователя без реферера
+        подзапрос пуст и UPDATE ничего не меняет.
+
+        Args:
+            db: Сессия БД
+            user_id: Пользователь, открывший кейс
+            opened: Сколько кейсов открыто этим списанием
+        """
+        referrer_id = (
+            select(User.referred_by)
+            .where(User.id == user_id, User.total_cases_opened == opened)
+            .scalar_subquery()
+        )
+        await db.execute(
+            update(ReferralStats)
+            .where(ReferralStats.user_id == referrer_id)
+            .values(active_referrals=ReferralStats.active_referrals + 1, updated_at=datetime.utcnow())
+        )
+
+    async def get(self, db: AsyncSession, user_id: int) -> Dict[str, int]:
+        """Итоги реферера (нули, если рефералов нет)"""
+        row = await db.get(ReferralStats, user_id)
+        return {
+            "total_referrals": row.referrals if row else 0,
+            "active_referrals": row.active_referrals if row else 0,
+        }
+
+    async def rebuild(self, db: AsyncSession, user_id: Optional[int] = None) -> int:
+        """
+        Пересчитать итоги по users (восстановление после ручных правок)
+
+        Args:
+            db: Сессия БД
+            user_id: Реферер (по умолчанию - все)
+
+        Returns:
+            Количество строк итогов
+        """
+        users_scope = [User.referred_by == user_id] if user_id is not None else [User.referred_by.is_not(None)]
+        stats_scope = [ReferralStats.user_id == user_id] if user_id is not None else []
+        await db.execute(delete(ReferralStats).where(*stats_scope))
+
+        result = await db.execute(insert(ReferralStats).from_select(
+            ["user_id", "referrals", "active_referrals", "updated_at"],
+            select(
+                User.referred_by,
+                func.count(User.id),
+                func.count(User.id).filter(User.total_cases_opened > 0),
+                literal(datetime.utcnow(), DateTime),
+            )
+            .where(*users_scope)
+            .group_by(User.referred_by)
+        ))
+        return max(result.rowcount, 0)
+
+
+async def referral_tree(db: AsyncSession, user_id: int, depth: int) -> List[Dict[str, Any]]:
+    """
+    Рефералы по уровням (рекурсивный CTE с ограничением глубины)
+
+    Каждый уровень - одно соединение с users по индексу referred_by,
+    рекурсия останавливается на depth. Отдаются агрегаты по уровням,
+    а не сами пользователи: у крупных партнеров дерево большое.
+
+    Args:
+        db: Сессия БД
+        user_id: Корень дерева
+        depth: Сколько уровней спускаться (1 - прямые рефералы)
+
+    Returns:
+        Список {"depth", "referrals", "active_referrals"} по уровням
+    """
+    tree = (
+        select(User.id, User.total_cases_opened, literal(1).label("depth"))
+        .where(User.referred_by == user_id)
+        .cte("referral_tree", recursive=True)
+    )
+    tree = tree.union_all(
+        select(User.id, User.total_cases_opened, (tree.c.depth + 1).label("depth"))
+        .join(tree, User.referred_by == tree.c.id)
+        .where(tree.c.depth < depth)
+    )
+
+    rows = await db.execute(
+        select(
+            tree.c.depth,
+            func.count(),
+            func.sum(case((tree.c.total_cases_opened > 0, 1), else_=0)),
+        )
+        .group_by(tree.c.depth)
+        .order_by(tree.c.depth)
+    )
+    return [
+        {"depth": level, "referrals": referrals, "active_referrals": active or 0}
+        for level, referrals, active in rows
+    ]
+
+
+# Создаем глобальный экземпляр итогов
+referral_rollup = ReferralRollup()
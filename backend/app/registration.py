@@ -0,0 +1,123 @@
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import counters
+from .auth import decode_referral_code, generate_referral_code
+from .config import settings
+from .counters import global_counters
+from .database import dialect_insert
+from .ledger import ledger
+from .models import ReferralCodeAlias, ReferralTransaction, Transaction, User
+from .referrals import referral_rollup
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+async def register_user(
+    db: AsyncSession,
+    user_data: Dict[str, Any],
+    referral_code: Optional[str] = None
+) -> Optional[User]:
+    """
+    Зарегистрировать пользователя одной транзакцией
+
+    Пользователь создается одним INSERT ... ON CONFLICT (telegram_id)
+    DO NOTHING RETURNING: реферер ищется подзапросом в том же выражении
+    (referrer_id_query), реферальный код считается из полученного ID,
+    а повторный вход того же пользователя (двойное нажатие) не падает на
+    уникальном ключе, а получает пустой результат. Только вызов, который
+    действительно создал строку, начисляет бонус рефереру и пишет
+    referral_bonus и ReferralTransaction в той же транзакции.
+    Коммит остается за вызывающим кодом.
+
+    Args:
+        db: Сессия БД
+        user_data: Проверенные данные пользователя (validate_user_data)
+        referral_code: Реферальный код из start_param
+
+    Returns:
+        Созданный пользователь или None, если он уже существует
+    """
+    referrer_id = referrer_id_query(referral_code) if referral_code else None
+
+    statement = (
+        dialect_insert(User)
+        .values(
+            telegram_id=user_data['telegram_id'],
+            username=user_data['username'],
+            first_name=user_data['first_name'],
+            last_name=user_data['last_name'],
+            referred_by=referrer_id,
+            balance_stars=settings.welcome_bonus_stars,
+            last_active=datetime.utcnow()
+        )
+        .on_conflict_do_nothing(index_elements=["telegram_id"])
+        .returning(User)
+    )
+    user = (await db.scalars(statement, execution_options={"populate_existing": True})).first()
+    if user is None:
+        return None
+
+    # Код из ID не пересекается с кодами других пользователей
+    user.referral_code = generate_referral_code(user.id)
+    await db.flush()
+
+    await global_counters.increment(db, counters.USERS)
+    if user.referred_by is not None:
+        await award_referral_bonus(db, user.referred_by, user.id)
+    return user
+
+
+def referrer_id_query(referral_code: str):
+    """
+    Подзапрос ID реферера по коду
+
+    Код текущей схемы декодируется в ID без поиска по referral_code
+    (подзапрос только проверяет, что пользователь существует, по
+    первичному ключу), старые коды ищутся в referral_code_aliases.
+    """
+    user_id = decode_referral_code(referral_code)
+    if user_id is not None:
+        return select(User.id).where(User.id == user_id).scalar_subquery()
+    return select(ReferralCodeAlias.user_id).where(ReferralCodeAlias.code == referral_code).scalar_subquery()
+
+
+async def award_referral_bonus(db: AsyncSession, referrer_id: int, referred_id: int) -> ReferralTransaction:
+    """
+    Начислить рефереру бонус за приглашенного пользователя
+
+    Бонус фиксированный (referral_bonus_stars), поэтому commission_rate
+    в ReferralTransaction равен 0. Коммит остается за вызывающим кодом.
+    """
+    now = datetime.utcnow()
+    amount = settings.referral_bonus_stars
+
+    await ledger.credit(db, referrer_id, amount)
+    bonus = Transaction(
+        user_id=referrer_id,
+        type="referral_bonus",
+        amount=amount,
+        currency="STARS",
+        status="completed",
+        description=f"Referral bonus for user {referred_id}",
+        completed_at=now
+    )
+    db.add(bonus)
+    await db.flush()
+
+    referral = ReferralTransaction(
+        referrer_id=referrer_id,
+        referred_id=referred_id,
+        transaction_id=bonus.id,
+        commission_amount=amount,
+        commission_rate=0,
+        status="paid",
+        paid_at=now
+    )
+    db.add(referral)
+    await referral_rollup.add_referral(db, referrer_id)
+    return referral
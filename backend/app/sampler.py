@@ -0,0 +1,163 @@
+import random
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from .cache import mark_invalidated, register_invalidation_handler
+from .models import Case, CaseItem
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AliasSampler:
+    """
+    Взвешенный выбор предмета методом алиасов (Walker/Vose)
+
+    Таблицы строятся один раз за O(n), после чего каждый выбор стоит O(1)
+    """
+
+    def __init__(self, items: List[dict]):
+        if not items:
+            raise ValueError("Case has no items")
+
+        self.items = list(items)
+        n = len(self.items)
+
+        # Нулевые и отрицательные веса трактуем как 1 (как и раньше)
+        weights = []
+        for item in self.items:
+            weight = item.get('weight', 1)
+            if weight <= 0:
+                weight = 1
+            weights.append(weight)
+
+        total = float(sum(weights))
+        scaled = [weight * n / total for weight in weights]
+
+        self._prob = [1.0] * n
+        self._alias = list(range(n))
+
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+
+            self._prob[s] = scaled[s]
+            self._alias[s] = l
+
+            scaled[l] = (scaled[l] + scaled[s]) - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+
+        # Остатки из-за погрешности округления получают вероятность 1
+        for i in small + large:
+            self._prob[i] = 1.0
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def sample(self, rng: random.Random = random) -> dict:
+        """Выбирает один предмет за O(1)"""
+        u = rng.random() * len(self.items)
+        i = int(u)
+        if u - i < self._prob[i]:
+            return self.items[i]
+        return self.items[self._alias[i]]
+
+    def sample_many(self, count: int, rng: random.Random = random) -> List[dict]:
+        """Выбирает count предметов (с возвращением)"""
+        return [self.sample(rng) for _ in range(count)]
+
+
+class SamplerCache:
+    """
+    In-process кеш скомпилированных сэмплеров кейсов
+
+    Ключ записи - id кейса, версия - Case.updated_at. Если версия строки
+    изменилась, запись пересобирается при следующем обращении.
+    """
+
+    def __init__(self):
+        self._entries: Dict[int, Tuple[Any, AliasSampler]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, case_id: int, version: Any) -> Optional[AliasSampler]:
+        """
+        Получить сэмплер кейса
+
+        Args:
+            case_id: ID кейса
+            version: Версия строки кейса (updated_at)
+
+        Returns:
+            Сэмплер или None, если его нужно собрать заново
+        """
+        entry = self._entries.get(case_id)
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        return None
+
+    def put(self, case_id: int, version: Any, items: List[dict]) -> AliasSampler:
+        """Собрать сэмплер из предметов кейса и положить его в кеш"""
+        sampler = AliasSampler(items)
+        self._entries[case_id] = (version, sampler)
+        return sampler
+
+    def invalidate(self, case_id: Optional[int] = None):
+        """Сбросить запись кейса (или весь кеш, если case_id не указан)"""
+        if case_id is None:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+        elif self._entries.pop(case_id, None) is not None:
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики кеша"""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+# Создаем глобальный экземпляр кеша
+sampler_cache = SamplerCache()
+
+# Изменения кейсов на других воркерах приходят через общий кеш
+register_invalidation_handler("case", sampler_cache.invalidate)
+
+
+def _invalidate_case(target, case_id: int):
+    sampler_cache.invalidate(case_id)
+
+    session = object_session(target)
+    if session is not None:
+        mark_invalidated(session, "case", case_id)
+
+
+@event.listens_for(Case, "after_update")
+@event.listens_for(Case, "after_delete")
+def _invalidate_case_sampler(mapper, connection, target):
+    """Сбрасываем сэмплер при любом изменении строки кейса через ORM"""
+    _invalidate_case(target, target.id)
+
+
+@event.listens_for(CaseItem, "after_insert")
+@event.listens_for(CaseItem, "after_update")
+@event.listens_for(CaseItem, "after_delete")
+def _invalidate_case_item_sampler(mapper, connection, target):
+    """Сбрасываем сэмплер кейса при изменении его предметов через ORM"""
+    _invalidate_case(target, target.case_id)
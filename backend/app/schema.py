@@ -0,0 +1,57 @@
+from pathlib import Path
+from typing import Optional, Tuple
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+
+from .config import settings
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+class SchemaOutdatedError(RuntimeError):
+    """Схема БД не соответствует последней миграции"""
+
+
+def alembic_config(database_url: Optional[str] = None) -> Config:
+    """Конфигурация Alembic, не зависящая от текущей директории"""
+    config = Config(str(BACKEND_DIR / "alembic.ini"))
+    config.set_main_option("script_location", str(BACKEND_DIR / "migrations"))
+    config.set_main_option("sqlalchemy.url", database_url or settings.database_url)
+    return config
+
+
+def head_revision() -> Optional[str]:
+    """Последняя ревизия миграций (читается из файлов, без БД)"""
+    return ScriptDirectory.from_config(alembic_config()).get_current_head()
+
+
+async def current_revision(engine) -> Optional[str]:
+    """Ревизия, до которой мигрирована БД (None - миграции не применялись)"""
+    async with engine.connect() as conn:
+        return await conn.run_sync(
+            lambda sync_conn: MigrationContext.configure(sync_conn).get_current_revision()
+        )
+
+
+async def check_schema(engine) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Быстрая проверка версии схемы при старте сервера
+
+    Один SELECT из alembic_version вместо create_all.
+
+    Returns:
+        Кортеж (текущая ревизия, последняя ревизия)
+
+    Raises:
+        SchemaOutdatedError: БД не мигрирована до последней ревизии
+    """
+    current, head = await current_revision(engine), head_revision()
+
+    if current != head:
+        raise SchemaOutdatedError(
+            f"Database schema is at revision {current or 'none'}, expected {head}. "
+            f"Run: crazygift-admin migrate"
+        )
+
+    return current, head
@@ -188,6 +188,19 @@ class CaseOpenResponse(BaseModel):
     message: str
 
 
+class CaseOpenBatchRequest(BaseModel):
+    user_id: int
+    count: int = Field(ge=1, le=100, description="Number of cases to open")
+
+
+class CaseOpenBatchResponse(BaseModel):
+    success: bool
+    items: List[InventoryItemResponse] = []
+    new_balance: int
+    total_spent: int = 0
+    message: str
+
+
 # ================= INVENTORY ACTION SCHEMAS =================
 
 class SellItemRequest(BaseModel):
@@ -220,7 +233,9 @@ class TelegramAuthRequest(BaseModel):
 class TelegramAuthResponse(BaseModel):
     success: bool
     user: UserResponse
-    access_token: Optional[str] = None
+    access_token: Optional[str] = None  # Токен сессии для Authorization: Bearer
+    token_type: str = "bearer"
+    expires_in: Optional[int] = None  # Срок жизни токена, секунды
 
 
 # ================= ADMIN SCHEMAS =================
@@ -254,8 +269,9 @@ class HistoryFilter(BaseModel):
 
 class HistoryResponse(BaseModel):
     transactions: List[TransactionResponse]
-    total: int
+    total: Optional[int] = None  # Только с include_total=true
     has_more: bool
+    next_cursor: Optional[str] = None  # Передать как cursor для следующей страницы
 
 
 # ================= ERROR SCHEMAS =================
@@ -0,0 +1,228 @@
+import asyncio
+import os
+import signal
+import socket
+import time
+from typing import Dict
+
+import uvicorn
+from uvicorn.importer import import_from_string
+
+from .config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+APP_PATH = "app.main:app"
+
+
+def worker_count() -> int:
+    """Количество воркеров из настроек (0 - по числу CPU)"""
+    return settings.workers if settings.workers > 0 else (os.cpu_count() or 1)
+
+
+def event_loop_name() -> str:
+    """Event loop, который выберет uvicorn при loop=auto"""
+    try:
+        import uvloop  # noqa: F401
+        return "uvloop"
+    except ImportError:
+        return "asyncio"
+
+
+def make_config(app) -> uvicorn.Config:
+    """Конфигурация uvicorn для production воркера"""
+    return uvicorn.Config(
+        app,
+        loop="auto",  # uvloop, если установлен
+        http="auto",  # httptools, если установлен
+        lifespan="on",
+        timeout_keep_alive=settings.keepalive_timeout,
+        timeout_graceful_shutdown=settings.graceful_timeout,
+        backlog=settings.backlog,
+        limit_max_requests=settings.max_requests or None,
+        proxy_headers=True,
+        access_log=False,
+        log_level="warning",
+    )
+
+
+class WorkerSupervisor:
+    """
+    Pre-fork супервизор воркеров uvicorn
+
+    Приложение импортируется один раз в мастер-процессе, затем
+    форкаются воркеры, которые принимают соединения с общего сокета.
+    SIGTERM/SIGINT запускают плавную остановку: воркеры перестают
+    принимать соединения, дожидаются текущих запросов и выходят.
+    Упавшие воркеры перезапускаются.
+    """
+
+    def __init__(self, app_path: str, workers: int, host: str, port: int):
+        self.app_path = app_path
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.children: Dict[int, float] = {}
+        self.shutting_down = False
+
+    def run(self):
+        start = time.perf_counter()
+
+        # Предзагрузка: воркеры получают уже импортированное приложение
+        app = import_from_string(self.app_path)
+        asyncio.run(self._prepare(app))
+        sock = self._bind()
+
+        print(
+            f"🚀 Preloaded app and checked schema in {(time.perf_counter() - start) * 1000:.0f}ms, "
+            f"listening on {self.host}:{self.port} with {self.workers} workers"
+        )
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+
+        for _ in range(self.workers):
+            self._spawn(app, sock)
+
+        while not self.shutting_down:
+            self._reap(app, sock)
+            time.sleep(0.5)
+
+        self._stop_children()
+        sock.close()
+        print("✅ All workers stopped")
+
+    @staticmethod
+    async def _prepare(app):
+        """Однократная проверка схемы БД до форка"""
+        from .database import engine
+        from .schema import check_schema
+
+        try:
+            await check_schema(engine)
+        finally:
+            await engine.dispose()
+        app.state.schema_ready = True
+
+    def _bind(self) -> socket.socket:
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(settings.backlog)
+        sock.set_inheritable(True)
+        return sock
+
+    def _spawn(self, app, sock: socket.socket):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.monotonic()
+            return
+
+        # Дочерний процесс
+        exit_code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            self._serve_worker(app, sock)
+        except Exception as e:
+            logger.error(f"Worker {os.getpid()} crashed: {str(e)}", exc_info=True)
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    @staticmethod
+    def _serve_worker(app, sock: socket.socket):
+        # Соединения пула, открытые до форка, не должны использоваться воркерами
+        from .database import dispose_after_fork
+        dispose_after_fork()
+
+        config = make_config(app)
+        config.load()
+
+        print(f"✅ Worker {os.getpid()} started (loop: {event_loop_name()}, http: {config.http_protocol_class.__name__})")
+
+        uvicorn.Server(config).run(sockets=[sock])
+
+    def _reap(self, app, sock: socket.socket):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            started = self.children.pop(pid, None)
+            if started is None or self.shutting_down:
+                continue
+
+            print(f"⚠️  Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting")
+
+            # Защита от цикла падений сразу после старта
+            if time.monotonic() - started < 1:
+                time.sleep(1)
+
+            self._spawn(app, sock)
+
+    def _handle_stop(self, signum, frame):
+        self.shutting_down = True
+
+    def _stop_children(self):
+        print(f"🔄 Draining {len(self.children)} workers...")
+
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self.children.pop(pid, None)
+
+        deadline = time.monotonic() + settings.graceful_timeout + 5
+        while self.children and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                self.children.pop(pid, None)
+            else:
+                time.sleep(0.1)
+
+        for pid in list(self.children):
+            print(f"🔨 Worker {pid} did not stop in time, killing")
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+
+
+def run():
+    """Запуск сервера в режиме, соответствующем настройкам"""
+    if settings.debug:
+        # Разработка: один процесс с автоперезагрузкой
+        uvicorn.run(
+            APP_PATH,
+            host=settings.host,
+            port=settings.port,
+            reload=True,
+            reload_dirs=["app"],
+            log_level="info",
+        )
+        return
+
+    workers = worker_count()
+
+    if workers == 1 or not hasattr(os, "fork"):
+        config = make_config(APP_PATH)
+        config.host = settings.host
+        config.port = settings.port
+        uvicorn.Server(config).run()
+        return
+
+    WorkerSupervisor(APP_PATH, workers, settings.host, settings.port).run()
+
+
+if __name__ == "__main__":
+    run()
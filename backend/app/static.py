@@ -0,0 +1,38 @@
+from pathlib import Path
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+from starlette.responses import Response
+
+from .config import settings
+
+
+# Корень фронтенда по умолчанию - папка frontend рядом с backend
+DEFAULT_STATIC_DIR = Path(__file__).resolve().parent.parent.parent / "frontend"
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    Статика фронтенда с заголовками кеширования
+
+    HTML всегда перепроверяется (ETag / Last-Modified от StaticFiles),
+    остальные ресурсы кешируются браузером на static_max_age секунд.
+    """
+
+    def __init__(self, *args, max_age: int, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_age = max_age
+
+    def file_response(self, full_path, stat_result, scope: Scope, status_code: int = 200) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code)
+
+        if settings.debug or str(full_path).endswith(".html"):
+            response.headers["Cache-Control"] = "no-cache"
+        else:
+            response.headers["Cache-Control"] = f"public, max-age={self.max_age}"
+
+        return response
+
+
+def get_static_dir() -> Path:
+    """Папка со статикой фронтенда"""
+    return Path(settings.static_dir) if settings.static_dir else DEFAULT_STATIC_DIR
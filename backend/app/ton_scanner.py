@@ -0,0 +1,377 @@
+import asyncio
+import time
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import case, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import notifications
+from .config import settings
+from .database import AsyncSessionLocal, dialect_insert
+from .ledger import ledger
+from .models import TonIncomingMessage, TonScanCursor, Transaction, User
+from .payments.telegram import telegram_service
+from .payments.ton import ton_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+NANOTONS = Decimal(10**9)
+# Допустимая погрешность суммы депозита
+AMOUNT_TOLERANCE = Decimal("0.001")
+# Статусы депозита, которому можно зачесть перевод: неоплаченный депозит
+# отменяется по таймауту, но перевод с его memo может прийти и позже
+PAYABLE_STATUSES = ("pending", "processing", "cancelled")
+
+
+def message_matches(message: TonIncomingMessage, amount: Decimal, memo: str) -> bool:
+    """Перевод соответствует депозиту по сумме и memo"""
+    value_ton = Decimal(message.value_nanotons) / NANOTONS
+    return (
+        message.success
+        and abs(value_ton - amount) <= AMOUNT_TOLERANCE
+        and (message.memo or "").strip() == memo
+    )
+
+
+async def complete_deposit(
+    db: AsyncSession,
+    transaction: Transaction,
+    telegram_id: int,
+    message: TonIncomingMessage
+) -> Optional[int]:
+    """
+    Зачесть перевод депозиту: завершить транзакцию и начислить звезды
+
+    Перевод закрепляется за депозитом условным UPDATE, поэтому сканер и
+    webhook не зачтут один перевод дважды. Коммит остается за вызывающим кодом.
+
+    Returns:
+        Новый баланс или None, если перевод или депозит уже обработаны
+    """
+    claimed = await db.execute(
+        update(TonIncomingMessage)
+        .where(
+            TonIncomingMessage.id == message.id,
+            TonIncomingMessage.matched_transaction_id.is_(None)
+        )
+        .values(matched_transaction_id=transaction.id)
+    )
+    if claimed.rowcount == 0:
+        return None
+
+    completed = await db.execute(
+        update(Transaction)
+        .where(
+            Transaction.id == transaction.id,
+            Transaction.status.in_(PAYABLE_STATUSES)
+        )
+        .values(
+            status="completed",
+            external_id=message.tx_hash,
+            completed_at=datetime.utcnow()
+        )
+    )
+    if completed.rowcount == 0:
+        # Депозит уже завершен другим переводом - освобождаем этот
+        await db.execute(
+            update(TonIncomingMessage)
+            .where(TonIncomingMessage.id == message.id)
+            .values(matched_transaction_id=None)
+        )
+        return None
+
+    # Конвертируем TON в звезды (1 TON = 100 stars)
+    stars_amount = int(transaction.amount * 100)
+    new_balance = await ledger.credit(db, transaction.user_id, stars_amount)
+
+    notifications.enqueue(
+        db, telegram_id,
+        telegram_service.format_payment_success(stars_amount, new_balance),
+        kind="payment_success"
+    )
+    return new_balance
+
+
+class TonScanner:
+    """
+    Фоновый сканер входящих транзакций TON кошелька
+
+    Листает getTransactions от последней обработанной транзакции (курсор
+    lt/hash в ton_scan_cursors), складывает входящие переводы в индекс
+    ton_incoming_messages и пачкой зачитывает их ожидающим депозитам по memo.
+    Проверка депозита по хешу из webhook - поиск в локальном индексе.
+    """
+
+    def __init__(self, service=ton_service, session_factory=AsyncSessionLocal):
+        self.service = service
+        self.session_factory = session_factory
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.last_scan_at = 0.0
+        # Позиция, с которой продолжить чтение пропуска (если не дочитали за одно сканирование)
+        self._resume: Optional[Dict[str, Any]] = None
+
+        self.scans = 0
+        self.pages = 0
+        self.indexed = 0
+        self.matched = 0
+        self.errors = 0
+
+    async def start(self):
+        """Запустить фоновое сканирование"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Остановить фоновое сканирование"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"TON scanner error: {str(e)}")
+            await asyncio.sleep(settings.ton_scan_interval)
+
+    async def refresh(self, since: Optional[float] = None) -> int:
+        """
+        Просканировать кошелек, если с момента since сканирования не было
+
+        Параллельные вызовы (пачка webhook) ждут одно общее сканирование.
+
+        Returns:
+            Количество новых проиндексированных переводов
+        """
+        since = time.monotonic() if since is None else since
+        async with self._lock:
+            if self.last_scan_at > since:
+                return 0
+            indexed = await self.scan_once()
+            self.last_scan_at = time.monotonic()
+            return indexed
+
+    async def _fetch(
+        self,
+        cursor_lt: int,
+        lt: Optional[int] = None,
+        tx_hash: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], bool, Optional[Tuple[int, str]]]:
+        """
+        Транзакции новее курсора, от новых к старым
+
+        Returns:
+            Кортеж (транзакции, дошли ли до курсора, самая старая прочитанная lt/hash)
+        """
+        page_size = settings.ton_scan_page_size
+        transactions: List[Dict[str, Any]] = []
+        oldest = (lt, tx_hash) if lt is not None else None
+
+        for _ in range(settings.ton_scan_max_pages):
+            page = await self.service.get_transactions(
+                limit=page_size, lt=lt, tx_hash=tx_hash, to_lt=cursor_lt
+            )
+            self.pages += 1
+            full_page = len(page) >= page_size
+
+            if lt is not None:
+                # Страница начинается с последней транзакции предыдущей
+                page = [tx for tx in page if int(tx["transaction_id"]["lt"]) != lt]
+
+            fresh = [tx for tx in page if int(tx["transaction_id"]["lt"]) > cursor_lt]
+            transactions.extend(fresh)
+
+            if not full_page or len(fresh) < len(page) or not fresh:
+                return transactions, True, oldest
+
+            lt = int(fresh[-1]["transaction_id"]["lt"])
+            tx_hash = fresh[-1]["transaction_id"]["hash"]
+            oldest = (lt, tx_hash)
+
+        return transactions, False, oldest
+
+    async def scan_once(self) -> int:
+        """
+        Одно сканирование: новые транзакции, индекс, сопоставление депозитов
+
+        Returns:
+            Количество новых проиндексированных переводов
+        """
+        if not self.service.wallet_address:
+            return 0
+
+        address = self.service.wallet_address
+        async with self.session_factory() as db:
+            cursor = await db.get(TonScanCursor, address)
+        cursor_lt = cursor.last_lt if cursor else 0
+
+        if self._resume is not None and self._resume["cursor_lt"] == cursor_lt:
+            # Дочитываем пропуск между курсором и уже прочитанными транзакциями
+            transactions, reached_cursor, oldest = await self._fetch(cursor_lt, *self._resume["oldest"])
+            newest = self._resume["newest"]
+        else:
+            transactions, reached_cursor, oldest = await self._fetch(cursor_lt)
+            newest = transactions[0]["transaction_id"] if transactions else None
+        self.scans += 1
+
+        rows = []
+        for tx in transactions:
+            in_msg = tx.get("in_msg") or {}
+            value = int(in_msg.get("value") or 0)
+            if not in_msg.get("source") or value <= 0:
+                continue
+            rows.append({
+                "tx_hash": tx["transaction_id"]["hash"],
+                "lt": int(tx["transaction_id"]["lt"]),
+                "utime": int(tx.get("utime", 0)),
+                "source": in_msg.get("source"),
+                "value_nanotons": value,
+                "memo": (in_msg.get("message") or "").strip()[:255] or None,
+                "success": tx.get("out_msgs") is not None,
+            })
+
+        inserted = 0
+        async with self.session_factory() as db:
+            if rows:
+                result = await db.execute(
+                    dialect_insert(TonIncomingMessage)
+                    .values(rows)
+                    .on_conflict_do_nothing(index_elements=["tx_hash"])
+                )
+                inserted = max(result.rowcount, 0)
+
+            # Курсор двигается, только если между ним и прочитанными транзакциями
+            # не осталось пропуска (при первом запуске - сразу)
+            if newest is not None and (reached_cursor or cursor is None):
+                values = {
+                    "last_lt": int(newest["lt"]),
+                    "last_hash": newest["hash"],
+                    "updated_at": datetime.utcnow(),
+                }
+                await db.execute(
+                    dialect_insert(TonScanCursor)
+                    .values(address=address, **values)
+                    .on_conflict_do_update(index_elements=["address"], set_=values)
+                )
+                self._resume = None
+            elif not reached_cursor:
+                self._resume = {"cursor_lt": cursor_lt, "oldest": oldest, "newest": newest}
+                logger.warning(
+                    f"TON scanner: more than {settings.ton_scan_max_pages} pages behind, "
+                    f"continuing from lt {oldest[0]} on next scan"
+                )
+
+            await db.commit()
+
+        self.indexed += inserted
+        await self.match_pending()
+        return inserted
+
+    async def match_pending(self) -> int:
+        """
+        Зачесть проиндексированные переводы ожидающим депозитам
+
+        Переводы с memo deposit_<user>_<сумма> сопоставляются с самыми
+        старыми незавершенными депозитами пользователя на ту же сумму
+        (депозит, уже получивший этот хеш через webhook, - в первую очередь).
+        Депозиты, отмененные по таймауту, идут после ожидающих: перевод,
+        пришедший после отмены, все равно зачисляется.
+
+        Returns:
+            Количество завершенных депозитов
+        """
+        async with self.session_factory() as db:
+            messages = (await db.scalars(
+                select(TonIncomingMessage)
+                .where(
+                    TonIncomingMessage.matched_transaction_id.is_(None),
+                    TonIncomingMessage.success.is_(True),
+                    TonIncomingMessage.memo.like("deposit_%")
+                )
+                .order_by(TonIncomingMessage.lt.desc())
+                .limit(settings.ton_match_batch)
+            )).all()
+
+            parsed = {message.id: self.service.parse_deposit_memo(message.memo) for message in messages}
+            user_ids = {memo[0] for memo in parsed.values() if memo}
+            if not user_ids:
+                return 0
+
+            rows = (await db.execute(
+                select(Transaction, User.telegram_id)
+                .join(User)
+                .where(
+                    Transaction.user_id.in_(user_ids),
+                    Transaction.type == "deposit_ton",
+                    Transaction.status.in_(PAYABLE_STATUSES)
+                )
+                .order_by(
+                    case((Transaction.status == "cancelled", 1), else_=0),
+                    Transaction.created_at,
+                    Transaction.id
+                )
+            )).all()
+
+            telegram_ids = {}
+            candidates: Dict[str, List[Transaction]] = {}
+            for transaction, telegram_id in rows:
+                telegram_ids[transaction.user_id] = telegram_id
+                memo = self.service.deposit_memo(transaction.user_id, transaction.amount)
+                candidates.setdefault(memo, []).append(transaction)
+
+            matched = 0
+            for message in sorted(messages, key=lambda item: item.lt):
+                pending = candidates.get((message.memo or "").strip(), [])
+                suitable = [
+                    transaction for transaction in pending
+                    if message_matches(message, transaction.amount, message.memo.strip())
+                ]
+                if not suitable:
+                    continue
+
+                transaction = next(
+                    (item for item in suitable if item.external_id == message.tx_hash),
+                    suitable[0]
+                )
+                if await complete_deposit(db, transaction, telegram_ids[transaction.user_id], message) is not None:
+                    pending.remove(transaction)
+                    matched += 1
+                    logger.info(f"TON deposit {transaction.id} matched to {message.tx_hash}")
+
+            await db.commit()
+
+        self.matched += matched
+        return matched
+
+    async def lookup(self, db: AsyncSession, tx_hash: str) -> Optional[TonIncomingMessage]:
+        """Перевод из локального индекса по хешу"""
+        return await db.scalar(
+            select(TonIncomingMessage).where(TonIncomingMessage.tx_hash == tx_hash)
+        )
+
+    def stats(self) -> dict:
+        """Счетчики сканирования"""
+        return {
+            "running": self._task is not None,
+            "scans": self.scans,
+            "pages": self.pages,
+            "indexed": self.indexed,
+            "matched": self.matched,
+            "errors": self.errors,
+        }
+
+
+# Создаем глобальный экземпляр сканера
+ton_scanner = TonScanner()
@@ -0,0 +1,97 @@
+"""
+crazygift-worker - отдельный процесс фоновых задач
+
+    crazygift-worker [--concurrency N] [--notifications] [--ton-scanner] [--reaper]
+
+Выполняет очередь задач (обработка платежей) независимо от воркеров API:
+в API при этом ставится JOBS_RUNNER=false. Несколько таких процессов
+могут работать одновременно. SIGTERM/SIGINT - плавная остановка:
+новые задачи не захватываются, текущие дорабатывают graceful_timeout секунд.
+
+Запуск из папки backend: ./crazygift-worker или python -m app.worker
+"""
+
+import argparse
+import asyncio
+import signal
+import sys
+
+from .config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+async def serve(concurrency: int, notifications: bool, scanner: bool, reaper: bool):
+    """Выполнять задачи до сигнала остановки"""
+    from .cache import cache
+    from .database import engine, close_db
+    from .jobs import HANDLERS, job_runner
+    from .notifications import notification_dispatcher
+    from .payments.telegram import telegram_service
+    from .payments.ton import ton_service
+    from .reaper import transaction_reaper
+    from .schema import check_schema
+    from .ton_scanner import ton_scanner
+    from .api import payments  # noqa: F401 - регистрирует обработчики задач
+
+    await check_schema(engine)
+    await cache.start()
+    await telegram_service.start()
+    await ton_service.start()
+
+    job_runner.concurrency = concurrency
+    await job_runner.start()
+    if notifications:
+        await notification_dispatcher.start()
+    if scanner and settings.ton_wallet_address:
+        await ton_scanner.start()
+    if reaper:
+        await transaction_reaper.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+
+    print(f"✅ Worker started: {concurrency} slots, jobs: {', '.join(sorted(HANDLERS))}")
+    await stop.wait()
+
+    print(f"🔄 Stopping worker, waiting for {job_runner.stats()['active']} running jobs...")
+    try:
+        await job_runner.close(timeout=settings.graceful_timeout)
+        await transaction_reaper.close()
+        await ton_scanner.close()
+        await notification_dispatcher.close()
+    finally:
+        await telegram_service.close()
+        await ton_service.close()
+        await cache.close()
+        await close_db()
+    print(f"✅ Worker stopped: {job_runner.stats()}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="crazygift-worker", description="CrazyGift background job worker")
+    parser.add_argument("--concurrency", type=int, default=settings.jobs_concurrency, help="jobs running at once")
+    parser.add_argument("--notifications", action="store_true", help="also send the Telegram notification queue")
+    parser.add_argument("--ton-scanner", action="store_true", help="also scan incoming TON transfers")
+    parser.add_argument("--reaper", action="store_true", help="also expire stale deposits")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO if settings.debug else logging.WARNING,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+
+    try:
+        asyncio.run(serve(args.concurrency, args.notifications, args.ton_scanner, args.reaper))
+    except Exception as e:
+        print(f"❌ Worker failed: {e}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""initial schema
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-17 01:00:22.011527
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Базы, созданные через create_all до появления миграций, уже содержат эту схему
+    if "users" in sa.inspect(op.get_bind()).get_table_names():
+        return
+
+    op.create_table('cases',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=255), nullable=False),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.Column('price_stars', sa.Integer(), nullable=False),
+    sa.Column('items', sa.Text(), nullable=False),
+    sa.Column('active', sa.Boolean(), nullable=False),
+    sa.Column('image_url', sa.String(length=500), nullable=True),
+    sa.Column('category', sa.String(length=100), nullable=True),
+    sa.Column('total_opened', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('cases', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_cases_active'), ['active'], unique=False)
+        batch_op.create_index(batch_op.f('ix_cases_category'), ['category'], unique=False)
+        batch_op.create_index(batch_op.f('ix_cases_id'), ['id'], unique=False)
+
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('telegram_id', sa.Integer(), nullable=False),
+    sa.Column('username', sa.String(length=255), nullable=True),
+    sa.Column('first_name', sa.String(length=255), nullable=True),
+    sa.Column('last_name', sa.String(length=255), nullable=True),
+    sa.Column('balance_stars', sa.Integer(), nullable=False),
+    sa.Column('balance_ton', sa.DECIMAL(precision=18, scale=9), nullable=False),
+    sa.Column('referral_code', sa.String(length=20), nullable=True),
+    sa.Column('referred_by', sa.Integer(), nullable=True),
+    sa.Column('total_cases_opened', sa.Integer(), nullable=True),
+    sa.Column('total_spent_stars', sa.Integer(), nullable=True),
+    sa.Column('total_earned_stars', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.Column('last_active', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+    sa.ForeignKeyConstraint(['referred_by'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.create_index('idx_user_telegram_id', ['telegram_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_users_id'), ['id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_users_referral_code'), ['referral_code'], unique=True)
+        batch_op.create_index(batch_op.f('ix_users_telegram_id'), ['telegram_id'], unique=True)
+
+    op.create_table('inventory',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('item_name', sa.String(length=255), nullable=False),
+    sa.Column('item_value', sa.DECIMAL(precision=10, scale=2), nullable=False),
+    sa.Column('item_stars', sa.Integer(), nullable=False),
+    sa.Column('rarity', sa.String(length=50), nullable=False),
+    sa.Column('image_url', sa.String(length=500), nullable=True),
+    sa.Column('case_name', sa.String(length=255), nullable=True),
+    sa.Column('case_id', sa.Integer(), nullable=True),
+    sa.Column('is_withdrawn', sa.Boolean(), nullable=False),
+    sa.Column('is_upgraded', sa.Boolean(), nullable=False),
+    sa.Column('withdrawal_requested_at', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=False),
+    sa.ForeignKeyConstraint(['case_id'], ['cases.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('inventory', schema=None) as batch_op:
+        batch_op.create_index('idx_inventory_user_rarity', ['user_id', 'rarity'], unique=False)
+        batch_op.create_index(batch_op.f('ix_inventory_id'), ['id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_inventory_rarity'), ['rarity'], unique=False)
+        batch_op.create_index(batch_op.f('ix_inventory_user_id'), ['user_id'], unique=False)
+
+    op.create_table('transactions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('type', sa.String(length=50), nullable=False),
+    sa.Column('amount', sa.DECIMAL(precision=18, scale=9), nullable=False),
+    sa.Column('currency', sa.String(length=10), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('external_id', sa.String(length=255), nullable=True),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.Column('extra_data', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=False),
+    sa.Column('completed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('transactions', schema=None) as batch_op:
+        batch_op.create_index('idx_transaction_status_created', ['status', 'created_at'], unique=False)
+        batch_op.create_index('idx_transaction_user_type', ['user_id', 'type'], unique=False)
+        batch_op.create_index(batch_op.f('ix_transactions_external_id'), ['external_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_transactions_id'), ['id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_transactions_status'), ['status'], unique=False)
+        batch_op.create_index(batch_op.f('ix_transactions_type'), ['type'], unique=False)
+        batch_op.create_index(batch_op.f('ix_transactions_user_id'), ['user_id'], unique=False)
+
+    op.create_table('referral_transactions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('referrer_id', sa.Integer(), nullable=False),
+    sa.Column('referred_id', sa.Integer(), nullable=False),
+    sa.Column('transaction_id', sa.Integer(), nullable=False),
+    sa.Column('commission_amount', sa.Integer(), nullable=False),
+    sa.Column('commission_rate', sa.DECIMAL(precision=5, scale=4), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=False),
+    sa.Column('paid_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['referred_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['referrer_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['transaction_id'], ['transactions.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('referral_transactions', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_referral_transactions_id'), ['id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_referral_transactions_referred_id'), ['referred_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_referral_transactions_referrer_id'), ['referrer_id'], unique=False)
+
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('referral_transactions', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_referral_transactions_referrer_id'))
+        batch_op.drop_index(batch_op.f('ix_referral_transactions_referred_id'))
+        batch_op.drop_index(batch_op.f('ix_referral_transactions_id'))
+
+    op.drop_table('referral_transactions')
+    with op.batch_alter_table('transactions', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_transactions_user_id'))
+        batch_op.drop_index(batch_op.f('ix_transactions_type'))
+        batch_op.drop_index(batch_op.f('ix_transactions_status'))
+        batch_op.drop_index(batch_op.f('ix_transactions_id'))
+        batch_op.drop_index(batch_op.f('ix_transactions_external_id'))
+        batch_op.drop_index('idx_transaction_user_type')
+        batch_op.drop_index('idx_transaction_status_created')
+
+    op.drop_table('transactions')
+    with op.batch_alter_table('inventory', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_inventory_user_id'))
+        batch_op.drop_index(batch_op.f('ix_inventory_rarity'))
+        batch_op.drop_index(batch_op.f('ix_inventory_id'))
+        batch_op.drop_index('idx_inventory_user_rarity')
+
+    op.drop_table('inventory')
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_users_telegram_id'))
+        batch_op.drop_index(batch_op.f('ix_users_referral_code'))
+        batch_op.drop_index(batch_op.f('ix_users_id'))
+        batch_op.drop_index('idx_user_telegram_id')
+
+    op.drop_table('users')
+    with op.batch_alter_table('cases', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_cases_id'))
+        batch_op.drop_index(batch_op.f('ix_cases_category'))
+        batch_op.drop_index(batch_op.f('ix_cases_active'))
+
+    op.drop_table('cases')
@@ -0,0 +1,107 @@
+"""case items table
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 01:10:00.000000
+
+"""
+import json
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+cases_table = sa.table(
+    'cases',
+    sa.column('id', sa.Integer),
+    sa.column('items', sa.Text),
+)
+
+case_items_table = sa.table(
+    'case_items',
+    sa.column('case_id', sa.Integer),
+    sa.column('item_id', sa.Integer),
+    sa.column('name', sa.String),
+    sa.column('value', sa.DECIMAL(10, 2)),
+    sa.column('stars', sa.Integer),
+    sa.column('rarity', sa.String),
+    sa.column('image_url', sa.String),
+    sa.column('weight', sa.Integer),
+    sa.column('position', sa.Integer),
+)
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+
+    # Таблица могла быть создана через create_all при старте приложения
+    if 'case_items' not in sa.inspect(bind).get_table_names():
+        op.create_table('case_items',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('case_id', sa.Integer(), nullable=False),
+        sa.Column('item_id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=255), nullable=False),
+        sa.Column('value', sa.DECIMAL(precision=10, scale=2), nullable=False),
+        sa.Column('stars', sa.Integer(), nullable=False),
+        sa.Column('rarity', sa.String(length=50), nullable=False),
+        sa.Column('image_url', sa.String(length=500), nullable=True),
+        sa.Column('weight', sa.Integer(), nullable=False),
+        sa.Column('position', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['case_id'], ['cases.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+        )
+        with op.batch_alter_table('case_items', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_case_items_id'), ['id'], unique=False)
+            batch_op.create_index('idx_case_items_case_position', ['case_id', 'position'], unique=False)
+            batch_op.create_index('idx_case_items_rarity_case', ['rarity', 'case_id'], unique=False)
+
+    # Переносим предметы из JSON для кейсов, у которых еще нет строк в case_items
+    filled = {
+        row.case_id
+        for row in bind.execute(sa.select(case_items_table.c.case_id).distinct())
+    }
+
+    rows = []
+    for case in bind.execute(sa.select(cases_table.c.id, cases_table.c['items'].label('items'))):
+        if case.id in filled:
+            continue
+
+        try:
+            items = json.loads(case.items or "[]")
+        except json.JSONDecodeError:
+            print(f"⚠️  Case {case.id}: invalid items JSON, skipped")
+            continue
+
+        for position, item in enumerate(items):
+            weight = item.get('weight', 1)
+            rows.append({
+                'case_id': case.id,
+                'item_id': item.get('id', position + 1),
+                'name': item['name'],
+                'value': item.get('value', 0),
+                'stars': item.get('stars', 0),
+                'rarity': item.get('rarity', 'common'),
+                'image_url': item.get('image'),
+                'weight': weight if weight > 0 else 1,
+                'position': position,
+            })
+
+    if rows:
+        op.bulk_insert(case_items_table, rows)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('case_items', schema=None) as batch_op:
+        batch_op.drop_index('idx_case_items_rarity_case')
+        batch_op.drop_index('idx_case_items_case_position')
+        batch_op.drop_index(batch_op.f('ix_case_items_id'))
+
+    op.drop_table('case_items')
@@ -0,0 +1,61 @@
+"""ton deposit scanner cursor and incoming message index
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 02:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    tables = sa.inspect(op.get_bind()).get_table_names()
+
+    if 'ton_scan_cursors' not in tables:
+        op.create_table('ton_scan_cursors',
+        sa.Column('address', sa.String(length=100), nullable=False),
+        sa.Column('last_lt', sa.BigInteger(), nullable=False),
+        sa.Column('last_hash', sa.String(length=100), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('address')
+        )
+
+    if 'ton_incoming_messages' not in tables:
+        op.create_table('ton_incoming_messages',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('tx_hash', sa.String(length=100), nullable=False),
+        sa.Column('lt', sa.BigInteger(), nullable=False),
+        sa.Column('utime', sa.Integer(), nullable=False),
+        sa.Column('source', sa.String(length=100), nullable=True),
+        sa.Column('value_nanotons', sa.BigInteger(), nullable=False),
+        sa.Column('memo', sa.String(length=255), nullable=True),
+        sa.Column('success', sa.Boolean(), nullable=False),
+        sa.Column('matched_transaction_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['matched_transaction_id'], ['transactions.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('matched_transaction_id'),
+        sa.UniqueConstraint('tx_hash')
+        )
+        with op.batch_alter_table('ton_incoming_messages', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_ton_incoming_messages_id'), ['id'], unique=False)
+            batch_op.create_index('idx_ton_incoming_memo', ['memo'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('ton_incoming_messages', schema=None) as batch_op:
+        batch_op.drop_index('idx_ton_incoming_memo')
+        batch_op.drop_index(batch_op.f('ix_ton_incoming_messages_id'))
+
+    op.drop_table('ton_incoming_messages')
+    op.drop_table('ton_scan_cursors')
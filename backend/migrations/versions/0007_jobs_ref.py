@@ -0,0 +1,34 @@
+"""job reference to the object it processes
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 04:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('jobs')}
+    if 'ref' in columns:
+        return
+
+    with op.batch_alter_table('jobs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('ref', sa.String(length=64), nullable=True))
+        batch_op.create_index('idx_jobs_ref', ['ref'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('jobs', schema=None) as batch_op:
+        batch_op.drop_index('idx_jobs_ref')
+        batch_op.drop_column('ref')
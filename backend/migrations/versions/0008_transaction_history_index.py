@@ -0,0 +1,35 @@
+"""keyset pagination index for user transaction history
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17 04:50:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    indexes = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('transactions')}
+    if 'idx_transaction_user_created' in indexes:
+        return
+
+    op.create_index(
+        'idx_transaction_user_created',
+        'transactions',
+        ['user_id', sa.text('created_at DESC'), sa.text('id DESC')],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('idx_transaction_user_created', table_name='transactions')
@@ -0,0 +1,35 @@
+"""keyset pagination index for inventory listing
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17 05:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0009'
+down_revision: Union[str, None] = '0008'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    indexes = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('inventory')}
+    if 'idx_inventory_user_listing' in indexes:
+        return
+
+    op.create_index(
+        'idx_inventory_user_listing',
+        'inventory',
+        ['user_id', 'is_withdrawn', sa.text('created_at DESC'), sa.text('id DESC')],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('idx_inventory_user_listing', table_name='inventory')
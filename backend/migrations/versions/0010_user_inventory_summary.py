@@ -0,0 +1,79 @@
+"""per-user inventory summary maintained on write
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-17 05:50:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0010'
+down_revision: Union[str, None] = '0009'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if 'user_inventory_summary' in sa.inspect(op.get_bind()).get_table_names():
+        return
+
+    op.create_table('user_inventory_summary',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('rarity', sa.String(length=50), nullable=False),
+    sa.Column('items', sa.Integer(), nullable=False),
+    sa.Column('items_value', sa.DECIMAL(precision=18, scale=2), nullable=False),
+    sa.Column('items_stars', sa.BigInteger(), nullable=False),
+    sa.Column('withdrawn_items', sa.Integer(), nullable=False),
+    sa.Column('withdrawn_value', sa.DECIMAL(precision=18, scale=2), nullable=False),
+    sa.Column('withdrawn_stars', sa.BigInteger(), nullable=False),
+    sa.Column('best_item_id', sa.Integer(), nullable=True),
+    sa.Column('best_item_name', sa.String(length=255), nullable=True),
+    sa.Column('best_item_value', sa.DECIMAL(precision=10, scale=2), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'rarity')
+    )
+
+    # Сводка по уже существующему инвентарю
+    op.execute("""
+        INSERT INTO user_inventory_summary (
+            user_id, rarity, items, items_value, items_stars,
+            withdrawn_items, withdrawn_value, withdrawn_stars, updated_at
+        )
+        SELECT
+            user_id, rarity,
+            SUM(CASE WHEN is_withdrawn THEN 0 ELSE 1 END),
+            COALESCE(SUM(CASE WHEN is_withdrawn THEN 0 ELSE item_value END), 0),
+            COALESCE(SUM(CASE WHEN is_withdrawn THEN 0 ELSE item_stars END), 0),
+            SUM(CASE WHEN is_withdrawn THEN 1 ELSE 0 END),
+            COALESCE(SUM(CASE WHEN is_withdrawn THEN item_value ELSE 0 END), 0),
+            COALESCE(SUM(CASE WHEN is_withdrawn THEN item_stars ELSE 0 END), 0),
+            CURRENT_TIMESTAMP
+        FROM inventory
+        GROUP BY user_id, rarity
+    """)
+    op.execute("""
+        UPDATE user_inventory_summary SET best_item_id = (
+            SELECT id FROM inventory
+            WHERE inventory.user_id = user_inventory_summary.user_id
+              AND inventory.rarity = user_inventory_summary.rarity
+              AND NOT inventory.is_withdrawn
+            ORDER BY item_value DESC, id
+            LIMIT 1
+        )
+    """)
+    op.execute("""
+        UPDATE user_inventory_summary SET
+            best_item_name = (SELECT item_name FROM inventory WHERE inventory.id = best_item_id),
+            best_item_value = (SELECT item_value FROM inventory WHERE inventory.id = best_item_id)
+        WHERE best_item_id IS NOT NULL
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('user_inventory_summary')
@@ -0,0 +1,44 @@
+"""sharded global counters for public stats
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-17 06:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0011'
+down_revision: Union[str, None] = '0010'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if 'global_counters' in sa.inspect(op.get_bind()).get_table_names():
+        return
+
+    op.create_table('global_counters',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('shard', sa.Integer(), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name', 'shard')
+    )
+
+    # Начальные значения - в шард 0
+    op.execute("""
+        INSERT INTO global_counters (name, shard, value)
+        SELECT 'users', 0, COUNT(id) FROM users
+    """)
+    op.execute("""
+        INSERT INTO global_counters (name, shard, value)
+        SELECT 'cases_opened', 0, COALESCE(SUM(total_cases_opened), 0) FROM users
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('global_counters')
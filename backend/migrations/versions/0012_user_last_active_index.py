@@ -0,0 +1,30 @@
+"""index for online users count by last_active
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-17 09:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0012'
+down_revision: Union[str, None] = '0011'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    indexes = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('users')}
+    if 'idx_user_last_active' in indexes:
+        return
+
+    op.create_index('idx_user_last_active', 'users', ['last_active'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('idx_user_last_active', table_name='users')
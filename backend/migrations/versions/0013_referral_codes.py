@@ -0,0 +1,93 @@
+"""referral codes from user id and aliases for legacy codes
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2026-10-17 09:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0013'
+down_revision: Union[str, None] = '0012'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 5000
+
+# Копия схемы кодов из app.auth на момент миграции
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+PREFIX = "CGR"
+
+
+def referral_code(user_id: int) -> str:
+    digits = []
+    value = user_id
+    while value > 0:
+        value -= 1
+        digits.append(ALPHABET[value % 32])
+        value //= 32
+    body = "".join(reversed(digits))
+
+    total = 0
+    factor = 2
+    for symbol in reversed(body):
+        addend = factor * ALPHABET.index(symbol)
+        total += addend // 32 + addend % 32
+        factor = 1 if factor == 2 else 2
+    return f"{PREFIX}{body}{ALPHABET[(32 - total % 32) % 32]}"
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if 'referral_code_aliases' in sa.inspect(bind).get_table_names():
+        return
+
+    op.create_table('referral_code_aliases',
+    sa.Column('code', sa.String(length=20), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('code')
+    )
+
+    # Старые коды остаются рабочими через алиасы, пользователи получают коды из ID.
+    # Новые коды (CGR...) не совпадают со старыми (CG и цифры), поэтому
+    # уникальный индекс не мешает обновлять пачками.
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.text("SELECT id, referral_code FROM users WHERE id > :last_id ORDER BY id LIMIT :limit"),
+            {"last_id": last_id, "limit": BATCH_SIZE}
+        ).all()
+        if not rows:
+            break
+
+        aliases = [
+            {"code": code, "user_id": user_id}
+            for user_id, code in rows
+            if code and code != referral_code(user_id)
+        ]
+        if aliases:
+            bind.execute(
+                sa.text("INSERT INTO referral_code_aliases (code, user_id) VALUES (:code, :user_id)"),
+                aliases
+            )
+        bind.execute(
+            sa.text("UPDATE users SET referral_code = :code WHERE id = :user_id"),
+            [{"code": referral_code(user_id), "user_id": user_id} for user_id, _ in rows]
+        )
+        last_id = rows[-1][0]
+
+
+def downgrade() -> None:
+    op.execute("""
+        UPDATE users SET referral_code = (
+            SELECT code FROM referral_code_aliases WHERE referral_code_aliases.user_id = users.id
+        )
+        WHERE id IN (SELECT user_id FROM referral_code_aliases)
+    """)
+    op.drop_table('referral_code_aliases')
@@ -0,0 +1,60 @@
+"""per-referrer referral stats and referral listing index
+
+Revision ID: 0014
+Revises: 0013
+Create Date: 2026-10-17 10:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0014'
+down_revision: Union[str, None] = '0013'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+
+    if 'idx_user_referred_created' not in {index['name'] for index in inspector.get_indexes('users')}:
+        op.create_index(
+            'idx_user_referred_created',
+            'users',
+            ['referred_by', sa.text('created_at DESC'), sa.text('id DESC')],
+            unique=False
+        )
+
+    if 'referral_stats' in inspector.get_table_names():
+        return
+
+    op.create_table('referral_stats',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('referrals', sa.Integer(), nullable=False),
+    sa.Column('active_referrals', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+    # Итоги по уже существующим рефералам
+    op.execute("""
+        INSERT INTO referral_stats (user_id, referrals, active_referrals, updated_at)
+        SELECT
+            referred_by,
+            COUNT(*),
+            SUM(CASE WHEN total_cases_opened > 0 THEN 1 ELSE 0 END),
+            CURRENT_TIMESTAMP
+        FROM users
+        WHERE referred_by IS NOT NULL
+        GROUP BY referred_by
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('referral_stats')
+    op.drop_index('idx_user_referred_created', table_name='users')
@@ -3,8 +3,6 @@
 Скрипт для запуска CrazyGift API сервера
 """
 
-import uvicorn
-import asyncio
 import sys
 from pathlib import Path
 
@@ -12,36 +10,29 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent))
 
 from app.config import settings
+from app.server import run, worker_count, event_loop_name
 
 
-async def main():
+def main():
     """Основная функция запуска"""
     print("🚀 Starting CrazyGift API Server...")
     print(f"📊 Debug mode: {settings.debug}")
     print(f"🗄️  Database: {settings.database_url.split('://')[0]}")
     print(f"📱 Telegram Bot: {'✅ Configured' if settings.telegram_bot_token else '❌ Not configured'}")
     print(f"💰 TON Wallet: {'✅ Configured' if settings.ton_wallet_address else '❌ Not configured'}")
+    if not settings.debug:
+        print(f"⚙️  Workers: {worker_count()}, loop: {event_loop_name()}")
     print("-" * 50)
     
-    # Запускаем сервер
-    config = uvicorn.Config(
-        "app.main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=settings.debug,
-        log_level="info" if settings.debug else "warning",
-        reload_dirs=["app"] if settings.debug else None,
-    )
-    
-    server = uvicorn.Server(config)
-    await server.serve()
+    # Запускаем сервер (debug - reload, иначе pre-fork воркеры)
+    run()
 
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        main()
     except KeyboardInterrupt:
         print("\n🛑 Server stopped by user")
     except Exception as e:
         print(f"❌ Server failed to start: {e}")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
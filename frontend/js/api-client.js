@@ -39,6 +39,12 @@ class APIClient {
      */
     async authenticateUser() {
         try {
+            // Сессия из прошлого открытия страницы - без повторной проверки initData
+            const restored = await this.restoreSession();
+            if (restored) {
+                return restored;
+            }
+
             let authData;
             
             // Попытка получить реальные данные из Telegram WebApp
@@ -61,7 +67,13 @@ class APIClient {
                 throw new Error(`Auth failed: ${response.status}`);
             }
 
-            const userData = await response.json();
+            const authResult = await response.json();
+            const userData = authResult.user || authResult;
+
+            if (authResult.access_token) {
+                this.authToken = authResult.access_token;
+                sessionStorage.setItem('crazygift_session', authResult.access_token);
+            }
             
             this.authenticated = true;
             this.userId = userData.id;
@@ -77,6 +89,43 @@ class APIClient {
         }
     }
 
+    /**
+     * Восстановление сессии по сохраненному токену (GET /users/me)
+     * Возвращает пользователя или null, если токена нет или он истек
+     */
+    async restoreSession() {
+        const token = sessionStorage.getItem('crazygift_session');
+        if (!token) {
+            return null;
+        }
+
+        try {
+            const response = await fetch(`${this.baseURL}/users/me`, {
+                headers: {
+                    'Authorization': `Bearer ${token}`,
+                }
+            });
+
+            if (!response.ok) {
+                sessionStorage.removeItem('crazygift_session');
+                return null;
+            }
+
+            const userData = await response.json();
+
+            this.authToken = token;
+            this.authenticated = true;
+            this.userId = userData.id;
+            window.GameState.setUser(userData);
+
+            return userData;
+
+        } catch (error) {
+            console.error('Restore session error:', error);
+            return null;
+        }
+    }
+
     /**
      * Получение списка доступных кейсов
      */
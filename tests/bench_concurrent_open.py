@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк параллельного открытия кейсов одним пользователем
+
+Приложение запускается в процессе на временной SQLite базе. Баланс
+пользователя рассчитан ровно на AFFORDABLE открытий, а запросов
+отправляется CONCURRENCY одновременно: успешных открытий должно быть
+ровно AFFORDABLE, итоговый баланс - 0, и ни одного ухода в минус.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+DB_PATH = Path(tempfile.gettempdir()) / "crazygift_bench_open.db"
+
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{DB_PATH}")
+os.environ.setdefault("DEBUG", "false")
+os.environ.setdefault("TESTING", "1")
+
+# Добавляем путь к backend
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+import httpx
+
+# Конфигурация
+CONCURRENCY = 200
+AFFORDABLE = 50
+CASE_ID = 1
+
+
+async def prepare():
+    """Создает схему, тестовые кейсы и пользователя с балансом"""
+    from app.database import init_db, AsyncSessionLocal
+    from app.fixtures import load_test_data
+    from app.models import User, Case
+    from sqlalchemy import select
+
+    await init_db()
+    await load_test_data()
+
+    async with AsyncSessionLocal() as db:
+        price = await db.scalar(select(Case.price_stars).where(Case.id == CASE_ID))
+
+        user = User(
+            telegram_id=int(time.time()),
+            username="bench_user",
+            balance_stars=price * AFFORDABLE
+        )
+        db.add(user)
+        await db.commit()
+
+        return user.id, price
+
+
+async def open_case(client, user_id):
+    response = await client.post(
+        f"/api/cases/{CASE_ID}/open",
+        json={"user_id": user_id}
+    )
+    return response.status_code, response.json()
+
+
+async def main():
+    print("=" * 50)
+    print("BENCHMARK: CONCURRENT CASE OPENING")
+    print("=" * 50)
+
+    if DB_PATH.exists():
+        DB_PATH.unlink()
+
+    user_id, price = await prepare()
+    print(f"User {user_id}: balance {price * AFFORDABLE} stars ({AFFORDABLE} opens x {price})")
+
+    from app.main import app
+    from app.database import AsyncSessionLocal, close_db
+    from app.models import User, InventoryItem
+    from sqlalchemy import select, func
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(open_case(client, user_id) for _ in range(CONCURRENCY))
+        )
+        elapsed = time.perf_counter() - start
+
+    succeeded = sum(1 for code, body in results if code == 200 and body["success"])
+    rejected = sum(1 for code, body in results if code == 200 and not body["success"])
+    errors = sum(1 for code, _ in results if code != 200)
+    min_reported = min(body["new_balance"] for code, body in results if code == 200)
+
+    async with AsyncSessionLocal() as db:
+        final_balance = await db.scalar(
+            select(User.balance_stars).where(User.id == user_id)
+        )
+        items_count = await db.scalar(
+            select(func.count(InventoryItem.id)).where(InventoryItem.user_id == user_id)
+        )
+
+    await close_db()
+
+    print(f"Requests:        {CONCURRENCY}")
+    print(f"Succeeded:       {succeeded}")
+    print(f"Rejected:        {rejected}")
+    print(f"Errors:          {errors}")
+    print(f"Final balance:   {final_balance}")
+    print(f"Min new_balance: {min_reported}")
+    print(f"Items created:   {items_count}")
+    print(f"Elapsed:         {elapsed:.3f}s ({CONCURRENCY / elapsed:.1f} req/s)")
+
+    ok = (
+        succeeded == AFFORDABLE
+        and items_count == AFFORDABLE
+        and final_balance == 0
+        and min_reported >= 0
+        and errors == 0
+    )
+
+    print("\nSUCCESS: balance is consistent" if ok else "\nFAILED: balance is inconsistent")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
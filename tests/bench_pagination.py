@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пагинации: LIMIT/OFFSET + count(*) против keyset курсора
+
+Один пользователь с большой историей операций. Для страниц на разной
+глубине измеряется медианная латентность запроса страницы старым способом
+(offset и точное total) и по курсору. Курсор для глубокой страницы берется
+из строки, которой заканчивается предыдущая страница.
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+DB_PATH = Path(tempfile.gettempdir()) / "crazygift_bench_pagination.db"
+for suffix in ("", "-wal", "-shm"):
+    Path(f"{DB_PATH}{suffix}").unlink(missing_ok=True)
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("DEBUG", "false")
+
+# Добавляем путь к backend
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+# Конфигурация
+ROWS = 100_000
+OTHER_USERS = 20
+PAGE_SIZE = 50
+PAGES = [1, 100, 1000, ROWS // PAGE_SIZE]
+REPEATS = 20
+
+import httpx
+from sqlalchemy import insert, select
+
+from app.database import AsyncSessionLocal, init_db, close_db
+from app.main import app
+from app.models import Transaction, User
+from app.pagination import encode_cursor
+
+
+async def prepare():
+    """Пользователь с ROWS транзакциями среди транзакций других пользователей"""
+    await init_db()
+    start = datetime(2025, 1, 1)
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(User), [
+            {"telegram_id": 700000 + i, "username": f"bench_page_{i}", "balance_stars": 0}
+            for i in range(OTHER_USERS + 1)
+        ])
+        user_ids = list((await db.scalars(select(User.id).order_by(User.id))).all())
+
+        for chunk in range(0, ROWS * 2, 20_000):
+            await db.execute(insert(Transaction), [
+                {
+                    # Половина строк - целевого пользователя, остальные - других
+                    "user_id": user_ids[0] if index % 2 else user_ids[1 + index % OTHER_USERS],
+                    "type": "case_purchase", "amount": 100, "currency": "STARS", "status": "completed",
+                    "created_at": start + timedelta(seconds=index // 3),
+                }
+                for index in range(chunk, chunk + 20_000)
+            ])
+        await db.commit()
+
+        # Курсоры: последняя строка страницы перед нужной
+        rows = (await db.execute(
+            select(Transaction.created_at, Transaction.id)
+            .where(Transaction.user_id == user_ids[0])
+            .order_by(Transaction.created_at.desc(), Transaction.id.desc())
+        )).all()
+
+    cursors = {page: encode_cursor(*rows[(page - 1) * PAGE_SIZE - 1]) if page > 1 else None for page in PAGES}
+    return user_ids[0], cursors
+
+
+async def measure(client, url, params):
+    latencies = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        response = await client.get(url, params=params)
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200 and len(response.json()["transactions"]) == PAGE_SIZE
+    return statistics.median(latencies)
+
+
+async def main():
+    print("=" * 50)
+    print("BENCHMARK: HISTORY PAGINATION (OFFSET VS CURSOR)")
+    print("=" * 50)
+
+    start = time.perf_counter()
+    user_id, cursors = await prepare()
+    print(f"Prepared {ROWS} rows for one user ({ROWS * 2} total) in {time.perf_counter() - start:.1f}s\n")
+
+    url = f"/api/users/{user_id}/history"
+    transport = httpx.ASGITransport(app=app)
+
+    print(f"{'page':>8}{'offset+count, ms':>20}{'cursor, ms':>14}")
+    results = []
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for page in PAGES:
+                offset_ms = await measure(client, url, {
+                    "limit": PAGE_SIZE, "offset": (page - 1) * PAGE_SIZE, "include_total": "true"
+                })
+                cursor_ms = await measure(client, url, {
+                    "limit": PAGE_SIZE, **({"cursor": cursors[page]} if cursors[page] else {})
+                })
+                results.append((page, offset_ms, cursor_ms))
+                print(f"{page:>8}{offset_ms:>20.1f}{cursor_ms:>14.1f}")
+    finally:
+        await close_db()
+
+    first, last = results[0][2], results[-1][2]
+    print(f"\nCursor latency, last page vs first: {last / first:.2f}x")
+    print("SUCCESS: benchmark completed")
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк рефералов на сгенерированном графе из 1M пользователей
+
+Граф: 10 крупных партнеров с десятками тысяч прямых рефералов, остальные
+приглашения - случайному более раннему пользователю (дерево в несколько
+уровней), часть пользователей без реферера. Измеряется медианная
+латентность старого способа (все рефералы в память и подсчет в Python,
+count(*) для статистики) против итогов referral_stats и страницы по
+курсору, и дерево рефералов рекурсивным запросом на разной глубине.
+"""
+
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+DB_PATH = Path(tempfile.gettempdir()) / "crazygift_bench_referrals.db"
+for suffix in ("", "-wal", "-shm"):
+    Path(f"{DB_PATH}{suffix}").unlink(missing_ok=True)
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("DEBUG", "false")
+
+# Добавляем путь к backend
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+# Конфигурация
+USERS = int(os.environ.get("BENCH_USERS", 1_000_000))
+PARTNERS = 10
+PAGE_SIZE = 50
+DEPTHS = [1, 2, 3, 5]
+REPEATS = 10
+CHUNK = 50_000
+
+from sqlalchemy import func, insert, select
+
+from app.database import AsyncSessionLocal, init_db, close_db
+from app.models import User
+from app.referrals import referral_rollup, referral_tree
+
+
+def generate_users():
+    """Пользователи графа по порядку id (реферер всегда зарегистрирован раньше)"""
+    rnd = random.Random(42)
+    start = datetime(2025, 1, 1)
+    for user_id in range(1, USERS + 1):
+        roll = rnd.random()
+        if user_id <= PARTNERS or roll < 0.3:
+            referred_by = None
+        elif roll < 0.5:
+            referred_by = rnd.randint(1, PARTNERS)
+        else:
+            referred_by = rnd.randint(1, user_id - 1)
+        yield {
+            "id": user_id,
+            "telegram_id": 10_000_000 + user_id,
+            "referred_by": referred_by,
+            "balance_stars": 0,
+            "total_cases_opened": 0 if rnd.random() < 0.6 else rnd.randint(1, 20),
+            "created_at": start + timedelta(seconds=user_id * 3),
+        }
+
+
+async def prepare():
+    """Граф пользователей и итоги по рефералам"""
+    await init_db()
+
+    async with AsyncSessionLocal() as db:
+        batch = []
+        for row in generate_users():
+            batch.append(row)
+            if len(batch) == CHUNK:
+                await db.execute(insert(User.__table__), batch)
+                batch = []
+        if batch:
+            await db.execute(insert(User.__table__), batch)
+        await db.commit()
+
+    start = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        rows = await referral_rollup.rebuild(db)
+        await db.commit()
+    rebuild_s = time.perf_counter() - start
+
+    async with AsyncSessionLocal() as db:
+        partner, partner_referrals = (await db.execute(
+            select(User.referred_by, func.count(User.id))
+            .where(User.referred_by.is_not(None))
+            .group_by(User.referred_by)
+            .order_by(func.count(User.id).desc())
+            .limit(1)
+        )).first()
+    return partner, partner_referrals, rows, rebuild_s
+
+
+async def old_listing(db, user_id):
+    """Как раньше: все рефералы в память, активные считаются в Python, count(*) для статистики"""
+    referrals = (await db.execute(
+        select(User.id, User.first_name, User.username, User.created_at, User.total_cases_opened, User.last_active)
+        .where(User.referred_by == user_id)
+        .order_by(User.created_at.desc())
+    )).all()
+    active = sum(1 for ref in referrals if ref.total_cases_opened > 0)
+    count = await db.scalar(select(func.count(User.id)).where(User.referred_by == user_id))
+    return len(referrals), active, count
+
+
+async def new_listing(db, user_id):
+    """Итоги из referral_stats и одна страница по индексу (referred_by, created_at, id)"""
+    stats = await referral_rollup.get(db, user_id)
+    page = (await db.execute(
+        select(User.id, User.first_name, User.username, User.created_at, User.total_cases_opened, User.last_active)
+        .where(User.referred_by == user_id)
+        .order_by(User.created_at.desc(), User.id.desc())
+        .limit(PAGE_SIZE + 1)
+    )).all()
+    return stats, page
+
+
+async def measure(func, *args):
+    latencies = []
+    result = None
+    for _ in range(REPEATS):
+        async with AsyncSessionLocal() as db:
+            start = time.perf_counter()
+            result = await func(db, *args)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.median(latencies), result
+
+
+async def main():
+    print("=" * 50)
+    print("BENCHMARK: REFERRALS ON A GENERATED GRAPH")
+    print("=" * 50)
+
+    start = time.perf_counter()
+    partner, partner_referrals, rows, rebuild_s = await prepare()
+    print(f"Prepared {USERS} users in {time.perf_counter() - start:.1f}s, "
+          f"referral_stats rebuild: {rows} rows in {rebuild_s:.1f}s")
+    print(f"Top partner {partner}: {partner_referrals} direct referrals\n")
+
+    try:
+        old_ms, (total, active, count) = await measure(old_listing, partner)
+        new_ms, (stats, page) = await measure(new_listing, partner)
+        consistent = (
+            stats == {"total_referrals": total, "active_referrals": active}
+            and count == total and len(page) == PAGE_SIZE + 1
+        )
+
+        print(f"{'listing':<32}{'ms':>10}")
+        print(f"{'all rows + count(*)':<32}{old_ms:>10.1f}")
+        print(f"{'rollup + page':<32}{new_ms:>10.1f}")
+        print(f"Speedup: {old_ms / new_ms:.0f}x\n")
+
+        # Самый крупный реферер среди обычных пользователей - дерево в несколько уровней
+        async with AsyncSessionLocal() as db:
+            middle = await db.scalar(
+                select(User.referred_by)
+                .where(User.referred_by > PARTNERS)
+                .group_by(User.referred_by)
+                .order_by(func.count(User.id).desc())
+                .limit(1)
+            )
+
+        print(f"{'tree':<12}{'depth':>6}{'referrals':>12}{'ms':>10}")
+        for user_id, label in ((partner, "partner"), (middle, "user")):
+            for depth in DEPTHS:
+                tree_ms, levels = await measure(referral_tree, user_id, depth)
+                print(f"{label:<12}{depth:>6}{sum(level['referrals'] for level in levels):>12}{tree_ms:>10.1f}")
+    finally:
+        await close_db()
+
+    print("\nSUCCESS: benchmark completed" if consistent else "\nERROR: rollup differs from aggregates")
+    return consistent
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
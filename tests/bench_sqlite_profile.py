@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк профиля SQLite: открытие и продажа предметов до/после
+
+Один и тот же сценарий запускается дважды в отдельных процессах:
+с SQLITE_TUNING=false (журнал по умолчанию, одно соединение на все)
+и с SQLITE_TUNING=true (WAL, прагмы, очередь записи и пул соединений
+для чтения).
+
+Фаза "write" - только открытия и продажи. Фаза "mixed" - те же открытия,
+но параллельно идут GET запросы инвентаря. Приложение работает в одном
+процессе с бенчмарком, поэтому в смешанной фазе читатели и писатель делят
+один CPU: смотрите на число чтений и их p95, а не только на записи.
+"""
+
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Конфигурация
+USERS = 20
+OPENS = 600
+CONCURRENCY = 50
+MIXED_OPENS = 300
+READERS = 10
+READ_PAUSE = 0.02  # Читатели дают постоянную умеренную нагрузку, а не занимают весь CPU
+CASE_ID = 1
+
+CHILD_ENV = "BENCH_SQLITE_CHILD"
+
+
+async def prepare():
+    """Создает схему, тестовые кейсы и пользователей"""
+    from app.database import init_db, AsyncSessionLocal
+    from app.fixtures import load_test_data
+    from app.models import User
+    from sqlalchemy import insert, select
+
+    await init_db()
+    await load_test_data()
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(User), [
+            {"telegram_id": 900000 + i, "username": f"bench_sqlite_{i}", "balance_stars": 1_000_000}
+            for i in range(USERS)
+        ])
+        await db.commit()
+        return list((await db.scalars(select(User.id))).all())
+
+
+async def run_phase(requests):
+    """Выполняет запросы с ограничением параллельности"""
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    errors = 0
+
+    async def call(request):
+        nonlocal errors
+        async with semaphore:
+            response = await request()
+            if response.status_code != 200:
+                errors += 1
+            return response
+
+    start = time.perf_counter()
+    responses = await asyncio.gather(*(call(request) for request in requests))
+    return responses, time.perf_counter() - start, errors
+
+
+async def readers(client, user_ids, stop, latencies):
+    """Фоновые GET запросы инвентаря"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get(f"/api/inventory/{random.choice(user_ids)}")
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(READ_PAUSE)
+
+
+async def child():
+    """Сценарий в текущем процессе, результат - JSON в stdout"""
+    sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+    import httpx
+
+    user_ids = await prepare()
+
+    from app.main import app
+    from app.database import close_db
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        def open_requests(count):
+            return [
+                lambda user_id=random.choice(user_ids): client.post(
+                    f"/api/cases/{CASE_ID}/open", json={"user_id": user_id}
+                )
+                for _ in range(count)
+            ]
+
+        # Фаза write: только запись
+        opens, open_time, open_errors = await run_phase(open_requests(OPENS))
+
+        sells, sell_time, sell_errors = await run_phase([
+            lambda response=response: client.post(
+                f"/api/inventory/{response.json()['item']['id']}/sell",
+                json={"user_id": response.json()['item']['user_id']}
+            )
+            for response in opens if response.status_code == 200
+        ])
+
+        # Фаза mixed: открытия на фоне чтений
+        stop = asyncio.Event()
+        read_latencies = []
+        reader_tasks = [
+            asyncio.create_task(readers(client, user_ids, stop, read_latencies))
+            for _ in range(READERS)
+        ]
+
+        _, mixed_time, mixed_errors = await run_phase(open_requests(MIXED_OPENS))
+
+        stop.set()
+        await asyncio.gather(*reader_tasks)
+
+    await close_db()
+
+    read_latencies.sort()
+    print(json.dumps({
+        "opens_per_sec": OPENS / open_time,
+        "sells_per_sec": len(sells) / sell_time,
+        "mixed_opens_per_sec": MIXED_OPENS / mixed_time,
+        "mixed_reads_per_sec": len(read_latencies) / mixed_time,
+        "read_p95_ms": read_latencies[int(len(read_latencies) * 0.95)] * 1000 if read_latencies else 0,
+        "errors": open_errors + sell_errors + mixed_errors,
+    }))
+
+
+def run_profile(tuning: bool) -> dict:
+    db_path = Path(tempfile.gettempdir()) / f"crazygift_bench_sqlite_{'on' if tuning else 'off'}.db"
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{db_path}{suffix}").unlink(missing_ok=True)
+
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite+aiosqlite:///{db_path}",
+        SQLITE_TUNING="true" if tuning else "false",
+        DEBUG="false",
+        TESTING="1",
+        **{CHILD_ENV: "1"}
+    )
+    result = subprocess.run(
+        [sys.executable, __file__], env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    print("=" * 50)
+    print("BENCHMARK: SQLITE PROFILE (OPEN / SELL)")
+    print("=" * 50)
+    print(f"write: {OPENS} opens, then sells, {CONCURRENCY} concurrent")
+    print(f"mixed: {MIXED_OPENS} opens with {READERS} background readers\n")
+
+    before = run_profile(tuning=False)
+    after = run_profile(tuning=True)
+
+    print(f"{'':<22}{'before':>12}{'after':>12}")
+    for key in ("opens_per_sec", "sells_per_sec", "mixed_opens_per_sec",
+                "mixed_reads_per_sec", "read_p95_ms", "errors"):
+        print(f"{key:<22}{before[key]:>12.1f}{after[key]:>12.1f}")
+
+    ok = before["errors"] == 0 and after["errors"] == 0
+    print("\nSUCCESS: benchmark completed" if ok else "\nERROR: requests failed")
+    return ok
+
+
+if __name__ == "__main__":
+    if os.environ.get(CHILD_ENV):
+        asyncio.run(child())
+    else:
+        sys.exit(0 if main() else 1)
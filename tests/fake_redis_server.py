@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Локальная замена Redis для тестов кеша
+
+Реализует подмножество протокола RESP2, которое использует
+app.cache.RedisCache: PING, AUTH, SELECT, GET, SET (EX/PX), DEL,
+PUBLISH, SUBSCRIBE. Можно запустить отдельно:
+
+    python tests/fake_redis_server.py --port 6380
+"""
+
+import argparse
+import asyncio
+import time
+
+
+class FakeRedisServer:
+    """In-memory сервер с протоколом Redis"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.data = {}
+        self.subscribers = {}
+        self.commands = 0
+        self.delay = 0.0  # задержка ответа в секундах
+        self._server = None
+        self._clients = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        for writer in list(self._clients):
+            writer.close()
+        await self._server.wait_closed()
+
+    def drop_clients(self):
+        """Разорвать все соединения (имитация рестарта сервера)"""
+        for writer in list(self._clients):
+            writer.close()
+
+    @property
+    def url(self) -> str:
+        return f"redis://{self.host}:{self.port}/0"
+
+    async def _read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+
+        count = int(line[1:-2])
+        args = []
+        for _ in range(count):
+            length = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    async def _handle(self, reader, writer):
+        self._clients.add(writer)
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+
+                self.commands += 1
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                writer.write(self._execute(args, writer))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._clients.discard(writer)
+            for writers in self.subscribers.values():
+                writers.discard(writer)
+            writer.close()
+
+    def _execute(self, args, writer) -> bytes:
+        command = args[0].upper()
+
+        if command in (b"PING", b"AUTH", b"SELECT"):
+            return b"+OK\r\n" if command != b"PING" else b"+PONG\r\n"
+
+        if command == b"GET":
+            entry = self.data.get(args[1])
+            if entry is None or (entry[0] and entry[0] <= time.monotonic()):
+                self.data.pop(args[1], None)
+                return b"$-1\r\n"
+            return self._bulk(entry[1])
+
+        if command == b"SET":
+            expires_at = None
+            options = [arg.upper() for arg in args[3:]]
+            if b"PX" in options:
+                expires_at = time.monotonic() + int(args[3 + options.index(b"PX") + 1]) / 1000
+            elif b"EX" in options:
+                expires_at = time.monotonic() + int(args[3 + options.index(b"EX") + 1])
+            self.data[args[1]] = (expires_at, args[2])
+            return b"+OK\r\n"
+
+        if command == b"DEL":
+            removed = sum(1 for key in args[1:] if self.data.pop(key, None) is not None)
+            return b":%d\r\n" % removed
+
+        if command == b"PUBLISH":
+            message = self._array([b"message", args[1], args[2]])
+            receivers = self.subscribers.get(args[1], set())
+            for subscriber in receivers:
+                subscriber.write(message)
+            return b":%d\r\n" % len(receivers)
+
+        if command == b"SUBSCRIBE":
+            reply = b""
+            for index, channel in enumerate(args[1:], start=1):
+                self.subscribers.setdefault(channel, set()).add(writer)
+                reply += self._array([b"subscribe", channel, index])
+            return reply
+
+        return b"-ERR unknown command '%s'\r\n" % command
+
+    @staticmethod
+    def _bulk(value: bytes) -> bytes:
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def _array(self, items) -> bytes:
+        parts = [b"*%d\r\n" % len(items)]
+        for item in items:
+            if isinstance(item, int):
+                parts.append(b":%d\r\n" % item)
+            else:
+                parts.append(self._bulk(item))
+        return b"".join(parts)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Fake Redis server for tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6380)
+    args = parser.parse_args()
+
+    server = await FakeRedisServer(args.host, args.port).start()
+    print(f"Fake Redis listening on {server.url}")
+
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Локальная замена Telegram Bot API и toncenter для тестов HTTP клиентов
+
+HTTP/1.1 с keep-alive. Telegram: /bot<token>/getMe, sendMessage,
+createInvoiceLink. TON: /api/v2/getTransactions (с постраничным lt/hash/to_lt), getAddressBalance.
+Ошибки задаются очередью статусов на метод:
+
+    server.fail("getMe", 502, 502)   # два ответа 502, потом успех
+
+Можно запустить отдельно:
+
+    python tests/fake_telegram_server.py --port 8081
+"""
+
+import argparse
+import asyncio
+import json
+from urllib.parse import parse_qs, urlsplit
+
+
+class FakeTelegramServer:
+    """HTTP сервер, отвечающий как Telegram Bot API и toncenter"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.connections = 0
+        self.requests = {}
+        self.messages = []
+        self.ton_transactions = []  # От новых к старым, как отдает toncenter
+        self.failures = {}
+        self._server = None
+        self._clients = set()
+        self._tasks = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        for writer in list(self._clients):
+            writer.close()
+        if self._tasks:
+            # Закрытые соединения завершают обработчики сами (чтение вернет EOF)
+            await asyncio.wait(self._tasks, timeout=1)
+        await self._server.wait_closed()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def fail(self, method: str, *statuses: int):
+        """Следующие ответы метода будут с этими статусами"""
+        self.failures.setdefault(method, []).extend(statuses)
+
+    def _get_transactions(self, query: dict):
+        transactions = self.ton_transactions
+        if "lt" in query:
+            lts = [tx["transaction_id"]["lt"] for tx in transactions]
+            transactions = transactions[lts.index(query["lt"]):] if query["lt"] in lts else []
+
+        to_lt = int(query.get("to_lt", 0))
+        transactions = [tx for tx in transactions if int(tx["transaction_id"]["lt"]) > to_lt]
+        return transactions[:int(query.get("limit", 10))]
+
+    def _route(self, method: str, body: dict, query: dict):
+        if method == "getMe":
+            return {"ok": True, "result": {"id": 1, "is_bot": True, "username": "crazygift_test_bot"}}
+        if method == "sendMessage":
+            self.messages.append(body)
+            return {"ok": True, "result": {"message_id": len(self.messages)}}
+        if method == "createInvoiceLink":
+            return {"ok": True, "result": f"https://t.me/$invoice{len(self.requests)}"}
+        if method == "getTransactions":
+            return {"ok": True, "result": self._get_transactions(query)}
+        if method == "getAddressBalance":
+            return {"ok": True, "result": "1500000000"}
+        return None
+
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+
+        http_method, target, _ = line.decode().split(" ", 2)
+        headers = {}
+        while True:
+            header = await reader.readline()
+            if header in (b"\r\n", b"\n", b""):
+                break
+            name, value = header.decode().split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+        return http_method, target, headers, body
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self._clients.add(writer)
+        self._tasks.add(asyncio.current_task())
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+
+                _, target, headers, raw_body = request
+                url = urlsplit(target)
+                method = url.path.rsplit("/", 1)[-1]
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                self.requests[method] = self.requests.get(method, 0) + 1
+
+                body = {}
+                if raw_body and headers.get("content-type", "").startswith("application/json"):
+                    body = json.loads(raw_body)
+
+                if self.failures.get(method):
+                    status = self.failures[method].pop(0)
+                    payload = {"ok": False, "error_code": status, "description": "Injected failure"}
+                    if status == 429:
+                        payload["parameters"] = {"retry_after": 0}
+                else:
+                    status, payload = 200, self._route(method, body, query)
+                    if payload is None:
+                        status, payload = 404, {"ok": False, "description": "Not Found"}
+
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} X\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: keep-alive\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._clients.discard(writer)
+            self._tasks.discard(asyncio.current_task())
+            writer.close()
+
+
+async def serve(port: int):
+    server = await FakeTelegramServer(port=port).start()
+    print(f"Fake Telegram/TON API on {server.url} (Ctrl+C to stop)")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.port))
+    except KeyboardInterrupt:
+        pass
@@ -43,11 +43,12 @@ async def create_test_user():
                 username="testuser", 
                 first_name="Test",
                 last_name="User",
-                referral_code=generate_referral_code(123456789),
                 balance_stars=10000
             )
             
             db.add(test_user)
+            await db.flush()
+            test_user.referral_code = generate_referral_code(test_user.id)
             await db.commit()
             await db.refresh(test_user)
             
@@ -11,13 +11,16 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
 
 async def init_database():
-    """Инициализирует базу данных"""
+    """Применяет миграции и загружает тестовые кейсы"""
     print("Initializing database...")
     
     try:
-        from app.database import init_db
-        await init_db()
-        print("✓ Database tables created successfully")
+        from app.admin import migrate
+        from app.fixtures import load_test_data
+        
+        await asyncio.to_thread(migrate)
+        await load_test_data()
+        print("✓ Database migrated and seeded successfully")
         return True
     except Exception as e:
         print(f"✗ Error initializing database: {str(e)}")
@@ -54,11 +57,12 @@ async def create_test_user():
                 username="testuser",
                 first_name="Test", 
                 last_name="User",
-                referral_code=generate_referral_code(123456789),
                 balance_stars=10000  # Достаточно для всех тестов
             )
             
             db.add(test_user)
+            await db.flush()
+            test_user.referral_code = generate_referral_code(test_user.id)
             await db.commit()
             await db.refresh(test_user)
             
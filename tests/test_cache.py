@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Тесты кеша: LRU/TTL в памяти и Redis-бэкенд на локальном фейковом сервере
+
+Два экземпляра RedisCache имитируют два воркера: инвалидация на одном
+должна сбрасывать локальные кеши на другом через pub/sub.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+from pathlib import Path
+
+os.environ.setdefault("TESTING", "1")
+
+# Добавляем путь к backend
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from sqlalchemy.orm import Session
+
+from fake_redis_server import FakeRedisServer
+from app import cache as cache_module
+from app.cache import MemoryCache, RedisCache, mark_invalidated, register_invalidation_handler
+
+CHANNEL = "crazygift:test-invalidate"
+
+
+async def test_memory_lru_ttl():
+    """Тестирует вытеснение LRU и истечение TTL"""
+    print("Testing memory cache...")
+
+    cache = MemoryCache(max_entries=2, default_ttl=60)
+    await cache.set("a", 1)
+    await cache.set("b", 2)
+    await cache.get("a")          # "a" становится самым свежим
+    await cache.set("c", 3)       # вытесняет "b"
+
+    lru_ok = await cache.get("a") == 1 and await cache.get("b") is None
+
+    await cache.set("short", 4, ttl=0.05)
+    await asyncio.sleep(0.1)
+
+    ok = lru_ok and await cache.get("short") is None
+
+    print(f"Stats: {cache.stats()}")
+    print("SUCCESS: LRU and TTL work" if ok else "ERROR: unexpected memory cache state")
+    return ok
+
+
+async def test_redis_get_set(server):
+    """Тестирует операции с ключами через Redis-протокол"""
+    print("\nTesting redis cache get/set...")
+
+    cache = RedisCache(server.url, default_ttl=60, channel=CHANNEL)
+    try:
+        await cache.set("balance:1", {"balance_stars": 100})
+        value = await cache.get("balance:1")
+
+        await cache.set("short", "x", ttl=0.05)
+        await asyncio.sleep(0.1)
+        expired = await cache.get("short")
+
+        await cache.delete("balance:1")
+        deleted = await cache.get("balance:1")
+
+        ok = value == {"balance_stars": 100} and expired is None and deleted is None
+        print(f"Stats: {cache.stats()}")
+        print("SUCCESS: get/set/delete work" if ok else "ERROR: unexpected redis cache state")
+        return ok
+    finally:
+        await cache.close()
+
+
+async def test_cancelled_command(server):
+    """Тестирует отмену команды до получения ответа"""
+    print("\nTesting cancelled redis command...")
+
+    cache = RedisCache(server.url, default_ttl=60, channel=CHANNEL, pool_size=1)
+    try:
+        await cache.set("first", "A")
+        await cache.set("second", "B")
+
+        server.delay = 0.2
+        pending = asyncio.create_task(cache.get("first"))
+        await asyncio.sleep(0.05)
+        pending.cancel()
+        await asyncio.gather(pending, return_exceptions=True)
+        server.delay = 0.0
+        # Ответ на отмененную команду доходит, пока соединение еще в пуле
+        await asyncio.sleep(0.3)
+
+        value = await cache.get("second")
+
+        ok = value == "B"
+        print(f"Value after cancelled command: {value!r}")
+        print("SUCCESS: cancelled reply not reused" if ok else "ERROR: stale reply returned")
+        return ok
+    finally:
+        server.delay = 0.0
+        await cache.close()
+
+
+async def test_cross_worker_invalidation(server):
+    """Тестирует инвалидацию между двумя воркерами"""
+    print("\nTesting cross-worker invalidation...")
+
+    calls = []
+    register_invalidation_handler("test", calls.append)
+
+    worker_a = RedisCache(server.url, default_ttl=60, channel=CHANNEL)
+    worker_b = RedisCache(server.url, default_ttl=60, channel=CHANNEL)
+    try:
+        await worker_a.start()
+        await worker_b.start()
+        await worker_a.wait_subscribed()
+        await worker_b.wait_subscribed()
+
+        await worker_a.set("test:42", "cached")
+        await worker_a.invalidate("test", [42])
+
+        for _ in range(50):
+            if worker_b.invalidations_received:
+                break
+            await asyncio.sleep(0.01)
+
+        shared = await worker_b.get("test:42")
+
+        # Локальный вызов на A + событие на B; свое событие A пропускает
+        ok = (
+            calls == [42, 42]
+            and worker_a.invalidations_received == 0
+            and worker_b.invalidations_received == 1
+            and shared is None
+        )
+
+        print(f"Handler calls: {calls}")
+        print("SUCCESS: invalidation reached other worker" if ok else "ERROR: invalidation lost")
+        return ok
+    finally:
+        await worker_a.close()
+        await worker_b.close()
+
+
+async def test_resubscribe_drops_local(server):
+    """Тестирует полный сброс локальных кешей после переподключения"""
+    print("\nTesting resubscribe after disconnect...")
+
+    calls = []
+    register_invalidation_handler("resubscribe", calls.append)
+
+    worker = RedisCache(server.url, default_ttl=60, channel=CHANNEL)
+    try:
+        await worker.start()
+        await worker.wait_subscribed()
+
+        server.drop_clients()
+        await asyncio.sleep(0.1)
+        await worker.wait_subscribed()
+
+        ok = None in calls
+        print(f"Stats: {worker.stats()}")
+        print("SUCCESS: local caches dropped" if ok else "ERROR: local caches kept after reconnect")
+        return ok
+    finally:
+        await worker.close()
+
+
+class ErrorLog(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+async def test_commit_broadcast():
+    """Тестирует рассылку инвалидаций после коммита"""
+    print("\nTesting broadcast after commit...")
+
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def failing_broadcast(namespace, keys):
+        started.set()
+        await release.wait()
+        raise ConnectionError("redis unavailable")
+
+    errors = ErrorLog()
+    cache_module.logger.addHandler(errors)
+    original = cache_module.cache.broadcast
+    cache_module.cache.broadcast = failing_broadcast
+    try:
+        with Session() as session:
+            mark_invalidated(session, "broadcast", 1)
+            session.commit()
+
+        await started.wait()
+        held = len(cache_module._broadcasts)
+        release.set()
+        await asyncio.sleep(0.05)
+
+        ok = held == 1 and not cache_module._broadcasts and any(
+            "redis unavailable" in message for message in errors.messages
+        )
+        print(f"Tasks held: {held}, left: {len(cache_module._broadcasts)}, errors logged: {len(errors.messages)}")
+        print("SUCCESS: broadcast tracked and failure logged" if ok else "ERROR: broadcast task lost")
+        return ok
+    finally:
+        cache_module.cache.broadcast = original
+        cache_module.logger.removeHandler(errors)
+
+
+async def main():
+    """Основная функция тестирования кеша"""
+    print("=" * 50)
+    print("TESTING CACHE MODULE")
+    print("=" * 50)
+
+    server = await FakeRedisServer().start()
+    try:
+        results = [
+            await test_memory_lru_ttl(),
+            await test_redis_get_set(server),
+            await test_cancelled_command(server),
+            await test_cross_worker_invalidation(server),
+            await test_resubscribe_drops_local(server),
+            await test_commit_broadcast(),
+        ]
+    finally:
+        await server.stop()
+
+    print(f"\nCache tests completed: {sum(results)}/{len(results)} passed")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
@@ -105,6 +105,40 @@ async def test_open_case(case_id, user_id):
         print(f"EXCEPTION: {str(e)}")
         return None
 
+async def test_open_case_batch(case_id, user_id, count=3):
+    """Тестирует пакетное открытие кейса"""
+    print(f"\nTesting batch case opening - Case {case_id}, User {user_id}, x{count}...")
+    
+    try:
+        async with httpx.AsyncClient(timeout=30) as client:
+            response = await client.post(
+                f"{API_BASE}/cases/{case_id}/open-batch",
+                json={"user_id": user_id, "count": count}
+            )
+            
+            print(f"Status: {response.status_code}")
+            
+            if response.status_code == 200:
+                result = response.json()
+                
+                if result['success']:
+                    print(f"SUCCESS: Opened {len(result['items'])} cases")
+                    for item in result['items']:
+                        print(f"  - {item['item_name']} ({item['rarity']})")
+                    print(f"Total spent: {result['total_spent']} stars")
+                    print(f"New balance: {result['new_balance']} stars")
+                else:
+                    print(f"FAILED: {result['message']}")
+                
+                return result
+            else:
+                print(f"ERROR: {response.text}")
+                return None
+                
+    except Exception as e:
+        print(f"EXCEPTION: {str(e)}")
+        return None
+
 async def test_case_categories():
     """Тестирует получение категорий кейсов"""
     print("\nTesting case categories...")
@@ -158,6 +192,39 @@ async def test_case_stats():
         print(f"EXCEPTION: {str(e)}")
         return None
 
+async def test_cases_not_modified():
+    """Тестирует условный запрос каталога (ETag / If-None-Match)"""
+    print("\nTesting cases ETag...")
+    
+    try:
+        async with httpx.AsyncClient(timeout=30) as client:
+            response = await client.get(f"{API_BASE}/cases/")
+            etag = response.headers.get("etag")
+            
+            print(f"Status: {response.status_code}, ETag: {etag}")
+            
+            if not etag:
+                print("ERROR: ETag header is missing")
+                return False
+            
+            response = await client.get(
+                f"{API_BASE}/cases/",
+                headers={"If-None-Match": etag}
+            )
+            
+            print(f"Conditional status: {response.status_code}")
+            
+            if response.status_code == 304:
+                print("SUCCESS: Not modified")
+                return True
+            else:
+                print(f"ERROR: expected 304, got {response.status_code}")
+                return False
+                
+    except Exception as e:
+        print(f"EXCEPTION: {str(e)}")
+        return False
+
 async def main():
     """Основная функция тестирования кейсов"""
     print("=" * 50)
@@ -166,6 +233,7 @@ async def main():
     
     # Получаем список кейсов
     cases = await test_get_cases()
+    await test_cases_not_modified()
     
     if cases:
         # Тестируем детали первого кейса
@@ -175,6 +243,7 @@ async def main():
         # Тестируем открытие кейса (с тестовым пользователем)
         test_user_id = 1  # Предполагаем что пользователь с ID 1 существует
         await test_open_case(first_case['id'], test_user_id)
+        await test_open_case_batch(first_case['id'], test_user_id)
     
     # Тестируем категории
     await test_case_categories()
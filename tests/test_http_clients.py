@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Тесты общих HTTP клиентов TelegramStarsService и TonPaymentService
+
+Сервисы ходят на локальный фейковый сервер: проверяется переиспользование
+соединений, повторы с задержкой и что неидемпотентные запросы не дублируются.
+"""
+
+import asyncio
+import os
+import sys
+from decimal import Decimal
+from pathlib import Path
+
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("HTTP_BACKOFF_BASE", "0.01")
+
+# Добавляем путь к backend
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fake_telegram_server import FakeTelegramServer
+from app.payments.telegram import TelegramStarsService
+from app.payments.ton import TonPaymentService
+
+REQUESTS = 20
+
+
+async def test_connection_reuse(server):
+    """Тестирует, что последовательные запросы идут через одно соединение"""
+    print("Testing connection reuse...")
+
+    service = TelegramStarsService(api_url=server.url)
+    await service.start()
+    try:
+        server.connections = 0
+        results = [await service.get_bot_info() for _ in range(REQUESTS)]
+        stats = service.http.stats()
+    finally:
+        await service.close()
+
+    ok = (
+        all(results)
+        and server.connections == 1
+        and stats["connections_opened"] == 1
+        and stats["connections_reused"] == REQUESTS - 1
+    )
+
+    print(f"Stats: {stats}")
+    print("SUCCESS: one connection reused" if ok else f"ERROR: server saw {server.connections} connections")
+    return ok
+
+
+async def test_retry_with_backoff(server):
+    """Тестирует повторы после 5xx и 429"""
+    print("\nTesting retries...")
+
+    service = TelegramStarsService(api_url=server.url)
+    try:
+        server.fail("getMe", 502, 503)
+        info = await service.get_bot_info()
+
+        server.fail("sendMessage", 429)
+        sent = await service.send_message(42, "retry after 429")
+        stats = service.http.stats()
+    finally:
+        await service.close()
+
+    ok = info is not None and sent and stats["retries"] == 3 and not server.failures["getMe"]
+
+    print(f"Stats: {stats}")
+    print("SUCCESS: failed requests retried" if ok else "ERROR: retries did not recover")
+    return ok
+
+
+async def test_no_retry_for_send_message(server):
+    """Тестирует, что sendMessage не повторяется после 5xx (сообщение могло уйти)"""
+    print("\nTesting non-idempotent request...")
+
+    service = TelegramStarsService(api_url=server.url)
+    try:
+        server.requests.pop("sendMessage", None)
+        server.fail("sendMessage", 500)
+        sent = await service.send_message(42, "no duplicates")
+    finally:
+        await service.close()
+
+    ok = sent is False and server.requests["sendMessage"] == 1
+
+    print(f"sendMessage requests: {server.requests['sendMessage']}")
+    print("SUCCESS: message was not duplicated" if ok else "ERROR: non-idempotent request retried")
+    return ok
+
+
+async def test_ton_verify(server):
+    """Тестирует проверку TON транзакции через общий клиент"""
+    print("\nTesting TON verification...")
+
+    server.ton_transactions = [{
+        "transaction_id": {"hash": "abc123", "lt": "1"},
+        "utime": 1700000000,
+        "in_msg": {"value": "1500000000", "source": "EQsender", "message": "deposit_1_150"},
+        "out_msgs": [],
+    }]
+
+    service = TonPaymentService(api_url=server.url)
+    await service.start()
+    try:
+        valid = await service.verify_transaction("abc123", Decimal("1.5"), "deposit_1_150")
+        balance = await service.get_wallet_balance()
+        stats = service.http.stats()
+    finally:
+        await service.close()
+
+    ok = valid and balance == Decimal("1.5") and stats["connections_opened"] == 1
+
+    print(f"Stats: {stats}")
+    print("SUCCESS: transaction verified" if ok else "ERROR: TON verification failed")
+    return ok
+
+
+async def main():
+    """Основная функция тестирования HTTP клиентов"""
+    print("=" * 50)
+    print("TESTING HTTP CLIENTS")
+    print("=" * 50)
+
+    server = await FakeTelegramServer().start()
+    try:
+        results = [
+            await test_connection_reuse(server),
+            await test_retry_with_backoff(server),
+            await test_no_retry_for_send_message(server),
+            await test_ton_verify(server),
+        ]
+    finally:
+        await server.stop()
+
+    print(f"\nHTTP client tests completed: {sum(results)}/{len(results)} passed")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
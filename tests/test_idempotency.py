@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Тесты идемпотентности webhook платежей, открытия кейсов и продажи
+
+Запросы идут в приложение напрямую через ASGI транспорт httpx (без
+запущенного сервера) с временной SQLite базой: повторная доставка webhook,
+одновременные дубликаты, повтор с Idempotency-Key, повтор инвойса после
+ошибки Telegram и очистка просроченных ключей.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+DB_PATH = Path(tempfile.gettempdir()) / "crazygift_test_idempotency.db"
+for suffix in ("", "-wal", "-shm"):
+    Path(f"{DB_PATH}{suffix}").unlink(missing_ok=True)
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("DEBUG", "false")
+
+# Добавляем путь к backend
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+import httpx
+from sqlalchemy import func, select
+
+from app import idempotency
+from app.database import AsyncSessionLocal, init_db, close_db
+from app.fixtures import load_test_data
+from app.main import app
+from app.models import Case, IdempotencyKey, InventoryItem, Job, Transaction, User
+from app.payments.telegram import telegram_service
+
+
+async def create_user(telegram_id, balance=0):
+    async with AsyncSessionLocal() as db:
+        user = User(telegram_id=telegram_id, username=f"idem_{telegram_id}", balance_stars=balance)
+        db.add(user)
+        await db.commit()
+        return user.id
+
+
+async def create_deposit(user_id, type_="deposit_stars"):
+    async with AsyncSessionLocal() as db:
+        transaction = Transaction(user_id=user_id, type=type_, amount=100, currency="STARS", status="pending")
+        db.add(transaction)
+        await db.commit()
+        return transaction.id
+
+
+async def count(model, *where):
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(func.count()).select_from(model).where(*where))
+
+
+async def balance(user_id):
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(User.balance_stars).where(User.id == user_id))
+
+
+async def test_webhook_redelivery(client):
+    """Тестирует повторную доставку webhook с тем же ID платежа"""
+    print("Testing webhook redelivery...")
+
+    user_id = await create_user(8001)
+    transaction_id = await create_deposit(user_id)
+    body = {"transaction_id": transaction_id, "payment_id": "tg_pay_1", "status": "paid"}
+
+    first = await client.post("/api/payments/webhook/telegram", json=body)
+    second = await client.post("/api/payments/webhook/telegram", json=body)
+    jobs = await count(Job, Job.kind == "payment.telegram")
+
+    ok = (
+        first.status_code == second.status_code == 200
+        and first.json() == second.json()
+        and second.headers.get(idempotency.REPLAY_HEADER) == "true"
+        and jobs == 1
+    )
+
+    print(f"Responses: {first.status_code}, {second.status_code} (replayed: {second.headers.get(idempotency.REPLAY_HEADER)}), jobs: {jobs}")
+    print("SUCCESS: duplicate delivery replayed" if ok else "ERROR: duplicate delivery processed again")
+    return ok
+
+
+async def test_concurrent_duplicates(client):
+    """Тестирует одновременные дубликаты webhook"""
+    print("\nTesting concurrent duplicates...")
+
+    user_id = await create_user(8002)
+    transaction_id = await create_deposit(user_id, "deposit_ton")
+    body = {"transaction_id": transaction_id, "tx_hash": "ton_hash_1"}
+    jobs_before = await count(Job)
+
+    responses = await asyncio.gather(*(
+        client.post("/api/payments/webhook/ton", json=body) for _ in range(10)
+    ))
+    codes = sorted(response.status_code for response in responses)
+    jobs = await count(Job) - jobs_before
+
+    ok = jobs == 1 and all(code in (200, 409) for code in codes) and codes.count(200) >= 1
+
+    print(f"Status codes: {codes}, jobs: {jobs}")
+    print("SUCCESS: one job for concurrent duplicates" if ok else "ERROR: duplicates processed")
+    return ok
+
+
+async def test_open_and_sell(client):
+    """Тестирует Idempotency-Key для открытия кейса и продажи предмета"""
+    print("\nTesting Idempotency-Key on open and sell...")
+
+    async with AsyncSessionLocal() as db:
+        case = (await db.scalars(select(Case).where(Case.active == True).limit(1))).first()
+    user_id = await create_user(8003, balance=case.price_stars * 10)
+
+    open_body = {"user_id": user_id}
+    opened = [
+        await client.post(f"/api/cases/{case.id}/open", json=open_body, headers={"Idempotency-Key": "open-1"})
+        for _ in range(2)
+    ]
+    items = await count(InventoryItem, InventoryItem.user_id == user_id)
+    item_id = opened[0].json()["item"]["id"]
+
+    sell_body = {"user_id": user_id}
+    sold = [
+        await client.post(f"/api/inventory/{item_id}/sell", json=sell_body, headers={"Idempotency-Key": "sell-1"})
+        for _ in range(2)
+    ]
+    stars = await balance(user_id)
+    expected = case.price_stars * 9 + opened[0].json()["item"]["item_stars"]
+
+    # Тот же ключ для другого предмета - ошибка, а не чужой ответ
+    reused = await client.post(f"/api/inventory/{item_id + 1}/sell", json=sell_body, headers={"Idempotency-Key": "sell-1"})
+
+    ok = (
+        opened[0].json() == opened[1].json() and items == 1
+        and sold[0].status_code == sold[1].status_code == 200
+        and sold[0].json() == sold[1].json()
+        and stars == expected
+        and reused.status_code == 422
+    )
+
+    print(f"Items after two opens: {items}, balance: {stars} (expected {expected}), reused key: {reused.status_code}")
+    print("SUCCESS: open and sell executed once" if ok else "ERROR: request executed twice")
+    return ok
+
+
+async def test_invoice_retry(client):
+    """Тестирует повтор инвойса с тем же ключом после ошибки Telegram"""
+    print("\nTesting invoice retry after Telegram error...")
+
+    user_id = await create_user(8004)
+    body = {"user_id": user_id, "stars_amount": 100}
+    headers = {"Idempotency-Key": "invoice-1"}
+    writes = []
+
+    async def failing_invoice(*args):
+        # Во время запроса к Telegram запись в БД не должна ждать соединения
+        async with AsyncSessionLocal() as db:
+            db.add(User(telegram_id=8005, username="idem_8005"))
+            await asyncio.wait_for(db.commit(), timeout=5)
+        writes.append(True)
+        raise RuntimeError("Telegram API unavailable")
+
+    async def working_invoice(*args):
+        return "https://t.me/invoice/test"
+
+    original = telegram_service.create_stars_invoice
+    try:
+        telegram_service.create_stars_invoice = failing_invoice
+        started = asyncio.get_running_loop().time()
+        failed = await asyncio.wait_for(client.post("/api/payments/stars/invoice", json=body, headers=headers), timeout=10)
+        elapsed = asyncio.get_running_loop().time() - started
+
+        telegram_service.create_stars_invoice = working_invoice
+        retried = await asyncio.wait_for(client.post("/api/payments/stars/invoice", json=body, headers=headers), timeout=10)
+    finally:
+        telegram_service.create_stars_invoice = original
+
+    async with AsyncSessionLocal() as db:
+        statuses = sorted((await db.scalars(
+            select(Transaction.status).where(Transaction.user_id == user_id, Transaction.type == "deposit_stars")
+        )).all())
+
+    ok = (
+        failed.status_code == 500 and writes == [True] and elapsed < 5
+        and retried.status_code == 200
+        and retried.json()["invoice_link"] == "https://t.me/invoice/test"
+        and statuses == ["failed", "pending"]
+    )
+
+    print(f"Failed: {failed.status_code} in {elapsed:.2f}s, retry: {retried.status_code}, transactions: {statuses}")
+    print("SUCCESS: key released and retry executed" if ok else "ERROR: retry blocked or transaction orphaned")
+    return ok
+
+
+async def test_ttl_cleanup():
+    """Тестирует удаление и повторный захват просроченных ключей"""
+    print("\nTesting TTL cleanup...")
+
+    expired = datetime.utcnow() - timedelta(seconds=1)
+    async with AsyncSessionLocal() as db:
+        db.add_all([
+            IdempotencyKey(key=f"{index:064d}", fingerprint="0" * 64, status_code=200, response="{}", expires_at=expired)
+            for index in range(5)
+        ])
+        await db.commit()
+
+    idempotency._last_cleanup = 0
+    async with AsyncSessionLocal() as db:
+        request = await idempotency.begin(db, "test", "fresh", {})
+        await db.commit()
+
+    remaining = await count(IdempotencyKey, IdempotencyKey.expires_at < datetime.utcnow())
+
+    ok = request.key is not None and request.replay is None and remaining == 0
+
+    print(f"Expired keys left: {remaining}")
+    print("SUCCESS: expired keys removed" if ok else "ERROR: expired keys kept")
+    return ok
+
+
+async def main():
+    """Основная функция тестирования идемпотентности"""
+    print("=" * 50)
+    print("TESTING IDEMPOTENCY")
+    print("=" * 50)
+
+    await init_db()
+    await load_test_data()
+    transport = httpx.ASGITransport(app=app)
+
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            results = [
+                await test_webhook_redelivery(client),
+                await test_concurrent_duplicates(client),
+                await test_open_and_sell(client),
+                await test_invoice_retry(client),
+                await test_ttl_cleanup(),
+            ]
+    finally:
+        await close_db()
+
+    print(f"\nIdempotency tests completed: {sum(results)}/{len(results)} passed")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
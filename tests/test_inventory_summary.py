@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Тесты сводки инвентаря, обновляемой при записи
+
+Запросы идут в приложение напрямую через ASGI транспорт httpx (без
+запущенного сервера) с временной SQLite базой. После открытия, продажи,
+вывода и удаления статистика из сводки сравнивается с агрегатами,
+посчитанными по таблице inventory.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+DB_PATH = Path(tempfile.gettempdir()) / "crazygift_test_inventory_summary.db"
+for suffix in ("", "-wal", "-shm"):
+    Path(f"{DB_PATH}{suffix}").unlink(missing_ok=True)
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("DEBUG", "false")
+
+# Добавляем путь к backend
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+import httpx
+from sqlalchemy import delete, event, func, select
+
+from app.database import AsyncSessionLocal, engine, init_db, close_db
+from app.fixtures import load_test_data
+from app.inventory_summary import inventory_summary
+from app.main import app
+from app.models import Case, InventoryItem, Transaction, User, UserInventorySummary
+
+
+async def create_user(telegram_id, balance=0):
+    async with AsyncSessionLocal() as db:
+        user = User(telegram_id=telegram_id, username=f"summary_{telegram_id}", balance_stars=balance)
+        db.add(user)
+        await db.commit()
+        return user.id
+
+
+async def expected_stats(user_id):
+    """Статистика инвентаря агрегатами по таблице inventory"""
+    async with AsyncSessionLocal() as db:
+        items = (await db.scalars(select(InventoryItem).where(InventoryItem.user_id == user_id))).all()
+
+    active = [item for item in items if not item.is_withdrawn]
+    by_rarity = {}
+    for item in active:
+        rarity = by_rarity.setdefault(item.rarity, {"count": 0, "total_value": 0.0, "total_stars": 0})
+        rarity["count"] += 1
+        rarity["total_value"] += float(item.item_value)
+        rarity["total_stars"] += item.item_stars
+
+    best = max(active, key=lambda item: item.item_value, default=None)
+    return {
+        "total_items": len(items),
+        "portfolio_value": round(sum(float(item.item_value) for item in items), 2),
+        "portfolio_stars": sum(item.item_stars for item in items),
+        "withdrawn_items": len(items) - len(active),
+        "by_rarity": {
+            name: {**value, "total_value": round(value["total_value"], 2)} for name, value in by_rarity.items()
+        },
+        "best_value": float(best.item_value) if best else 0,
+    }
+
+
+async def matches(client, user_id):
+    """Статистика эндпоинта совпадает с агрегатами по инвентарю"""
+    stats = (await client.get(f"/api/inventory/{user_id}/stats")).json()
+    expected = await expected_stats(user_id)
+    actual = {
+        "total_items": stats["total_items"],
+        "portfolio_value": round(stats["portfolio_value"], 2),
+        "portfolio_stars": stats["portfolio_stars"],
+        "withdrawn_items": stats["withdrawn_items"],
+        "by_rarity": {
+            name: {**value, "total_value": round(value["total_value"], 2)} for name, value in stats["by_rarity"].items()
+        },
+        "best_value": stats["most_valuable_item"]["value"],
+    }
+    if actual != expected:
+        print(f"Summary: {actual}\nExpected: {expected}")
+    return actual == expected, stats
+
+
+async def test_open(client, user_id, case_id):
+    """Тестирует сводку после одиночных и пакетных открытий"""
+    print("Testing case opens...")
+
+    for _ in range(3):
+        await client.post(f"/api/cases/{case_id}/open", json={"user_id": user_id})
+    batch = await client.post(f"/api/cases/{case_id}/open-batch", json={"user_id": user_id, "count": 25})
+
+    ok, stats = await matches(client, user_id)
+    ok = ok and batch.status_code == 200 and stats["total_items"] == 28
+
+    print(f"Items: {stats['total_items']}, rarities: {sorted(stats['by_rarity'])}")
+    print("SUCCESS: summary follows opens" if ok else "ERROR: summary diverged after opens")
+    return ok
+
+
+async def test_sell_best(client, user_id):
+    """Тестирует продажу самого дорогого предмета (пересчет лучшего)"""
+    print("\nTesting sale of the most valuable item...")
+
+    async with AsyncSessionLocal() as db:
+        best = (await db.scalars(
+            select(InventoryItem)
+            .where(InventoryItem.user_id == user_id)
+            .order_by(InventoryItem.item_value.desc(), InventoryItem.id)
+            .limit(2)
+        )).all()
+
+    for item in best:
+        await client.post(f"/api/inventory/{item.id}/sell", json={"user_id": user_id})
+
+    ok, stats = await matches(client, user_id)
+    ok = ok and stats["total_items"] == 26
+
+    print(f"Sold: {[float(item.item_value) for item in best]}, new best: {stats['most_valuable_item']}")
+    print("SUCCESS: best item recomputed" if ok else "ERROR: summary diverged after sales")
+    return ok
+
+
+async def test_withdraw_and_delete(client, user_id):
+    """Тестирует вывод и удаление предметов"""
+    print("\nTesting withdrawal and delete...")
+
+    async with AsyncSessionLocal() as db:
+        items = (await db.scalars(
+            select(InventoryItem)
+            .where(InventoryItem.user_id == user_id)
+            .order_by(InventoryItem.item_value.desc(), InventoryItem.id)
+        )).all()
+
+    withdrawn = await client.post(f"/api/inventory/{items[0].id}/withdraw", json={"user_id": user_id})
+    await client.post(f"/api/inventory/{items[1].id}/withdraw", json={"user_id": user_id})
+    deleted_withdrawn = await client.delete(f"/api/inventory/{items[1].id}", params={"user_id": user_id})
+    deleted_active = await client.delete(f"/api/inventory/{items[-1].id}", params={"user_id": user_id})
+
+    ok, stats = await matches(client, user_id)
+    ok = (
+        ok and withdrawn.status_code == 200
+        and deleted_withdrawn.status_code == deleted_active.status_code == 200
+        and stats["withdrawn_items"] == 1 and stats["total_items"] == 24
+    )
+
+    print(f"Items: {stats['total_items']}, withdrawn: {stats['withdrawn_items']}")
+    print("SUCCESS: summary follows withdrawals and deletes" if ok else "ERROR: summary diverged")
+    return ok
+
+
+async def test_repeated_removal(client, user_id):
+    """Тестирует повторное удаление и вывод одного предмета"""
+    print("\nTesting repeated delete and withdrawal...")
+
+    async with AsyncSessionLocal() as db:
+        items = (await db.scalars(
+            select(InventoryItem)
+            .where(InventoryItem.user_id == user_id, InventoryItem.is_withdrawn == False)
+            .order_by(InventoryItem.item_value.desc(), InventoryItem.id)
+        )).all()
+
+    # Самый дорогой активный предмет удаляется дважды подряд и дважды одновременно
+    deleted = [
+        await client.delete(f"/api/inventory/{items[0].id}", params={"user_id": user_id})
+        for _ in range(2)
+    ]
+    concurrent = await asyncio.gather(*(
+        client.delete(f"/api/inventory/{items[1].id}", params={"user_id": user_id}) for _ in range(2)
+    ))
+    withdrawn = await asyncio.gather(*(
+        client.post(f"/api/inventory/{items[2].id}/withdraw", json={"user_id": user_id}) for _ in range(2)
+    ))
+
+    codes = {
+        "delete": [response.status_code for response in deleted],
+        "concurrent": sorted(response.status_code for response in concurrent),
+        "withdraw": sorted(response.status_code for response in withdrawn),
+    }
+    ok, stats = await matches(client, user_id)
+    ok = (
+        ok and codes["delete"] == [200, 404] and codes["concurrent"] == [200, 404]
+        and codes["withdraw"][0] == 200 and codes["withdraw"][1] in (400, 404)
+        and stats["total_items"] == 22 and stats["withdrawn_items"] == 2
+    )
+
+    print(f"Status codes: {codes}, items: {stats['total_items']}, withdrawn: {stats['withdrawn_items']}")
+    print("SUCCESS: summary changed once per item" if ok else "ERROR: summary applied twice")
+    return ok
+
+
+async def raced(request, prefix, competing_sql, item_id):
+    """
+    Запрос, который проигрывает гонку: прямо перед его DELETE/UPDATE
+    предмета конкурирующая запись выполняется на том же соединении
+    (на SQLite запросы сериализованы, и настоящая гонка не воспроизводится)
+    """
+    pending = [competing_sql]
+
+    def compete(conn, cursor, statement, parameters, context, executemany):
+        if pending and statement.startswith(prefix):
+            cursor.execute(pending.pop(), (item_id,))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", compete)
+    try:
+        return await request
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", compete)
+
+
+async def test_lost_race(client, user_id):
+    """Тестирует удаление и вывод предмета, который уже забрал другой запрос"""
+    print("\nTesting delete and withdrawal losing a race...")
+
+    async with AsyncSessionLocal() as db:
+        items = (await db.scalars(
+            select(InventoryItem)
+            .where(InventoryItem.user_id == user_id, InventoryItem.is_withdrawn == False)
+            .order_by(InventoryItem.item_value.desc(), InventoryItem.id)
+        )).all()
+    before = (await client.get(f"/api/inventory/{user_id}/stats")).json()
+
+    deleted = await raced(
+        client.delete(f"/api/inventory/{items[0].id}", params={"user_id": user_id}),
+        "DELETE FROM inventory", "DELETE FROM inventory WHERE id = ?", items[0].id
+    )
+    withdrawn = await raced(
+        client.post(f"/api/inventory/{items[1].id}/withdraw", json={"user_id": user_id}),
+        "UPDATE inventory", "UPDATE inventory SET is_withdrawn = 1 WHERE id = ?", items[1].id
+    )
+    after = (await client.get(f"/api/inventory/{user_id}/stats")).json()
+
+    # Конкурирующие записи шли в обход сводки - восстанавливаем ее для следующих тестов
+    async with AsyncSessionLocal() as db:
+        await inventory_summary.rebuild(db, user_id)
+        await db.commit()
+    consistent, _ = await matches(client, user_id)
+
+    ok = (
+        deleted.status_code == 404 and withdrawn.status_code == 400
+        and after == before and consistent
+    )
+
+    print(f"Delete: {deleted.status_code}, withdraw: {withdrawn.status_code}, summary unchanged: {after == before}")
+    print("SUCCESS: summary untouched by lost races" if ok else "ERROR: summary applied without a row")
+    return ok
+
+
+async def test_user_stats(client, user_id):
+    """Тестирует статистику пользователя по сводке и счетчикам"""
+    print("\nTesting user stats...")
+
+    stats = (await client.get(f"/api/users/{user_id}/stats")).json()
+    expected = await expected_stats(user_id)
+
+    async with AsyncSessionLocal() as db:
+        purchases, spent, earned = (await db.execute(
+            select(
+                func.count(Transaction.id).filter(Transaction.type == "case_purchase"),
+                func.sum(Transaction.amount).filter(Transaction.type == "case_purchase"),
+                func.sum(Transaction.amount).filter(Transaction.type == "item_sale"),
+            ).where(Transaction.user_id == user_id, Transaction.status == "completed")
+        )).first()
+
+    inventory = stats["inventory"]
+    ok = (
+        inventory["total_items"] == expected["total_items"] - expected["withdrawn_items"]
+        and all(
+            inventory[f"{rarity}_items"] == expected["by_rarity"].get(rarity, {}).get("count", 0)
+            for rarity in ("common", "rare", "epic", "legendary", "mythic")
+        )
+        and stats["transactions"] == {
+            "total_purchases": purchases, "total_spent": float(spent), "total_earned": float(earned)
+        }
+    )
+
+    print(f"Inventory: {inventory}, transactions: {stats['transactions']}")
+    print("SUCCESS: user stats match aggregates" if ok else "ERROR: user stats diverged")
+    return ok
+
+
+async def test_rebuild(client, user_id):
+    """Тестирует пересчет сводки по инвентарю"""
+    print("\nTesting rebuild...")
+
+    before = (await client.get(f"/api/inventory/{user_id}/stats")).json()
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(UserInventorySummary))
+        await db.commit()
+    emptied = (await client.get(f"/api/inventory/{user_id}/stats")).json()
+
+    async with AsyncSessionLocal() as db:
+        rows = await inventory_summary.rebuild(db)
+        await db.commit()
+
+    ok, after = await matches(client, user_id)
+    ok = ok and emptied["total_items"] == 0 and after == before and rows > 0
+
+    print(f"Rebuilt rows: {rows}, items: {after['total_items']}")
+    print("SUCCESS: summary rebuilt from inventory" if ok else "ERROR: rebuild differs")
+    return ok
+
+
+async def main():
+    """Основная функция тестирования сводки инвентаря"""
+    print("=" * 50)
+    print("TESTING INVENTORY SUMMARY")
+    print("=" * 50)
+
+    await init_db()
+    await load_test_data()
+    async with AsyncSessionLocal() as db:
+        case = (await db.scalars(select(Case).where(Case.name == "Telegram Case #2"))).first()
+    user_id = await create_user(9101, balance=case.price_stars * 100)
+    transport = httpx.ASGITransport(app=app)
+
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            results = [
+                await test_open(client, user_id, case.id),
+                await test_sell_best(client, user_id),
+                await test_withdraw_and_delete(client, user_id),
+                await test_repeated_removal(client, user_id),
+                await test_lost_race(client, user_id),
+                await test_user_stats(client, user_id),
+                await test_rebuild(client, user_id),
+            ]
+    finally:
+        await close_db()
+
+    print(f"\nInventory summary tests completed: {sum(results)}/{len(results)} passed")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Тесты очереди фоновых задач
+
+Воркер работает с временной SQLite базой: повтор с задержкой и dead после
+исчерпания попыток, повторный захват задачи упавшего воркера по истечении
+аренды, ограничение параллельности и обработка платежа Telegram Stars
+(в том числе запоздавший неудачный статус уже зачисленного платежа).
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+DB_PATH = Path(tempfile.gettempdir()) / "crazygift_test_jobs.db"
+for suffix in ("", "-wal", "-shm"):
+    Path(f"{DB_PATH}{suffix}").unlink(missing_ok=True)
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("DEBUG", "false")
+os.environ["JOBS_MAX_ATTEMPTS"] = "3"
+
+# Добавляем путь к backend
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+from sqlalchemy import select, update
+
+from app import jobs
+from app.database import AsyncSessionLocal, init_db, close_db
+from app.jobs import JobRunner
+from app.models import Job, OutboundMessage, Transaction, User
+from app.api import payments  # noqa: F401 - обработчики платежей
+
+calls = {}
+
+
+async def flaky(name: str, failures: int):
+    """Падает первые failures раз"""
+    calls[name] = calls.get(name, 0) + 1
+    if calls[name] <= failures:
+        raise RuntimeError(f"{name} failed")
+
+
+async def flaky_dead(name: str, failures: int):
+    calls[f"{name}:dead"] = True
+
+
+async def slow(index: int):
+    calls["active"] = calls.get("active", 0) + 1
+    calls["peak"] = max(calls.get("peak", 0), calls["active"])
+    await asyncio.sleep(0.05)
+    calls["active"] -= 1
+    calls["slow_done"] = calls.get("slow_done", 0) + 1
+
+
+jobs.register("test.flaky", flaky, on_dead=flaky_dead)
+jobs.register("test.slow", slow)
+
+
+async def add_job(kind, payload, **values):
+    async with AsyncSessionLocal() as db:
+        jobs.enqueue(db, kind, payload)
+        await db.flush()
+        job_id = (await db.scalars(select(Job.id).order_by(Job.id.desc()))).first()
+        if values:
+            await db.execute(update(Job).where(Job.id == job_id).values(**values))
+        await db.commit()
+        return job_id
+
+
+async def job_state(job_id):
+    async with AsyncSessionLocal() as db:
+        job = await db.get(Job, job_id)
+        return job.status, job.attempts
+
+
+async def make_due(job_id):
+    """Перенести повтор на сейчас, не дожидаясь задержки"""
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(Job).where(Job.id == job_id).values(run_at=datetime.utcnow()))
+        await db.commit()
+
+
+async def test_retry_and_dead(runner):
+    """Тестирует повтор после ошибки и dead после max_attempts"""
+    print("Testing retry and dead-lettering...")
+
+    recovered = await add_job("test.flaky", {"name": "recovers", "failures": 1})
+    await runner.run_once()
+    after_failure = await job_state(recovered)
+    await make_due(recovered)
+    await runner.run_once()
+    after_retry = await job_state(recovered)
+
+    dead = await add_job("test.flaky", {"name": "dies", "failures": 10})
+    for _ in range(3):
+        await make_due(dead)
+        await runner.run_once()
+    dead_state = await job_state(dead)
+
+    ok = (
+        after_failure == ("pending", 1) and after_retry == ("done", 2)
+        and dead_state == ("dead", 3) and calls.get("dies:dead") and calls["dies"] == 3
+    )
+
+    print(f"Recovered: {after_failure} -> {after_retry}, dead: {dead_state}")
+    print("SUCCESS: failed jobs retried and dead-lettered" if ok else "ERROR: unexpected job state")
+    return ok
+
+
+async def test_expired_lease(runner):
+    """Тестирует повторный захват задачи упавшего воркера"""
+    print("\nTesting expired lease...")
+
+    now = datetime.utcnow()
+    held = await add_job(
+        "test.flaky", {"name": "held", "failures": 0},
+        status="running", attempts=1, locked_by="other", locked_until=now + timedelta(seconds=60)
+    )
+    abandoned = await add_job(
+        "test.flaky", {"name": "abandoned", "failures": 0},
+        status="running", attempts=1, locked_by="crashed", locked_until=now - timedelta(seconds=1)
+    )
+
+    claimed = [job.id for job in await runner.run_once()]
+    states = (await job_state(held), await job_state(abandoned))
+
+    ok = claimed == [abandoned] and states == (("running", 1), ("done", 2))
+
+    print(f"Claimed: {claimed}, held: {states[0]}, abandoned: {states[1]}")
+    print("SUCCESS: abandoned job reclaimed" if ok else "ERROR: lease not respected")
+    return ok
+
+
+async def drained(runner, total):
+    """Дождаться выполнения total задач и освобождения всех слотов"""
+    while runner.completed < total or runner.stats()["active"]:
+        await asyncio.sleep(0.01)
+
+
+async def test_bounded_pool():
+    """Тестирует ограничение одновременно выполняемых задач и остановку воркера"""
+    print("\nTesting bounded worker pool...")
+
+    runner = JobRunner(concurrency=3)
+    for index in range(12):
+        await add_job("test.slow", {"index": index})
+
+    await runner.start()
+    try:
+        await asyncio.wait_for(drained(runner, 12), timeout=10)
+        # Воркер ждет пробуждения; пробуждение в момент остановки (как после
+        # последней задачи) не должно отменить остановку
+        await asyncio.sleep(0.2)
+        runner.wake()
+        started = asyncio.get_running_loop().time()
+        await asyncio.wait_for(runner.close(timeout=5), timeout=5)
+        # close глотает отмену от wait_for, поэтому зависание видно по времени
+        stopped = asyncio.get_running_loop().time() - started < 1
+    except asyncio.TimeoutError:
+        stopped = False
+
+    ok = stopped and calls.get("slow_done") == 12 and calls["peak"] == 3 and runner.completed == 12
+
+    print(f"Done: {calls.get('slow_done')}, peak concurrency: {calls.get('peak')}, stopped: {stopped}")
+    print("SUCCESS: pool bounded" if ok else "ERROR: unexpected concurrency or runner did not stop")
+    return ok
+
+
+async def test_payment_job(runner):
+    """Тестирует обработку платежа Telegram Stars задачей из webhook"""
+    print("\nTesting payment job...")
+
+    async with AsyncSessionLocal() as db:
+        user = User(telegram_id=7001, username="jobs_user", balance_stars=0)
+        db.add(user)
+        await db.flush()
+        transaction = Transaction(user_id=user.id, type="deposit_stars", amount=Decimal("250"),
+                                  currency="XTR", status="processing", external_id="pay_1")
+        db.add(transaction)
+        await db.flush()
+        payload = {"transaction_id": transaction.id, "payment_id": "pay_1", "payment_status": "paid"}
+        # Дубликат задачи (повторный webhook) не начислит звезды дважды
+        jobs.enqueue(db, "payment.telegram", payload)
+        jobs.enqueue(db, "payment.telegram", payload)
+        await db.commit()
+        user_id, transaction_id = user.id, transaction.id
+
+    await runner.run_once()
+
+    async with AsyncSessionLocal() as db:
+        balance = await db.scalar(select(User.balance_stars).where(User.id == user_id))
+        status = await db.scalar(select(Transaction.status).where(Transaction.id == transaction_id))
+        queued = await db.scalar(select(OutboundMessage.id).where(OutboundMessage.chat_id == 7001))
+
+    ok = balance == 250 and status == "completed" and queued is not None
+
+    print(f"Balance: {balance}, status: {status}, notification queued: {queued is not None}")
+    print("SUCCESS: payment processed by job" if ok else "ERROR: payment job failed")
+    return ok
+
+
+async def test_failed_after_paid(runner):
+    """Тестирует задачу с неудачным статусом для уже зачисленного платежа"""
+    print("\nTesting failed status after payment...")
+
+    async with AsyncSessionLocal() as db:
+        user = User(telegram_id=7002, username="jobs_failed", balance_stars=0)
+        db.add(user)
+        await db.flush()
+        transaction = Transaction(user_id=user.id, type="deposit_stars", amount=Decimal("100"),
+                                  currency="XTR", status="processing", external_id="pay_2")
+        db.add(transaction)
+        await db.flush()
+        payload = {"transaction_id": transaction.id, "payment_id": "pay_2"}
+        jobs.enqueue(db, "payment.telegram", {**payload, "payment_status": "paid"})
+        await db.commit()
+        user_id, transaction_id = user.id, transaction.id
+
+    await runner.run_once()
+
+    # Запоздавший webhook с неудачным статусом не отменяет зачисление
+    async with AsyncSessionLocal() as db:
+        jobs.enqueue(db, "payment.telegram", {**payload, "payment_status": "failed"})
+        await db.commit()
+
+    await runner.run_once()
+
+    async with AsyncSessionLocal() as db:
+        balance = await db.scalar(select(User.balance_stars).where(User.id == user_id))
+        status = await db.scalar(select(Transaction.status).where(Transaction.id == transaction_id))
+        failed = await db.scalar(
+            select(OutboundMessage.id)
+            .where(OutboundMessage.chat_id == 7002, OutboundMessage.kind == "payment_failed")
+        )
+
+    ok = balance == 100 and status == "completed" and failed is None
+
+    print(f"Balance: {balance}, status: {status}, failure notification queued: {failed is not None}")
+    print("SUCCESS: completed payment kept" if ok else "ERROR: completed payment overwritten")
+    return ok
+
+
+async def main():
+    """Основная функция тестирования очереди задач"""
+    print("=" * 50)
+    print("TESTING JOB QUEUE")
+    print("=" * 50)
+
+    await init_db()
+    runner = JobRunner()
+
+    try:
+        results = [
+            await test_retry_and_dead(runner),
+            await test_expired_lease(runner),
+            await test_bounded_pool(),
+            await test_payment_job(runner),
+            await test_failed_after_paid(runner),
+        ]
+    finally:
+        await close_db()
+
+    print(f"\nJob tests completed: {sum(results)}/{len(results)} passed")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Тесты очереди уведомлений Telegram
+
+Диспетчер работает с временной SQLite базой и отправляет сообщения на
+локальный фейковый Bot API: склейка сообщений одному чату, повтор после
+ошибки, окончательная ошибка для заблокированного бота, ведро токенов и
+остановка фоновой отправки.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+DB_PATH = Path(tempfile.gettempdir()) / "crazygift_test_notifications.db"
+for suffix in ("", "-wal", "-shm"):
+    Path(f"{DB_PATH}{suffix}").unlink(missing_ok=True)
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("DEBUG", "false")
+os.environ.setdefault("NOTIFY_CHAT_RATE", "1000")
+
+# Добавляем путь к backend
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from sqlalchemy import select, update
+
+from fake_telegram_server import FakeTelegramServer
+from app.database import AsyncSessionLocal, init_db, close_db
+from app.models import OutboundMessage
+from app.notifications import NotificationDispatcher, TokenBucket, enqueue
+from app.payments.telegram import TelegramStarsService
+
+
+async def statuses():
+    async with AsyncSessionLocal() as db:
+        rows = await db.scalars(select(OutboundMessage).order_by(OutboundMessage.id))
+        return [(row.chat_id, row.status, row.attempts) for row in rows]
+
+
+async def clear_queue():
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(OutboundMessage).values(status="sent"))
+        await db.commit()
+
+
+def test_token_bucket():
+    """Тестирует ведро токенов"""
+    print("Testing token bucket...")
+
+    bucket = TokenBucket(rate=10, capacity=2)
+    burst = [bucket.try_acquire() for _ in range(3)]
+    wait = bucket.wait_time()
+    time.sleep(0.11)
+    refilled = bucket.try_acquire()
+
+    ok = burst == [True, True, False] and 0 < wait < 0.11 and refilled
+    print(f"Burst: {burst}, wait: {wait:.3f}s")
+    print("SUCCESS: token bucket limits rate" if ok else "ERROR: unexpected token bucket state")
+    return ok
+
+
+async def test_coalesce(server, dispatcher):
+    """Тестирует склейку нескольких уведомлений одному пользователю"""
+    print("\nTesting coalescing...")
+
+    server.messages.clear()
+    async with AsyncSessionLocal() as db:
+        enqueue(db, 1001, "first", kind="payment_success")
+        enqueue(db, 1001, "second", kind="payment_success")
+        enqueue(db, 1001, "third", kind="payment_failed")
+        enqueue(db, 2002, "other chat")
+        await db.commit()
+
+    claimed = await dispatcher.dispatch_once()
+    texts = {message["chat_id"]: message["text"] for message in server.messages}
+
+    ok = (
+        claimed == 4
+        and len(server.messages) == 2
+        and texts[1001] == "first\n\nsecond\n\nthird"
+        and all(status == "sent" for _, status, _ in await statuses())
+    )
+
+    print(f"Sent: {len(server.messages)} messages, stats: {dispatcher.stats()}")
+    print("SUCCESS: notifications coalesced" if ok else "ERROR: unexpected delivery")
+    return ok
+
+
+async def test_retry(server, dispatcher):
+    """Тестирует повтор после ошибки Bot API"""
+    print("\nTesting retry...")
+
+    server.messages.clear()
+    server.fail("sendMessage", 500)
+    async with AsyncSessionLocal() as db:
+        enqueue(db, 3003, "retry me")
+        await db.commit()
+
+    await dispatcher.dispatch_once()
+    after_failure = (await statuses())[-1]
+
+    # Переносим время повтора на сейчас, не дожидаясь задержки
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(OutboundMessage)
+            .where(OutboundMessage.status == "pending")
+            .values(next_attempt_at=datetime.utcnow())
+        )
+        await db.commit()
+
+    await dispatcher.dispatch_once()
+    after_retry = (await statuses())[-1]
+
+    ok = after_failure == (3003, "pending", 1) and after_retry == (3003, "sent", 1) and len(server.messages) == 1
+
+    print(f"After failure: {after_failure}, after retry: {after_retry}")
+    print("SUCCESS: failed message retried" if ok else "ERROR: retry did not deliver")
+    return ok
+
+
+async def test_permanent_failure(server, dispatcher):
+    """Тестирует, что 403 (бот заблокирован) не повторяется"""
+    print("\nTesting permanent failure...")
+
+    server.fail("sendMessage", 403)
+    async with AsyncSessionLocal() as db:
+        enqueue(db, 4004, "blocked")
+        await db.commit()
+
+    await dispatcher.dispatch_once()
+    last = (await statuses())[-1]
+    claimed_again = await dispatcher.dispatch_once()
+
+    ok = last == (4004, "failed", 1) and claimed_again == 0
+
+    print(f"Status: {last}")
+    print("SUCCESS: message marked failed" if ok else "ERROR: blocked chat retried")
+    return ok
+
+
+async def test_stop(server, dispatcher):
+    """Тестирует остановку диспетчера, пришедшую вместе с пробуждением"""
+    print("\nTesting stop after wakeup...")
+
+    await dispatcher.start()
+    # Диспетчер ждет пробуждения; коммит с сообщением в момент остановки
+    await asyncio.sleep(0.2)
+    dispatcher.wake()
+    started = asyncio.get_running_loop().time()
+    try:
+        await asyncio.wait_for(dispatcher.close(), timeout=5)
+        # close глотает отмену от wait_for, поэтому зависание видно по времени
+        elapsed = asyncio.get_running_loop().time() - started
+    except asyncio.TimeoutError:
+        elapsed = None
+
+    ok = elapsed is not None and elapsed < 1
+
+    print(f"Stopped in: {f'{elapsed:.3f}s' if elapsed is not None else 'timeout'}")
+    print("SUCCESS: dispatcher stopped" if ok else "ERROR: dispatcher did not stop")
+    return ok
+
+
+async def main():
+    """Основная функция тестирования очереди уведомлений"""
+    print("=" * 50)
+    print("TESTING NOTIFICATION QUEUE")
+    print("=" * 50)
+
+    await init_db()
+    server = await FakeTelegramServer().start()
+    sender = TelegramStarsService(api_url=server.url)
+    dispatcher = NotificationDispatcher(sender=sender)
+
+    try:
+        results = [test_token_bucket()]
+        for test in (test_coalesce, test_retry, test_permanent_failure, test_stop):
+            await clear_queue()
+            results.append(await test(server, dispatcher))
+    finally:
+        await sender.close()
+        await server.stop()
+        await close_db()
+
+    print(f"\nNotification tests completed: {sum(results)}/{len(results)} passed")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Тесты keyset пагинации
+
+Запросы идут в приложение напрямую через ASGI транспорт httpx (без
+запущенного сервера) с временной SQLite базой: обход истории операций
+и инвентаря по курсору (в том числе строк с created_at из server_default),
+фильтры, точное total по запросу и ошибки.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+DB_PATH = Path(tempfile.gettempdir()) / "crazygift_test_pagination.db"
+for suffix in ("", "-wal", "-shm"):
+    Path(f"{DB_PATH}{suffix}").unlink(missing_ok=True)
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("DEBUG", "false")
+
+# Добавляем путь к backend
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+import httpx
+from sqlalchemy import insert
+
+from app.database import AsyncSessionLocal, init_db, close_db
+from app.main import app
+from app.models import InventoryItem, Transaction, User
+
+TRANSACTIONS = 237
+ITEMS = 173
+# Предел страниц при обходе: курсор, который не продвигается, не зациклит тест
+MAX_PAGES = 100
+
+
+async def create_user(telegram_id):
+    async with AsyncSessionLocal() as db:
+        user = User(telegram_id=telegram_id, username=f"page_{telegram_id}", balance_stars=0)
+        db.add(user)
+        await db.commit()
+        return user.id
+
+
+async def seed_history(user_id):
+    """Транзакции с повторяющимся created_at (порядок внутри секунды - по id)"""
+    start = datetime(2026, 1, 1)
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(Transaction), [
+            {
+                "user_id": user_id,
+                "type": "case_purchase" if index % 3 else "item_sale",
+                "amount": index, "currency": "STARS",
+                "status": "completed" if index % 5 else "failed",
+                "created_at": start + timedelta(seconds=index // 4),
+            }
+            for index in range(TRANSACTIONS)
+        ])
+        await db.commit()
+
+
+async def seed_inventory(user_id):
+    """Предметы с повторяющимся created_at, каждый седьмой выведен"""
+    start = datetime(2026, 1, 1)
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(InventoryItem), [
+            {
+                "user_id": user_id, "item_name": f"Item {index}", "item_value": 1, "item_stars": index,
+                "rarity": "rare" if index % 2 else "common",
+                "is_withdrawn": index % 7 == 0,
+                "created_at": start + timedelta(seconds=index // 3),
+            }
+            for index in range(ITEMS)
+        ])
+        await db.commit()
+
+
+async def walk_inventory(client, url, params):
+    """Пройти все страницы инвентаря по курсору из заголовка"""
+    ids, pages, cursor = [], 0, None
+    while pages < MAX_PAGES:
+        response = await client.get(url, params={**params, **({"cursor": cursor} if cursor else {})})
+        ids.extend(item["id"] for item in response.json())
+        pages += 1
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return ids, pages
+    return ids, pages
+
+
+async def walk(client, url, params):
+    """Пройти все страницы по курсору"""
+    ids, pages, cursor = [], 0, None
+    while pages < MAX_PAGES:
+        response = await client.get(url, params={**params, **({"cursor": cursor} if cursor else {})})
+        data = response.json()
+        ids.extend(item["id"] for item in data["transactions"])
+        pages += 1
+        cursor = data["next_cursor"]
+        if not data["has_more"]:
+            return ids, pages, data
+    return ids, pages, data
+
+
+async def test_history_walk(client, user_id):
+    """Тестирует обход истории по курсору"""
+    print("Testing history cursor walk...")
+
+    ids, pages, last = await walk(client, f"/api/users/{user_id}/history", {"limit": 50})
+
+    ok = (
+        len(ids) == TRANSACTIONS and len(set(ids)) == TRANSACTIONS
+        and ids == sorted(ids, reverse=True)
+        and pages == 5 and last["next_cursor"] is None and last["total"] is None
+    )
+
+    print(f"Pages: {pages}, rows: {len(ids)}, unique: {len(set(ids))}")
+    print("SUCCESS: every row returned once in order" if ok else "ERROR: cursor walk skipped or repeated rows")
+    return ok
+
+
+async def test_history_filters(client, user_id):
+    """Тестирует фильтры с курсором и точное total"""
+    print("\nTesting filters and total...")
+
+    params = {"limit": 20, "transaction_type": "case_purchase", "status": "completed"}
+    ids, _, _ = await walk(client, f"/api/users/{user_id}/history", params)
+    expected = sum(1 for index in range(TRANSACTIONS) if index % 3 and index % 5)
+
+    first = (await client.get(
+        f"/api/users/{user_id}/history", params={**params, "include_total": "true"}
+    )).json()
+
+    ok = len(ids) == expected and first["total"] == expected and first["has_more"]
+
+    print(f"Filtered rows: {len(ids)}, total: {first['total']}, expected: {expected}")
+    print("SUCCESS: filters applied across pages" if ok else "ERROR: unexpected filtered result")
+    return ok
+
+
+async def test_history_server_default(client):
+    """Тестирует обход строк с created_at из server_default (без долей секунды)"""
+    print("\nTesting history with server-default timestamps...")
+
+    user_id = await create_user(10004)
+    async with AsyncSessionLocal() as db:
+        # created_at не передается - его пишет CURRENT_TIMESTAMP, все строки в одной секунде
+        await db.execute(insert(Transaction), [
+            {"user_id": user_id, "type": "case_purchase", "amount": index, "currency": "STARS", "status": "completed"}
+            for index in range(10)
+        ])
+        await db.commit()
+
+    ids, pages, _ = await walk(client, f"/api/users/{user_id}/history", {"limit": 3})
+
+    ok = len(ids) == 10 and len(set(ids)) == 10 and ids == sorted(ids, reverse=True) and pages == 4
+
+    print(f"Pages: {pages}, rows: {len(ids)}, unique: {len(set(ids))}")
+    print("SUCCESS: server-default rows returned once" if ok else "ERROR: cursor repeated server-default rows")
+    return ok
+
+
+async def test_history_errors(client, user_id):
+    """Тестирует ошибки: поврежденный курсор, несуществующий пользователь"""
+    print("\nTesting errors...")
+
+    bad_cursor = await client.get(f"/api/users/{user_id}/history", params={"cursor": "not-a-cursor"})
+    missing = await client.get("/api/users/999999/history")
+    empty_user = await create_user(10002)
+    empty = await client.get(f"/api/users/{empty_user}/history")
+
+    ok = (
+        bad_cursor.status_code == 400 and missing.status_code == 404
+        and empty.status_code == 200 and empty.json()["transactions"] == []
+    )
+
+    print(f"Bad cursor: {bad_cursor.status_code}, missing user: {missing.status_code}, empty history: {empty.status_code}")
+    print("SUCCESS: errors reported" if ok else "ERROR: unexpected error handling")
+    return ok
+
+
+async def test_inventory_walk(client, user_id):
+    """Тестирует обход инвентаря по курсору с фильтрами"""
+    print("\nTesting inventory cursor walk...")
+
+    url = f"/api/inventory/{user_id}"
+    ids, pages = await walk_inventory(client, url, {"limit": 40})
+    rare_ids, _ = await walk_inventory(client, url, {"limit": 25, "rarity": "rare"})
+    all_ids, _ = await walk_inventory(client, url, {"limit": 40, "include_withdrawn": "true"})
+
+    active = sum(1 for index in range(ITEMS) if index % 7)
+    rare = sum(1 for index in range(ITEMS) if index % 7 and index % 2)
+
+    ok = (
+        len(ids) == active and len(set(ids)) == active and ids == sorted(ids, reverse=True)
+        and pages == -(-active // 40)
+        and len(rare_ids) == rare and len(set(all_ids)) == ITEMS
+    )
+
+    print(f"Active: {len(ids)} in {pages} pages, rare: {len(rare_ids)}, with withdrawn: {len(all_ids)}")
+    print("SUCCESS: inventory paginated by cursor" if ok else "ERROR: cursor walk skipped or repeated items")
+    return ok
+
+
+async def test_inventory_server_default(client):
+    """Тестирует обход предметов с created_at из server_default"""
+    print("\nTesting inventory with server-default timestamps...")
+
+    user_id = await create_user(10005)
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(InventoryItem), [
+            {"user_id": user_id, "item_name": f"Item {index}", "item_value": 1, "item_stars": index, "rarity": "common"}
+            for index in range(10)
+        ])
+        await db.commit()
+
+    ids, pages = await walk_inventory(client, f"/api/inventory/{user_id}", {"limit": 3})
+
+    ok = len(ids) == 10 and len(set(ids)) == 10 and ids == sorted(ids, reverse=True) and pages == 4
+
+    print(f"Pages: {pages}, items: {len(ids)}, unique: {len(set(ids))}")
+    print("SUCCESS: server-default items returned once" if ok else "ERROR: cursor repeated server-default items")
+    return ok
+
+
+async def test_inventory_errors(client, user_id):
+    """Тестирует ответы инвентаря без отдельной проверки пользователя"""
+    print("\nTesting inventory errors...")
+
+    missing = await client.get("/api/inventory/999999")
+    empty_user = await create_user(10003)
+    empty = await client.get(f"/api/inventory/{empty_user}")
+    bad_cursor = await client.get(f"/api/inventory/{user_id}", params={"cursor": "broken"})
+    legacy = await client.get(f"/api/inventory/{user_id}", params={"limit": 10, "offset": 10})
+    past_end = await client.get(f"/api/inventory/{user_id}", params={"offset": ITEMS})
+    missing_offset = await client.get("/api/inventory/999999", params={"offset": 10})
+
+    ok = (
+        missing.status_code == 404
+        and empty.status_code == 200 and empty.json() == []
+        and bad_cursor.status_code == 400
+        and legacy.status_code == 200 and len(legacy.json()) == 10
+        and past_end.status_code == 200 and past_end.json() == []
+        and missing_offset.status_code == 404
+    )
+
+    print(f"Missing: {missing.status_code}, empty: {empty.status_code}, bad cursor: {bad_cursor.status_code}, "
+          f"offset: {legacy.status_code}, past end: {past_end.status_code}")
+    print("SUCCESS: inventory errors reported" if ok else "ERROR: unexpected inventory response")
+    return ok
+
+
+async def main():
+    """Основная функция тестирования пагинации"""
+    print("=" * 50)
+    print("TESTING KEYSET PAGINATION")
+    print("=" * 50)
+
+    await init_db()
+    user_id = await create_user(10001)
+    await seed_history(user_id)
+    await seed_inventory(user_id)
+    transport = httpx.ASGITransport(app=app)
+
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            results = [
+                await test_history_walk(client, user_id),
+                await test_history_filters(client, user_id),
+                await test_history_server_default(client),
+                await test_history_errors(client, user_id),
+                await test_inventory_walk(client, user_id),
+                await test_inventory_server_default(client),
+                await test_inventory_errors(client, user_id),
+            ]
+    finally:
+        await close_db()
+
+    print(f"\nPagination tests completed: {sum(results)}/{len(results)} passed")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
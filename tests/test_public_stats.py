@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Тесты публичной статистики: шардированные счетчики и присутствие онлайн
+
+Запросы идут в приложение напрямую через ASGI транспорт httpx (без
+запущенного сервера) с временной SQLite базой: регистрации и открытия
+кейсов увеличивают счетчики, /api/stats отдает их из кеша. Активность
+копится в буфере присутствия и пакетом пишется в last_active, по которому
+считается online_now.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from urllib.parse import urlencode
+
+DB_PATH = Path(tempfile.gettempdir()) / "crazygift_test_public_stats.db"
+for suffix in ("", "-wal", "-shm"):
+    Path(f"{DB_PATH}{suffix}").unlink(missing_ok=True)
+
+BOT_TOKEN = "123456:stats-test-token"
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ["TELEGRAM_BOT_TOKEN"] = BOT_TOKEN
+os.environ.setdefault("SECRET_KEY", "crazygift-test-secret-key")
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("DEBUG", "false")
+
+# Добавляем путь к backend
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+import httpx
+from sqlalchemy import event, func, select, update
+
+from app.cache import cache
+from app.config import settings
+from app.database import AsyncSessionLocal, engine, init_db, close_db
+from app.fixtures import load_test_data
+from app.main import app
+from app.models import Case, GlobalCounter, User
+from app.presence import PresenceTracker, presence
+
+
+def init_data(telegram_id):
+    """Подписанные данные Telegram WebApp"""
+    params = {
+        "auth_date": str(int(time.time())),
+        "user": json.dumps({"id": telegram_id, "first_name": "Stats", "username": f"stats_{telegram_id}"}),
+    }
+    check_string = "\n".join(f"{key}={value}" for key, value in sorted(params.items()))
+    secret_key = hmac.new(b"WebAppData", BOT_TOKEN.encode(), hashlib.sha256).digest()
+    params["hash"] = hmac.new(secret_key, check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(params)
+
+
+async def register(client, telegram_id):
+    response = await client.post("/api/users/auth", json={"init_data": init_data(telegram_id)})
+    return response.json()["user"]["id"]
+
+
+async def fresh_stats(client):
+    """Статистика без закешированного значения"""
+    await cache.delete("stats:public")
+    return (await client.get("/api/stats")).json()
+
+
+async def test_counters(client):
+    """Тестирует счетчики регистраций и открытий кейсов"""
+    print("Testing counters...")
+
+    user_ids = [await register(client, telegram_id) for telegram_id in (7001, 7002, 7003)]
+    # Повторный вход не считается регистрацией
+    await register(client, 7001)
+
+    async with AsyncSessionLocal() as db:
+        case = (await db.scalars(select(Case).where(Case.active == True).limit(1))).first()
+        await db.execute(update(User).where(User.id == user_ids[0]).values(balance_stars=case.price_stars * 10))
+        await db.commit()
+
+    await client.post(f"/api/cases/{case.id}/open", json={"user_id": user_ids[0]})
+    await client.post(f"/api/cases/{case.id}/open-batch", json={"user_id": user_ids[0], "count": 4})
+
+    stats = await fresh_stats(client)
+    async with AsyncSessionLocal() as db:
+        users = await db.scalar(select(func.count(User.id)))
+        opened = await db.scalar(select(func.sum(User.total_cases_opened)))
+        active_cases = await db.scalar(select(func.count(Case.id)).where(Case.active == True))
+        shards = await db.scalar(select(func.count()).select_from(GlobalCounter))
+
+    ok = (
+        stats["total_users"] == users == 3
+        and stats["total_cases_opened"] == opened == 5
+        and stats["active_cases"] == active_cases
+    )
+
+    print(f"Stats: {stats}, counter rows: {shards}")
+    print("SUCCESS: counters match table aggregates" if ok else "ERROR: counters diverged")
+    return ok
+
+
+async def test_cached(client):
+    """Тестирует выдачу счетчиков из кеша"""
+    print("\nTesting cached stats...")
+
+    before = await fresh_stats(client)
+    await register(client, 7004)
+    cached = (await client.get("/api/stats")).json()
+
+    # Промах кеша читает через пул только для чтения и не сбрасывает буфер присутствия
+    statements = []
+    record = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    try:
+        refreshed = await fresh_stats(client)
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+    ok = (
+        cached["total_users"] == before["total_users"]
+        and refreshed["total_users"] == before["total_users"] + 1
+        and not statements
+    )
+
+    print(f"Cached: {cached['total_users']}, after expiry: {refreshed['total_users']}, writer statements: {len(statements)}")
+    print("SUCCESS: stats served from cache" if ok else "ERROR: unexpected cached stats")
+    return ok
+
+
+async def test_presence(client):
+    """Тестирует скользящее окно присутствия"""
+    print("\nTesting presence window...")
+
+    tracker = PresenceTracker(window=0.2)
+    tracker.touch(1)
+    tracker.touch(2)
+    tracker.touch(1)
+    online = tracker.online()
+    await asyncio.sleep(0.12)
+    tracker.touch(3)
+    await asyncio.sleep(0.12)
+    partial = tracker.online()
+    await asyncio.sleep(0.2)
+    expired = tracker.online()
+
+    # Пользователи, обращавшиеся к API в предыдущих тестах (после сброса буфера)
+    await presence.flush()
+    online_now = (await fresh_stats(client))["online_now"]
+
+    ok = online == 2 and partial == 1 and expired == 0 and online_now == 4
+
+    print(f"Online: {online}, after window: {partial}, expired: {expired}, API online_now: {online_now}")
+    print("SUCCESS: presence window slides" if ok else "ERROR: unexpected presence count")
+    return ok
+
+
+async def test_write_behind(client):
+    """Тестирует пакетную запись last_active и вход без записи профиля"""
+    print("\nTesting write-behind last_active...")
+
+    user_ids = [await register(client, telegram_id) for telegram_id in (7101, 7102)]
+    await presence.flush()
+    stale = datetime.utcnow() - timedelta(hours=1)
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(User).where(User.id.in_(user_ids)).values(last_active=stale))
+        await db.commit()
+
+    statements = []
+    record = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    try:
+        # Повторный вход с теми же данными и обращения к API - без записи в users
+        await register(client, 7101)
+        for _ in range(3):
+            await client.get(f"/api/users/{user_ids[0]}/balance")
+            await client.get(f"/api/users/{user_ids[1]}/profile")
+        login_writes = [statement for statement in statements if statement.lstrip().upper().startswith("UPDATE USERS")]
+        flushed = await presence.flush()
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+    async with AsyncSessionLocal() as db:
+        last_active = (await db.scalars(select(User.last_active).where(User.id.in_(user_ids)))).all()
+
+    ok = not login_writes and flushed == 2 and all(value > stale for value in last_active)
+
+    print(f"Writes before flush: {len(login_writes)}, flushed users: {flushed}, last_active: {last_active}")
+    print("SUCCESS: activity coalesced into one flush" if ok else "ERROR: unexpected last_active writes")
+    return ok
+
+
+async def test_global_online(client):
+    """Тестирует онлайн по last_active (активность других процессов)"""
+    print("\nTesting global online count...")
+
+    before = (await fresh_stats(client))["online_now"]
+    async with AsyncSessionLocal() as db:
+        # Пользователи, активные в другом воркере, и давно неактивный
+        db.add_all([
+            User(telegram_id=7201, last_active=datetime.utcnow()),
+            User(telegram_id=7202, last_active=datetime.utcnow()),
+            User(telegram_id=7203, last_active=datetime.utcnow() - timedelta(hours=1)),
+        ])
+        await db.commit()
+    after = (await fresh_stats(client))["online_now"]
+
+    ok = after == before + 2
+
+    print(f"Online before: {before}, after other workers' activity: {after}")
+    print("SUCCESS: online counted across processes" if ok else "ERROR: unexpected online count")
+    return ok
+
+
+async def test_metrics_access(client):
+    """Тестирует закрытие внутренних метрик без DEBUG"""
+    print("\nTesting metrics access...")
+
+    paths = ("/api/metrics", "/api/metrics/db")
+    debug, token = settings.debug, settings.metrics_token
+    try:
+        settings.debug, settings.metrics_token = False, ""
+        closed = [(await client.get(path)).status_code for path in paths]
+
+        settings.metrics_token = "metrics-test-token"
+        wrong = [(await client.get(path, headers={"X-Metrics-Token": "wrong"})).status_code for path in paths]
+        allowed = [
+            (await client.get(path, headers={"X-Metrics-Token": "metrics-test-token"})).status_code
+            for path in paths
+        ]
+
+        settings.debug, settings.metrics_token = True, ""
+        in_debug = [(await client.get(path)).status_code for path in paths]
+    finally:
+        settings.debug, settings.metrics_token = debug, token
+
+    ok = closed == [404, 404] and wrong == [404, 404] and allowed == [200, 200] and in_debug == [200, 200]
+
+    print(f"Closed: {closed}, wrong token: {wrong}, token: {allowed}, debug: {in_debug}")
+    print("SUCCESS: metrics gated" if ok else "ERROR: metrics exposed")
+    return ok
+
+
+async def main():
+    """Основная функция тестирования публичной статистики"""
+    print("=" * 50)
+    print("TESTING PUBLIC STATS")
+    print("=" * 50)
+
+    await init_db()
+    await load_test_data()
+    transport = httpx.ASGITransport(app=app)
+
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            results = [
+                await test_counters(client),
+                await test_cached(client),
+                await test_presence(client),
+                await test_write_behind(client),
+                await test_global_online(client),
+                await test_metrics_access(client),
+            ]
+    finally:
+        await close_db()
+
+    print(f"\nPublic stats tests completed: {sum(results)}/{len(results)} passed")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
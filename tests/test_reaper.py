@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Тесты очистки зависших депозитов
+
+Очистка работает с временной SQLite базой: отмена брошенных депозитов
+пачками, повторная проверка зависшего TON платежа (без дублей задач)
+и перевод в failed платежей, зависших дольше порога.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+DB_PATH = Path(tempfile.gettempdir()) / "crazygift_test_reaper.db"
+for suffix in ("", "-wal", "-shm"):
+    Path(f"{DB_PATH}{suffix}").unlink(missing_ok=True)
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("DEBUG", "false")
+os.environ["REAPER_BATCH_SIZE"] = "500"
+
+# Добавляем путь к backend
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+from sqlalchemy import func, insert, select
+
+from app.database import AsyncSessionLocal, init_db, close_db
+from app.models import Job, Transaction, User
+from app.reaper import TransactionReaper
+
+
+async def add_transactions(user_id, count, type_, status, age, external_id=None):
+    created_at = datetime.utcnow() - age
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(Transaction), [
+            {
+                "user_id": user_id, "type": type_, "amount": 1, "currency": "TON",
+                "status": status, "external_id": external_id, "created_at": created_at
+            }
+            for _ in range(count)
+        ])
+        await db.commit()
+
+
+async def statuses(type_):
+    async with AsyncSessionLocal() as db:
+        rows = await db.execute(
+            select(Transaction.status, func.count()).where(Transaction.type == type_).group_by(Transaction.status)
+        )
+        return dict(rows.all())
+
+
+async def test_bulk_expire(reaper, user_id):
+    """Тестирует отмену брошенных депозитов пачками"""
+    print("Testing bulk expiry of pending deposits...")
+
+    await add_transactions(user_id, 1200, "deposit_ton", "pending", timedelta(hours=2))
+    await add_transactions(user_id, 10, "deposit_ton", "pending", timedelta(minutes=5))
+    await add_transactions(user_id, 20, "deposit_stars", "pending", timedelta(hours=2))
+    await add_transactions(user_id, 5, "deposit_ton", "completed", timedelta(days=2))
+
+    report = await reaper.sweep()
+    ton, stars = await statuses("deposit_ton"), await statuses("deposit_stars")
+
+    ok = (
+        report["ton_pending"] == 1200 and report["stars_pending"] == 20
+        and ton == {"cancelled": 1200, "pending": 10, "completed": 5}
+        and stars == {"cancelled": 20}
+        and report["duration_ms"] > 0
+    )
+
+    print(f"Report: {report}")
+    print("SUCCESS: stale deposits cancelled" if ok else f"ERROR: unexpected statuses {ton}, {stars}")
+    return ok
+
+
+async def test_processing(reaper, user_id):
+    """Тестирует повторную проверку и failed для зависших платежей"""
+    print("\nTesting stuck processing payments...")
+
+    await add_transactions(user_id, 3, "deposit_ton", "processing", timedelta(minutes=30), external_id="hash_retry")
+    await add_transactions(user_id, 2, "deposit_ton", "processing", timedelta(hours=30), external_id="hash_old")
+
+    first = await reaper.sweep()
+    second = await reaper.sweep()
+
+    async with AsyncSessionLocal() as db:
+        jobs = await db.scalar(select(func.count(Job.id)).where(Job.kind == "payment.ton"))
+    ton = await statuses("deposit_ton")
+
+    ok = (
+        first["ton_processing_retried"] == 3 and second["ton_processing_retried"] == 0
+        and jobs == 3
+        and first["ton_processing"] == 2 and ton.get("processing") == 3 and ton.get("failed") == 2
+    )
+
+    print(f"Retried: {first['ton_processing_retried']} then {second['ton_processing_retried']}, jobs: {jobs}, statuses: {ton}")
+    print("SUCCESS: stuck payments retried once and failed after threshold" if ok else "ERROR: unexpected processing result")
+    return ok
+
+
+async def main():
+    """Основная функция тестирования очистки"""
+    print("=" * 50)
+    print("TESTING TRANSACTION REAPER")
+    print("=" * 50)
+
+    await init_db()
+    async with AsyncSessionLocal() as db:
+        user = User(telegram_id=9001, username="reaper", balance_stars=0)
+        db.add(user)
+        await db.commit()
+        user_id = user.id
+
+    reaper = TransactionReaper()
+
+    try:
+        results = [
+            await test_bulk_expire(reaper, user_id),
+            await test_processing(reaper, user_id),
+        ]
+    finally:
+        await close_db()
+
+    print(f"\nReaper tests completed: {sum(results)}/{len(results)} passed")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
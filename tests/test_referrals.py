@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Тесты итогов по рефералам, постраничного списка и дерева рефералов
+
+Запросы идут в приложение напрямую через ASGI транспорт httpx (без
+запущенного сервера) с временной SQLite базой. Итоги referral_stats после
+регистраций и первых открытий кейсов сравниваются с агрегатами по users.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from urllib.parse import urlencode
+
+DB_PATH = Path(tempfile.gettempdir()) / "crazygift_test_referrals.db"
+for suffix in ("", "-wal", "-shm"):
+    Path(f"{DB_PATH}{suffix}").unlink(missing_ok=True)
+
+BOT_TOKEN = "123456:referrals-test-token"
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ["TELEGRAM_BOT_TOKEN"] = BOT_TOKEN
+os.environ.setdefault("SECRET_KEY", "crazygift-test-secret-key")
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("DEBUG", "false")
+
+# Добавляем путь к backend
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+import httpx
+from sqlalchemy import delete, func, insert, select, update
+
+from app.config import settings
+from app.database import AsyncSessionLocal, init_db, close_db
+from app.fixtures import load_test_data
+from app.main import app
+from app.models import Case, ReferralStats, User
+from app.referrals import referral_rollup
+
+
+def init_data(telegram_id, start_param=None):
+    """Подписанные данные Telegram WebApp"""
+    params = {
+        "auth_date": str(int(time.time())),
+        "user": json.dumps({"id": telegram_id, "first_name": "Ref", "username": f"ref_{telegram_id}"}),
+    }
+    if start_param:
+        params["start_param"] = start_param
+    check_string = "\n".join(f"{key}={value}" for key, value in sorted(params.items()))
+    secret_key = hmac.new(b"WebAppData", BOT_TOKEN.encode(), hashlib.sha256).digest()
+    params["hash"] = hmac.new(secret_key, check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(params)
+
+
+async def register(client, telegram_id, referrer=None):
+    start_param = f"ref_{referrer['referral_code']}" if referrer else None
+    response = await client.post("/api/users/auth", json={"init_data": init_data(telegram_id, start_param)})
+    return response.json()["user"]
+
+
+async def expected_stats(user_id):
+    """Итоги по рефералам агрегатами по users"""
+    async with AsyncSessionLocal() as db:
+        referrals, active = (await db.execute(
+            select(func.count(User.id), func.count(User.id).filter(User.total_cases_opened > 0))
+            .where(User.referred_by == user_id)
+        )).first()
+    return {"total_referrals": referrals, "active_referrals": active}
+
+
+async def test_rollup(client, case_id):
+    """Тестирует итоги после регистраций и первых открытий кейсов"""
+    print("Testing referral rollup...")
+
+    referrer = await register(client, 4001)
+    referrals = [await register(client, telegram_id, referrer) for telegram_id in (4002, 4003, 4004)]
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(User).where(User.id.in_([ref["id"] for ref in referrals])).values(balance_stars=100000))
+        await db.commit()
+
+    # Два одиночных открытия одного реферала, пакетное - другого
+    await client.post(f"/api/cases/{case_id}/open", json={"user_id": referrals[0]["id"]})
+    await client.post(f"/api/cases/{case_id}/open", json={"user_id": referrals[0]["id"]})
+    await client.post(f"/api/cases/{case_id}/open-batch", json={"user_id": referrals[1]["id"], "count": 3})
+    await client.post(f"/api/cases/{case_id}/open", json={"user_id": referrals[1]["id"]})
+
+    listing = (await client.get(f"/api/users/{referrer['id']}/referrals")).json()
+    stats = (await client.get(f"/api/users/{referrer['id']}/stats")).json()
+    expected = await expected_stats(referrer["id"])
+
+    ok = (
+        expected == {"total_referrals": 3, "active_referrals": 2}
+        and listing["total_referrals"] == expected["total_referrals"]
+        and listing["active_referrals"] == expected["active_referrals"]
+        and stats["referrals_count"] == 3
+        and sum(ref["is_active"] for ref in listing["referrals"]) == 2
+    )
+
+    print(f"Rollup: {listing['total_referrals']}/{listing['active_referrals']}, expected: {expected}")
+    print("SUCCESS: rollup follows signups and first opens" if ok else "ERROR: rollup diverged")
+    return ok
+
+
+async def test_listing(client):
+    """Тестирует постраничный список рефералов"""
+    print("\nTesting paginated listing...")
+
+    referrer = await register(client, 4100)
+    start = datetime(2025, 1, 1)
+    async with AsyncSessionLocal() as db:
+        # Часть рефералов с одинаковым created_at - порядок добирается по id
+        await db.execute(insert(User), [
+            {"telegram_id": 410000 + index, "referred_by": referrer["id"], "balance_stars": 0,
+             "total_cases_opened": index % 4, "created_at": start + timedelta(minutes=index // 3)}
+            for index in range(120)
+        ])
+        await referral_rollup.rebuild(db, referrer["id"])
+        await db.commit()
+
+    pages, cursor = [], None
+    while True:
+        response = await client.get(
+            f"/api/users/{referrer['id']}/referrals", params={"limit": 50, **({"cursor": cursor} if cursor else {})}
+        )
+        body = response.json()
+        pages.append([ref["id"] for ref in body["referrals"]])
+        cursor = body["next_cursor"]
+        if not body["has_more"]:
+            break
+
+    async with AsyncSessionLocal() as db:
+        ordered = list((await db.scalars(
+            select(User.id).where(User.referred_by == referrer["id"]).order_by(User.created_at.desc(), User.id.desc())
+        )).all())
+
+    invalid = await client.get(f"/api/users/{referrer['id']}/referrals", params={"cursor": "broken"})
+    ids = [ref_id for page in pages for ref_id in page]
+    ok = (
+        [len(page) for page in pages] == [50, 50, 20]
+        and ids == ordered
+        and body["total_referrals"] == 120 and body["active_referrals"] == 90
+        and invalid.status_code == 400
+    )
+
+    print(f"Pages: {[len(page) for page in pages]}, totals: {body['total_referrals']}/{body['active_referrals']}")
+    print("SUCCESS: referrals paginated by cursor" if ok else "ERROR: unexpected pages")
+    return ok
+
+
+async def test_signup_order(client):
+    """Тестирует обход рефералов, зарегистрированных через API (created_at из server_default)"""
+    print("\nTesting listing of signed-up referrals...")
+
+    referrer = await register(client, 4300)
+    referral_ids = [(await register(client, 4301 + index, referrer))["id"] for index in range(10)]
+
+    ids, pages, cursor = [], 0, None
+    # Предел страниц: курсор, который не продвигается, не зациклит тест
+    while pages < 20:
+        body = (await client.get(
+            f"/api/users/{referrer['id']}/referrals", params={"limit": 3, **({"cursor": cursor} if cursor else {})}
+        )).json()
+        ids.extend(ref["id"] for ref in body["referrals"])
+        pages += 1
+        cursor = body["next_cursor"]
+        if not body["has_more"]:
+            break
+
+    ok = ids == sorted(referral_ids, reverse=True) and pages == 4
+
+    print(f"Pages: {pages}, referrals: {len(ids)}, unique: {len(set(ids))}")
+    print("SUCCESS: signed-up referrals listed once" if ok else "ERROR: cursor repeated referrals")
+    return ok
+
+
+async def test_tree(client):
+    """Тестирует дерево рефералов с ограничением глубины"""
+    print("\nTesting referral tree...")
+
+    root = await register(client, 4200)
+    level_1 = [await register(client, 4210 + index, root) for index in range(2)]
+    level_2 = [await register(client, 4220 + index, level_1[index % 2]) for index in range(4)]
+    level_3 = [await register(client, 4240 + index, level_2[0]) for index in range(3)]
+    await register(client, 4250, level_3[0])
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(User).where(User.id == level_2[1]["id"]).values(total_cases_opened=1))
+        await db.commit()
+
+    shallow = (await client.get(f"/api/users/{root['id']}/referrals/tree", params={"depth": 2})).json()
+    deep = (await client.get(f"/api/users/{root['id']}/referrals/tree", params={"depth": 99})).json()
+    missing = await client.get("/api/users/999999/referrals/tree")
+
+    ok = (
+        [(level["depth"], level["referrals"]) for level in shallow["levels"]] == [(1, 2), (2, 4)]
+        and shallow["levels"][1]["active_referrals"] == 1
+        and shallow["total_referrals"] == 6
+        and deep["depth"] == settings.referral_tree_max_depth
+        and [level["referrals"] for level in deep["levels"]] == [2, 4, 3, 1]
+        and missing.status_code == 404
+    )
+
+    print(f"Depth 2: {shallow['levels']}, depth {deep['depth']}: {[level['referrals'] for level in deep['levels']]}")
+    print("SUCCESS: tree levels counted" if ok else "ERROR: unexpected tree")
+    return ok
+
+
+async def test_rebuild(client):
+    """Тестирует пересчет итогов по users"""
+    print("\nTesting rebuild...")
+
+    async with AsyncSessionLocal() as db:
+        before = {row.user_id: (row.referrals, row.active_referrals) for row in (await db.scalars(select(ReferralStats))).all()}
+        await db.execute(delete(ReferralStats))
+        rows = await referral_rollup.rebuild(db)
+        await db.commit()
+        after = {row.user_id: (row.referrals, row.active_referrals) for row in (await db.scalars(select(ReferralStats))).all()}
+
+    # Активность, выставленная в обход открытия кейса, учитывается только пересчетом
+    changed = {user_id: value for user_id, value in after.items() if before.get(user_id) != value}
+    ok = rows == len(after) and len(changed) == 1
+
+    print(f"Rebuilt rows: {rows}, changed: {changed}")
+    print("SUCCESS: rollup rebuilt from users" if ok else "ERROR: rebuild differs")
+    return ok
+
+
+async def main():
+    """Основная функция тестирования рефералов"""
+    print("=" * 50)
+    print("TESTING REFERRALS")
+    print("=" * 50)
+
+    await init_db()
+    await load_test_data()
+    async with AsyncSessionLocal() as db:
+        case = (await db.scalars(select(Case).where(Case.active == True).limit(1))).first()
+    transport = httpx.ASGITransport(app=app)
+
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            results = [
+                await test_rollup(client, case.id),
+                await test_listing(client),
+                await test_signup_order(client),
+                await test_tree(client),
+                await test_rebuild(client),
+            ]
+    finally:
+        await close_db()
+
+    print(f"\nReferrals tests completed: {sum(results)}/{len(results)} passed")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
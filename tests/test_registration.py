@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Тесты регистрации пользователя одной транзакцией
+
+Запросы идут в приложение напрямую через ASGI транспорт httpx (без
+запущенного сервера) с временной SQLite базой: новый пользователь
+создается через INSERT ... ON CONFLICT, бонус реферера, транзакция
+referral_bonus и ReferralTransaction пишутся в той же транзакции,
+параллельные входы одного пользователя не создают дублей. Реферальные
+коды строятся из User.id и декодируются без запроса к БД, старые коды
+работают через таблицу алиасов.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import urlencode
+
+DB_PATH = Path(tempfile.gettempdir()) / "crazygift_test_registration.db"
+for suffix in ("", "-wal", "-shm"):
+    Path(f"{DB_PATH}{suffix}").unlink(missing_ok=True)
+
+BOT_TOKEN = "123456:registration-test-token"
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ["TELEGRAM_BOT_TOKEN"] = BOT_TOKEN
+os.environ.setdefault("SECRET_KEY", "crazygift-test-secret-key")
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("DEBUG", "false")
+
+# Добавляем путь к backend
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+import httpx
+from sqlalchemy import event, func, select
+
+from app.auth import decode_referral_code, generate_referral_code
+from app.config import settings
+from app.database import AsyncSessionLocal, engine, init_db, close_db
+from app.main import app
+from app.models import GlobalCounter, ReferralCodeAlias, ReferralTransaction, Transaction, User
+from app.registration import register_user
+
+
+def init_data(telegram_id, start_param=None):
+    """Подписанные данные Telegram WebApp"""
+    params = {
+        "auth_date": str(int(time.time())),
+        "user": json.dumps({"id": telegram_id, "first_name": "Reg", "username": f"reg_{telegram_id}"}),
+    }
+    if start_param:
+        params["start_param"] = start_param
+    check_string = "\n".join(f"{key}={value}" for key, value in sorted(params.items()))
+    secret_key = hmac.new(b"WebAppData", BOT_TOKEN.encode(), hashlib.sha256).digest()
+    params["hash"] = hmac.new(secret_key, check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(params)
+
+
+async def auth(client, telegram_id, start_param=None):
+    return await client.post("/api/users/auth", json={"init_data": init_data(telegram_id, start_param)})
+
+
+async def referral_state(referrer_id):
+    """Баланс реферера, бонусные транзакции и ReferralTransaction"""
+    async with AsyncSessionLocal() as db:
+        balance = await db.scalar(select(User.balance_stars).where(User.id == referrer_id))
+        bonuses = (await db.scalars(
+            select(Transaction).where(Transaction.user_id == referrer_id, Transaction.type == "referral_bonus")
+        )).all()
+        referrals = (await db.scalars(
+            select(ReferralTransaction).where(ReferralTransaction.referrer_id == referrer_id)
+        )).all()
+    return balance, bonuses, referrals
+
+
+async def test_referral_signup(client):
+    """Тестирует регистрацию по реферальному коду"""
+    print("Testing referral signup...")
+
+    referrer = (await auth(client, 6001)).json()["user"]
+
+    statements = []
+    record = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    try:
+        response = await auth(client, 6002, f"ref_{referrer['referral_code']}")
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+    user = response.json()["user"]
+    balance, bonuses, referrals = await referral_state(referrer["id"])
+    async with AsyncSessionLocal() as db:
+        referred_by = await db.scalar(select(User.referred_by).where(User.id == user["id"]))
+
+    inserts = [statement for statement in statements if statement.lstrip().upper().startswith("INSERT INTO USERS")]
+    ok = (
+        response.status_code == 200
+        and user["balance_stars"] == settings.welcome_bonus_stars
+        and referred_by == referrer["id"]
+        and balance == settings.welcome_bonus_stars + settings.referral_bonus_stars
+        and len(bonuses) == 1 and bonuses[0].status == "completed"
+        and len(referrals) == 1
+        and referrals[0].referred_id == user["id"]
+        and referrals[0].transaction_id == bonuses[0].id
+        and referrals[0].commission_amount == settings.referral_bonus_stars
+        and len(inserts) == 1 and "ON CONFLICT" in inserts[0].upper()
+    )
+
+    print(f"Referrer balance: {balance}, bonus transactions: {len(bonuses)}, referral rows: {len(referrals)}")
+    print("SUCCESS: signup and bonus written together" if ok else "ERROR: unexpected referral state")
+    return ok
+
+
+async def test_double_tap(client):
+    """Тестирует параллельные входы нового пользователя"""
+    print("\nTesting concurrent first logins...")
+
+    referrer = (await auth(client, 6003)).json()["user"]
+    responses = await asyncio.gather(*[
+        auth(client, 6004, f"ref_{referrer['referral_code']}") for _ in range(5)
+    ])
+
+    # Вход, проигравший гонку: SELECT не нашел пользователя, а INSERT уже конфликтует
+    async with AsyncSessionLocal() as db:
+        duplicate = await register_user(
+            db,
+            {"telegram_id": 6004, "username": "reg_6004", "first_name": "Reg", "last_name": None},
+            referrer["referral_code"]
+        )
+        await db.commit()
+
+    balance, bonuses, referrals = await referral_state(referrer["id"])
+    async with AsyncSessionLocal() as db:
+        users = await db.scalar(select(func.count(User.id)).where(User.telegram_id == 6004))
+        total_users = await db.scalar(select(func.count(User.id)))
+        counted = await db.scalar(select(func.sum(GlobalCounter.value)).where(GlobalCounter.name == "users"))
+
+    ok = (
+        all(response.status_code == 200 for response in responses)
+        and len({response.json()["user"]["id"] for response in responses}) == 1
+        and duplicate is None and users == 1 and counted == total_users
+        and balance == settings.welcome_bonus_stars + settings.referral_bonus_stars
+        and len(bonuses) == len(referrals) == 1
+    )
+
+    print(f"Statuses: {[response.status_code for response in responses]}, users: {users}, bonuses: {len(bonuses)}")
+    print("SUCCESS: one user and one bonus" if ok else "ERROR: duplicate registration effects")
+    return ok
+
+
+async def test_unknown_code(client):
+    """Тестирует регистрацию с несуществующим кодом и повторный вход"""
+    print("\nTesting unknown referral code...")
+
+    first = await auth(client, 6005, "ref_CG0000000")
+    again = await auth(client, 6005, "ref_CG0000000")
+
+    async with AsyncSessionLocal() as db:
+        user = await db.scalar(select(User).where(User.telegram_id == 6005))
+        referrals = await db.scalar(
+            select(func.count(ReferralTransaction.id)).where(ReferralTransaction.referred_id == user.id)
+        )
+
+    ok = (
+        first.status_code == again.status_code == 200
+        and first.json()["user"]["id"] == again.json()["user"]["id"]
+        and user.referred_by is None and referrals == 0
+        and user.balance_stars == settings.welcome_bonus_stars
+    )
+
+    print(f"Referred by: {user.referred_by}, referral rows: {referrals}, balance: {user.balance_stars}")
+    print("SUCCESS: no bonus for unknown code" if ok else "ERROR: unexpected registration")
+    return ok
+
+
+async def test_referral_codes(client):
+    """Тестирует коды из User.id: уникальность, декодирование, опечатки"""
+    print("\nTesting referral codes...")
+
+    codes = [generate_referral_code(user_id) for user_id in range(1, 100001)]
+    decoded = all(decode_referral_code(code) == user_id for user_id, code in enumerate(codes, 1))
+
+    code = generate_referral_code(123456)
+    typos = [code[:index] + symbol + code[index + 1:]
+             for index in range(3, len(code)) for symbol in "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+             if symbol != code[index]]
+    caught = sum(decode_referral_code(typo) is None for typo in typos)
+
+    user = (await auth(client, 6006)).json()["user"]
+    referred = (await auth(client, 6007, f"ref_{user['referral_code'].lower()}")).json()["user"]
+    async with AsyncSessionLocal() as db:
+        referred_by = await db.scalar(select(User.referred_by).where(User.id == referred["id"]))
+
+    ok = (
+        len(set(codes)) == len(codes) and decoded
+        and caught == len(typos)
+        and decode_referral_code("CG1234567") is None
+        and user["referral_code"] == generate_referral_code(user["id"])
+        and referred_by == user["id"]
+    )
+
+    print(f"Codes: {codes[0]}..{codes[-1]}, typos caught: {caught}/{len(typos)}, lowercase code referrer: {referred_by}")
+    print("SUCCESS: codes unique and decodable" if ok else "ERROR: unexpected referral codes")
+    return ok
+
+
+async def test_legacy_alias(client):
+    """Тестирует регистрацию по старому коду через алиас"""
+    print("\nTesting legacy referral code...")
+
+    legacy = (await auth(client, 6008)).json()["user"]
+    async with AsyncSessionLocal() as db:
+        db.add(ReferralCodeAlias(code="CG0060088", user_id=legacy["id"]))
+        await db.commit()
+
+    referred = (await auth(client, 6009, "ref_CG0060088")).json()["user"]
+    balance, bonuses, referrals = await referral_state(legacy["id"])
+    async with AsyncSessionLocal() as db:
+        referred_by = await db.scalar(select(User.referred_by).where(User.id == referred["id"]))
+
+    ok = referred_by == legacy["id"] and len(bonuses) == len(referrals) == 1
+
+    print(f"Legacy code referrer: {referred_by}, bonuses: {len(bonuses)}")
+    print("SUCCESS: legacy code resolved through alias" if ok else "ERROR: legacy code not resolved")
+    return ok
+
+
+async def main():
+    """Основная функция тестирования регистрации"""
+    print("=" * 50)
+    print("TESTING REGISTRATION")
+    print("=" * 50)
+
+    await init_db()
+    transport = httpx.ASGITransport(app=app)
+
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            results = [
+                await test_referral_signup(client),
+                await test_double_tap(client),
+                await test_unknown_code(client),
+                await test_referral_codes(client),
+                await test_legacy_alias(client),
+            ]
+    finally:
+        await close_db()
+
+    print(f"\nRegistration tests completed: {sum(results)}/{len(results)} passed")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
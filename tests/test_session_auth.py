@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Тесты токена сессии после проверки initData Telegram
+
+Запросы идут в приложение напрямую через ASGI транспорт httpx (без
+запущенного сервера) с временной SQLite базой: /users/auth выдает
+подписанный токен, /users/me проверяет его без записи в базу,
+поврежденные и истекшие токены отклоняются, с ключом по умолчанию
+токены не выдаются и приложение не стартует.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import urlencode
+
+DB_PATH = Path(tempfile.gettempdir()) / "crazygift_test_session_auth.db"
+for suffix in ("", "-wal", "-shm"):
+    Path(f"{DB_PATH}{suffix}").unlink(missing_ok=True)
+
+BOT_TOKEN = "123456:session-test-token"
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+os.environ["TELEGRAM_BOT_TOKEN"] = BOT_TOKEN
+os.environ.setdefault("SECRET_KEY", "crazygift-test-secret-key")
+os.environ.setdefault("TESTING", "1")
+os.environ.setdefault("DEBUG", "false")
+
+# Добавляем путь к backend
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+import httpx
+from jose import jwt
+from sqlalchemy import event
+
+from app.auth import webapp_secret_key
+from app.config import DEFAULT_SECRET_KEY, settings
+from app.database import engine, read_engine, init_db, close_db
+from app.main import app
+
+
+def init_data(telegram_id):
+    """Подписанные данные Telegram WebApp"""
+    params = {
+        "auth_date": str(int(time.time())),
+        "user": json.dumps({"id": telegram_id, "first_name": "Session", "username": f"session_{telegram_id}"}),
+    }
+    check_string = "\n".join(f"{key}={value}" for key, value in sorted(params.items()))
+    secret_key = hmac.new(b"WebAppData", BOT_TOKEN.encode(), hashlib.sha256).digest()
+    params["hash"] = hmac.new(secret_key, check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(params)
+
+
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+class StatementLog:
+    """Запоминает SQL, выполненный движком"""
+
+    def __init__(self):
+        self.statements = []
+
+    def __enter__(self):
+        for bind in {engine.sync_engine, read_engine.sync_engine}:
+            event.listen(bind, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc):
+        for bind in {engine.sync_engine, read_engine.sync_engine}:
+            event.remove(bind, "before_cursor_execute", self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def writes(self):
+        return [
+            statement for statement in self.statements
+            if statement.lstrip().split(" ", 1)[0].upper() in ("INSERT", "UPDATE", "DELETE")
+        ]
+
+
+async def test_secret_cached(client):
+    """Тестирует кеширование ключа проверки initData"""
+    print("Testing cached WebAppData key...")
+
+    webapp_secret_key.cache_clear()
+    for telegram_id in (8001, 8002, 8003):
+        await client.post("/api/users/auth", json={"init_data": init_data(telegram_id)})
+    info = webapp_secret_key.cache_info()
+
+    ok = info.misses == 1 and info.hits == 2
+
+    print(f"Key cache: {info}")
+    print("SUCCESS: key derived once" if ok else "ERROR: key derived on every request")
+    return ok
+
+
+async def test_token_issued(client):
+    """Тестирует выдачу токена и вход по нему без записи в БД"""
+    print("\nTesting session token...")
+
+    response = await client.post("/api/users/auth", json={"init_data": init_data(8004)})
+    body = response.json()
+
+    with StatementLog() as log:
+        me = await client.get("/api/users/me", headers=bearer(body["access_token"]))
+
+    ok = (
+        response.status_code == 200
+        and body["token_type"] == "bearer"
+        and body["expires_in"] == settings.access_token_expire_minutes * 60
+        and me.status_code == 200
+        and me.json()["id"] == body["user"]["id"]
+        and me.json()["telegram_id"] == 8004
+        and log.statements and not log.writes()
+    )
+
+    print(f"/me: {me.status_code}, statements: {len(log.statements)}, writes: {log.writes()}")
+    print("SUCCESS: session verified without writes" if ok else "ERROR: unexpected session result")
+    return ok
+
+
+async def test_rejected(client):
+    """Тестирует отклонение поврежденных, чужих и истекших токенов"""
+    print("\nTesting rejected tokens...")
+
+    body = (await client.post("/api/users/auth", json={"init_data": init_data(8005)})).json()
+    token = body["access_token"]
+    now = int(time.time())
+    claims = {"sub": str(body["user"]["id"]), "tg": 8005, "typ": "session", "iat": now - 120}
+
+    cases = {
+        "missing": {},
+        "not bearer": {"Authorization": token},
+        "tampered": bearer(token[:-2] + ("AA" if token[-2:] != "AA" else "BB")),
+        "foreign key": bearer(jwt.encode({**claims, "exp": now + 60}, "other-secret", algorithm=settings.algorithm)),
+        "expired": bearer(jwt.encode({**claims, "exp": now - 60}, settings.secret_key, algorithm=settings.algorithm)),
+        "wrong type": bearer(jwt.encode({**claims, "typ": "refresh", "exp": now + 60},
+                                        settings.secret_key, algorithm=settings.algorithm)),
+        "other user": bearer(jwt.encode({**claims, "tg": 9999, "exp": now + 60},
+                                        settings.secret_key, algorithm=settings.algorithm)),
+    }
+    statuses = {name: (await client.get("/api/users/me", headers=headers)).status_code for name, headers in cases.items()}
+
+    ok = all(code == 401 for code in statuses.values())
+
+    print(f"Statuses: {statuses}")
+    print("SUCCESS: invalid tokens rejected" if ok else "ERROR: invalid token accepted")
+    return ok
+
+
+async def test_default_secret(client):
+    """Тестирует отказ выдавать и принимать токены с ключом по умолчанию"""
+    print("\nTesting default secret key guard...")
+
+    now = int(time.time())
+    forged = jwt.encode(
+        {"sub": "1", "tg": 8006, "typ": "session", "iat": now, "exp": now + 60},
+        DEFAULT_SECRET_KEY, algorithm=settings.algorithm
+    )
+
+    configured = settings.secret_key
+    settings.secret_key = DEFAULT_SECRET_KEY
+    try:
+        issued = await client.post("/api/users/auth", json={"init_data": init_data(8006)})
+        accepted = await client.get("/api/users/me", headers=bearer(forged))
+        try:
+            async with app.router.lifespan_context(app):
+                started = True
+        except RuntimeError:
+            started = False
+    finally:
+        settings.secret_key = configured
+
+    ok = issued.status_code == 503 and "access_token" not in issued.json() and accepted.status_code == 503 and not started
+
+    print(f"Auth: {issued.status_code}, forged token: {accepted.status_code}, app started: {started}")
+    print("SUCCESS: default key refused" if ok else "ERROR: default key accepted")
+    return ok
+
+
+async def main():
+    """Основная функция тестирования токена сессии"""
+    print("=" * 50)
+    print("TESTING SESSION AUTH")
+    print("=" * 50)
+
+    await init_db()
+    transport = httpx.ASGITransport(app=app)
+
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            results = [
+                await test_secret_cached(client),
+                await test_token_issued(client),
+                await test_rejected(client),
+                await test_default_secret(client),
+            ]
+    finally:
+        await close_db()
+
+    print(f"\nSession auth tests completed: {sum(results)}/{len(results)} passed")
+    return all(results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
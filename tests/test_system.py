@@ -5,9 +5,12 @@
 
 import httpx
 import asyncio
+import os
 
 # Конфигурация
 API_BASE = "http://localhost:8000"
+# Без DEBUG метрики доступны только с токеном
+METRICS_HEADERS = {"X-Metrics-Token": os.environ["METRICS_TOKEN"]} if os.getenv("METRICS_TOKEN") else {}
 
 async def test_health_check():
     """Тестирует проверку состояния системы"""
@@ -85,6 +88,30 @@ async def test_public_stats():
         print(f"EXCEPTION: {str(e)}")
         return None
 
+async def test_metrics():
+    """Тестирует внутренние метрики процесса"""
+    print("\nTesting metrics...")
+    
+    try:
+        async with httpx.AsyncClient(timeout=10) as client:
+            response = await client.get(f"{API_BASE}/api/metrics", headers=METRICS_HEADERS)
+            
+            print(f"Status: {response.status_code}")
+            
+            if response.status_code == 200:
+                data = response.json()
+                sampler = data['sampler_cache']
+                print("SUCCESS: Metrics retrieved")
+                print(f"Sampler cache: {sampler['hits']} hits / {sampler['misses']} misses")
+                return data
+            else:
+                print(f"ERROR: {response.text}")
+                return None
+                
+    except Exception as e:
+        print(f"EXCEPTION: {str(e)}")
+        return None
+
 async def test_api_endpoints():
     """Тестирует доступность основных API эндпоинтов"""
     print("\nTesting API endpoints availability...")
@@ -249,6 +276,7 @@ async def main():
     
     # Дополнительные тесты
     await test_public_stats()
+    await test_metrics()
     await test_api_endpoints()
     await test_error_handling()
     await test_cors_headers()